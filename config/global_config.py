@@ -70,7 +70,71 @@ __C.POSTPROCESS = edict()
 
 # Set the post process connect components analysis min area threshold
 __C.POSTPROCESS.MIN_AREA_THRESHOLD = 100
+# Set the post process connect components analysis min area threshold of each data source
+__C.POSTPROCESS.MIN_AREA_THRESHOLDS = edict({'tusimple': 100, 'beec_ccd': 100})
+# Set the post process camera profile of every data source, the source image size, the source image rows
+# [SAMPLE_START_Y, SAMPLE_END_Y] the lanes are sampled in and the ipm generate file, None to use the ipm
+# generate file the postprocessor is built with
+__C.POSTPROCESS.CAMERA_PROFILES = edict({
+    'tusimple': {
+        'SRC_HEIGHT': 720,
+        'SRC_WIDTH': 1280,
+        'SAMPLE_START_Y': 240,
+        'SAMPLE_END_Y': 720,
+        'IPM_REMAP_FILE_PATH': None,
+    },
+    'beec_ccd': {
+        'SRC_HEIGHT': 1350,
+        'SRC_WIDTH': 2448,
+        'SAMPLE_START_Y': 820,
+        'SAMPLE_END_Y': 1350,
+        'IPM_REMAP_FILE_PATH': None,
+    },
+})
 # Set the post process dbscan search radius threshold
 __C.POSTPROCESS.DBSCAN_EPS = 0.35
 # Set the post process dbscan min samples threshold
 __C.POSTPROCESS.DBSCAN_MIN_SAMPLES = 1000
+# Set the post process embedding feats cluster method, support dbscan, meanshift and voxel_grid
+__C.POSTPROCESS.CLUSTER_METHOD = 'dbscan'
+# Set the post process cluster mode, pixel to cluster every lane pixel, component to cluster the mean
+# embedding feats of every connected component or subsample to cluster a subsample of the lane pixels
+__C.POSTPROCESS.CLUSTER_MODE = 'pixel'
+# Set the post process max standardized embedding feats std of a component or sub component clustered as a whole
+__C.POSTPROCESS.COMPONENT_MAX_FEATS_STD = 0.05
+# Set the post process image row nums of a band a mixed component is split into
+__C.POSTPROCESS.COMPONENT_SPLIT_BAND_HEIGHT = 8
+# Set the post process max lane pixel nums clustered by the subsample cluster mode
+__C.POSTPROCESS.CLUSTER_SAMPLE_BUDGET = 2000
+# Set the post process meanshift bandwidth
+__C.POSTPROCESS.MEANSHIFT_BANDWIDTH = 1.5
+# Set the post process voxel grid cell size in the standardized embedding space
+__C.POSTPROCESS.VOXEL_GRID_CELL_SIZE = 0.225
+# Set the post process voxel grid min samples of a core cell and its neighbour cells, only core cells are linked
+__C.POSTPROCESS.VOXEL_GRID_CORE_MIN_SAMPLES = 1000
+# Set the post process voxel grid min samples of a cluster
+__C.POSTPROCESS.VOXEL_GRID_MIN_SAMPLES = 1000
+# Set the post process lane fit method, support least_squares and ransac
+__C.POSTPROCESS.FIT_METHOD = 'least_squares'
+# Set the post process ransac lane fit polynomial nums tried for every lane
+__C.POSTPROCESS.FIT_RANSAC_ITERATIONS = 50
+# Set the post process ransac lane fit point nums every tried polynomial is scored on
+__C.POSTPROCESS.FIT_RANSAC_SAMPLE_NUMS = 500
+# Set the post process ransac lane fit max ipm image x distance of an inlier point
+__C.POSTPROCESS.FIT_RANSAC_INLIER_DIST = 15.0
+# Set the stream post process max raw embedding feats distance of a lane pixel assigned to a tracked lane
+__C.POSTPROCESS.TRACK_ASSIGN_MAX_DIST = 1.5
+# Set the stream post process max raw embedding feats distance of a cluster matched to a tracked lane
+__C.POSTPROCESS.TRACK_MATCH_MAX_DIST = 1.5
+# Set the stream post process min ratio of the pixels of a connected component assigned to a tracked lane
+__C.POSTPROCESS.TRACK_MIN_COMPONENT_RATIO = 0.1
+# Set the stream post process min association confidence before falling back to the embedding feats cluster
+__C.POSTPROCESS.TRACK_MIN_CONFIDENCE = 0.8
+# Set the stream post process max frame nums between two embedding feats clusters
+__C.POSTPROCESS.TRACK_MAX_SKIP_FRAMES = 30
+# Set the stream post process min pixel nums of a tracked lane in a frame
+__C.POSTPROCESS.TRACK_MIN_LANE_PIXELS = 200
+# Set the stream post process weight of the new frame when smoothing the tracked lane embedding center
+__C.POSTPROCESS.TRACK_CENTER_SMOOTH_FACTOR = 0.5
+# Set the stream post process weight of the new frame when smoothing the tracked lane fit params
+__C.POSTPROCESS.TRACK_FIT_SMOOTH_FACTOR = 0.5
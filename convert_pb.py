@@ -4,39 +4,165 @@
 #   Copyright (C) 2019 * Ltd. All rights reserved.
 #
 #   Editor      : VIM
-#   File name   : freeze_graph.py
+#   File name   : convert_pb.py
 #   Author      : YunYang1994
 #   Created date: 2019-03-20 15:57:33
-#   Description :
+#   Description : export a lanenet checkpoint as an inference optimized frozen graph and SavedModel
 #
 #================================================================
+"""
+Export a lanenet checkpoint for inference. The graph takes uint8 BGR images and has the named dense and sparse
+outputs of lanenet_predictor.build_inference_graph, lanenet_predictor.LaneNetPredictor imports the exported
+frozen graph or SavedModel directly instead of building the net and restoring the checkpoint
+"""
+import argparse
+import collections
+import os.path as ops
 
-
+import glog as log
 import tensorflow as tf
-from lanenet_model import lanenet
+from tensorflow.tools.graph_transforms import TransformGraph
 
+from lanenet_model import lanenet_predictor
 
-pb_file = "model/tusimple_lanenet_mobilenet_v2_1005/culane_lanenet_mobilenet_v2_1213.pb"
-#ckpt_file = cfg.YOLO.DEMO_WEIGHT
-ckpt_file = 'model/tusimple_lanenet_mobilenet_v2_1005/culane_lanenet_mobilenet_v2_1005_reduce_train.ckpt'
-# output_node_names = ["input/input_data", "pred_sbbox/concat_2", "pred_mbbox/concat_2", "pred_lbbox/concat_2"]
-#
-#output_node_names = ["input_tensor", "lanenet_loss/inference/decode/score_final/Conv2D", "lanenet_loss/pix_embedding_conv/Conv2D"]
-output_node_names = ["input_tensor", "lanenet_model/mobilenet_v2_backend/binary_seg/ArgMax","lanenet_model/mobilenet_v2_backend/instance_seg/pix_embedding_conv/Conv2D"]
+# strip the training only and the unused nodes, fold the constant subgraphs and fold the remaining batch norms
+# into the preceding convolutions
+GRAPH_TRANSFORMS = [
+    'strip_unused_nodes(type=uint8)',
+    'remove_nodes(op=Identity, op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'sort_by_execution_order'
+]
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights_path', type=str, required=True, help='The lanenet checkpoint path')
+    parser.add_argument('--net_flag', type=str, default='vgg', help='Backbone Network Tag')
+    parser.add_argument('--pb_file_path', type=str, default=None, help='The frozen graph .pb output path')
+    parser.add_argument('--saved_model_dir', type=str, default=None,
+                        help='The SavedModel output dir, it must not exist')
+    parser.add_argument('--no_slim', action='store_true',
+                        help='Export the standard inference graph instead of the slim one, see LaneNet')
+
+    return parser.parse_args()
+
+
+def _get_op_type_nums(graph_def):
+    """
+
+    :param graph_def:
+    :return:
+    """
+    return collections.Counter(node.op for node in graph_def.node)
+
+
+def freeze_lanenet(weights_path, net_flag='vgg', slim=True):
+    """
+    build the inference graph, restore the checkpoint into constants and optimize the graph for inference
+    :param weights_path:
+    :param net_flag:
+    :param slim:
+    :return: the optimized frozen GraphDef
+    """
+    with tf.Graph().as_default() as graph:
+        input_tensor, outputs = lanenet_predictor.build_inference_graph(net_flag=net_flag, slim=slim)
+        output_node_names = [tensor.op.name for tensor in outputs.values()]
+
+        with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+            tf.train.Saver().restore(sess=sess, save_path=weights_path)
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                sess=sess,
+                input_graph_def=graph.as_graph_def(),
+                output_node_names=output_node_names
+            )
+
+    frozen_node_nums = len(graph_def.node)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=output_node_names)
+    graph_def = TransformGraph(graph_def, [input_tensor.op.name], output_node_names, GRAPH_TRANSFORMS)
+
+    op_type_nums = _get_op_type_nums(graph_def)
+    log.info('Optimized the frozen graph from {:d} to {:d} nodes'.format(frozen_node_nums, len(graph_def.node)))
+    bn_nums = op_type_nums['FusedBatchNorm'] + op_type_nums['FusedBatchNormV3']
+    if bn_nums > 0:
+        log.warning('{:d} batch norms could not be folded'.format(bn_nums))
+
+    return graph_def
+
+
+def export_saved_model(graph_def, saved_model_dir):
+    """
+    export a frozen graph of lanenet_predictor.build_inference_graph as a SavedModel with a serving signature
+    of its named input and outputs
+    :param graph_def:
+    :param saved_model_dir:
+    :return:
+    """
+    if ops.exists(saved_model_dir):
+        raise ValueError('Wrong saved model dir: {:s}, it already exists'.format(saved_model_dir))
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        input_tensor = graph.get_tensor_by_name('{:s}:0'.format(lanenet_predictor.INPUT_TENSOR_KEY))
+        outputs = {
+            key: graph.get_tensor_by_name('{:s}/{:s}:0'.format(lanenet_predictor.OUTPUT_SCOPE, key))
+            for key in lanenet_predictor.DENSE_OUTPUT_KEYS + lanenet_predictor.SPARSE_OUTPUT_KEYS
+        }
+        signature = tf.saved_model.signature_def_utils.predict_signature_def(
+            inputs={lanenet_predictor.INPUT_TENSOR_KEY: input_tensor},
+            outputs=outputs
+        )
+
+        with tf.Session(graph=graph) as sess:
+            builder = tf.saved_model.builder.SavedModelBuilder(saved_model_dir)
+            builder.add_meta_graph_and_variables(
+                sess=sess,
+                tags=[tf.saved_model.tag_constants.SERVING],
+                signature_def_map={tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature},
+                strip_default_attrs=True
+            )
+            builder.save()
+
+
+def convert_lanenet(weights_path, net_flag='vgg', pb_file_path=None, saved_model_dir=None, slim=True):
+    """
+
+    :param weights_path:
+    :param net_flag:
+    :param pb_file_path:
+    :param saved_model_dir:
+    :param slim:
+    :return:
+    """
+    if pb_file_path is None and saved_model_dir is None:
+        raise ValueError('Wrong export settings, set the pb file path or the saved model dir')
 
-input_data = tf.placeholder(dtype=tf.float32, name='input_tensor', shape=[None,None,None,3])
-phase_tensor = tf.constant('false', tf.string)
-net = lanenet.LaneNet(phase=phase_tensor, net_flag='mobilenet_v2')
-model=net.inference(input_data,name='lanenet_model')
-#print(model.conv_sbbox, model.conv_mbbox, model.conv_lbbox)
+    graph_def = freeze_lanenet(weights_path=weights_path, net_flag=net_flag, slim=slim)
+    if pb_file_path is not None:
+        with tf.gfile.GFile(pb_file_path, 'wb') as file:
+            file.write(graph_def.SerializeToString())
+        log.info('Frozen graph saved to {:s}'.format(pb_file_path))
+    if saved_model_dir is not None:
+        export_saved_model(graph_def, saved_model_dir)
+        log.info('SavedModel saved to {:s}'.format(saved_model_dir))
 
-sess  = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
-saver = tf.train.Saver()
-saver.restore(sess, ckpt_file)
 
-converted_graph_def = tf.graph_util.convert_variables_to_constants(sess,
-                            input_graph_def  = sess.graph.as_graph_def(),
-                            output_node_names = output_node_names)
+if __name__ == '__main__':
+    """
+    export lanenet
+    """
+    args = init_args()
 
-with tf.gfile.GFile(pb_file, "wb") as f:
-    f.write(converted_graph_def.SerializeToString())
\ No newline at end of file
+    convert_lanenet(
+        weights_path=args.weights_path,
+        net_flag=args.net_flag,
+        pb_file_path=args.pb_file_path,
+        saved_model_dir=args.saved_model_dir,
+        slim=not args.no_slim
+    )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : convert_tflite.py
+# @IDE: PyCharm
+"""
+Export a lanenet checkpoint as a TFLite model for cpu inference, optionally with float16 or post training int8
+quantization calibrated on the images of a dataset list. The model has a fixed batch size of 1, takes uint8
+BGR images and has the dense outputs of lanenet_predictor.build_inference_graph, see
+lanenet_predictor.LaneNetTFLitePredictor
+"""
+import argparse
+import os.path as ops
+
+import glog as log
+import numpy as np
+import tensorflow as tf
+
+from data_provider import lanenet_data_processor
+from lanenet_model import lanenet_predictor
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights_path', type=str, required=True, help='The lanenet checkpoint path')
+    parser.add_argument('--net_flag', type=str, default='mobilenet_v2', help='Backbone Network Tag')
+    parser.add_argument('--tflite_file_path', type=str, required=True, help='The tflite model output path')
+    parser.add_argument('--quantization', type=str, default='int8',
+                        help='The quantization mode, float32, float16, int8 which keeps the ops without an int8 '
+                             'kernel in float, or int8_full which fails on them')
+    parser.add_argument('--calibration_list', type=str, default='./data/training_data_example/train.txt',
+                        help='The image list of the int8 calibration images, the train.txt / val.txt format')
+    parser.add_argument('--calibration_nums', type=int, default=100, help='The int8 calibration image nums')
+    parser.add_argument('--no_slim', action='store_true',
+                        help='Export the standard inference graph instead of the slim one, see LaneNet')
+
+    return parser.parse_args()
+
+
+def _get_representative_dataset(calibration_list, calibration_nums):
+    """
+    representative dataset of randomly sampled images of the calibration list
+    :param calibration_list:
+    :param calibration_nums:
+    :return:
+    """
+    assert ops.exists(calibration_list), '{:s} not exist'.format(calibration_list)
+    dataset = lanenet_data_processor.DataSet(calibration_list, traing=True)
+    calibration_nums = min(calibration_nums, dataset._dataset_size)
+    log.info('Calibrate the int8 quantization on {:d} images of {:s}'.format(calibration_nums, calibration_list))
+
+    def _representative_dataset_gen():
+        for _ in range(calibration_nums):
+            gt_imgs, _, _ = dataset.next_batch(1)
+            yield [np.asarray(gt_imgs, dtype=np.uint8)]
+
+    return tf.lite.RepresentativeDataset(_representative_dataset_gen)
+
+
+def convert_lanenet_tflite(weights_path, net_flag='mobilenet_v2', quantization='int8', calibration_list=None,
+                           calibration_nums=100, slim=True):
+    """
+
+    :param weights_path:
+    :param net_flag:
+    :param quantization: float32, float16, int8 or int8_full
+    :param calibration_list: needed by the int8 quantizations
+    :param calibration_nums:
+    :param slim:
+    :return: the serialized tflite model
+    """
+    if quantization not in ('float32', 'float16', 'int8', 'int8_full'):
+        raise ValueError('Wrong quantization: {}, now only support float32, float16, int8 and int8_full'.format(
+            quantization))
+
+    with tf.Graph().as_default():
+        input_tensor, outputs = lanenet_predictor.build_inference_graph(net_flag=net_flag, slim=slim, batch_size=1)
+        output_tensors = [outputs[key] for key in lanenet_predictor.DENSE_OUTPUT_KEYS]
+
+        with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+            tf.train.Saver().restore(sess=sess, save_path=weights_path)
+            converter = tf.lite.TFLiteConverter.from_session(sess, [input_tensor], output_tensors)
+            if quantization == 'float16':
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
+            elif quantization in ('int8', 'int8_full'):
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = _get_representative_dataset(calibration_list, calibration_nums)
+                if quantization == 'int8_full':
+                    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+            return converter.convert()
+
+
+if __name__ == '__main__':
+    """
+    export lanenet tflite model
+    """
+    args = init_args()
+
+    tflite_model = convert_lanenet_tflite(
+        weights_path=args.weights_path,
+        net_flag=args.net_flag,
+        quantization=args.quantization,
+        calibration_list=args.calibration_list,
+        calibration_nums=args.calibration_nums,
+        slim=not args.no_slim
+    )
+    with open(args.tflite_file_path, 'wb') as file:
+        file.write(tflite_model)
+    log.info('{:s} tflite model of {:d} bytes saved to {:s}'.format(
+        args.quantization, len(tflite_model), args.tflite_file_path))
@@ -23,33 +23,61 @@ class LaneNet(cnn_basenet.CNNBaseModel):
 
     """
 
-    def __init__(self, phase, net_flag='vgg', reuse=False):
+    def __init__(self, phase, net_flag='vgg', reuse=False, slim=False):
         """
 
+        :param phase:
+        :param net_flag:
+        :param reuse:
+        :param slim: build the inference optimized net which folds the batch norms into the preceding
+        convolutions and returns a uint8 binary mask, it restores from the same checkpoint but can not be trained
         """
         super(LaneNet, self).__init__()
         self._net_flag = net_flag
         self._reuse = reuse
+        self._slim = slim
         if net_flag == 'mobilenet_v2':
             self._need_layer_norm = False
         else:
             self._need_layer_norm = True
 
         self._frontend = lanenet_front_end.LaneNetFrondEnd(
-            phase=phase, net_flag=net_flag
+            phase=phase, net_flag=net_flag, fold_bn=slim
         )
         self._backend = lanenet_back_end.LaneNetBackEnd(
             phase=phase
         )
 
+    def _normalize_input(self, input_tensor):
+        """
+        normalize a uint8 BGR input tensor like the backbone was trained in graph, so the callers feed the raw
+        image bytes. Float input tensors are expected to be normalized already and are returned unchanged
+        :param input_tensor: [batch, height, width, 3] uint8 or normalized float32 tensor
+        :return:
+        """
+        if input_tensor.dtype != tf.uint8:
+            return input_tensor
+
+        with tf.name_scope('input_normalization'):
+            input_tensor = tf.cast(input_tensor, tf.float32)
+            if self._net_flag == 'vgg':
+                input_tensor = tf.subtract(tf.divide(input_tensor, 127.5), 1.0)
+            elif self._net_flag == 'mobilenet_v2':
+                input_tensor = tf.subtract(input_tensor, tf.constant([103.939, 116.779, 123.68], dtype=tf.float32))
+            else:
+                raise ValueError('Wrong net flag: {}, now only support vgg and mobilenet_v2'.format(self._net_flag))
+
+        return input_tensor
+
     def inference(self, input_tensor, name):
         """
 
-        :param input_tensor:
+        :param input_tensor: uint8 BGR images or images normalized like the backbone was trained
         :param name:
         :return:
         """
         with tf.variable_scope(name_or_scope=name, reuse=self._reuse):
+            input_tensor = self._normalize_input(input_tensor)
             # first extract image features
             extract_feats_result = self._frontend.build_model(
                 input_tensor=input_tensor,
@@ -58,7 +86,8 @@ class LaneNet(cnn_basenet.CNNBaseModel):
             )
 
             # # second apply backend process
-            binary_seg_prediction, instance_seg_prediction = self._backend.inference(
+            backend_inference = self._backend.inference_slim if self._slim else self._backend.inference
+            binary_seg_prediction, instance_seg_prediction = backend_inference(
                 binary_seg_logits=extract_feats_result['binary_segment_logits']['data'],
                 instance_seg_logits=extract_feats_result['instance_segment_logits']['data'],
                 name='{:s}_backend'.format(self._net_flag),
@@ -71,6 +100,59 @@ class LaneNet(cnn_basenet.CNNBaseModel):
 
         return binary_seg_prediction, instance_seg_prediction
 
+    def inference_sparse(self, input_tensor, name, morph_kernel_size=5):
+        """
+        inference and gather the embedding feats of the foreground pixels in graph so only a uint8 mask and
+        the foreground feats are fetched instead of the dense int64 binary and float instance results
+        :param input_tensor:
+        :param name:
+        :param morph_kernel_size: kernel size of the postprocess morphological closing
+        :return: see gather_foreground
+        """
+        binary_seg_prediction, instance_seg_prediction = self.inference(input_tensor=input_tensor, name=name)
+
+        return self.gather_foreground(
+            binary_seg_prediction=binary_seg_prediction,
+            instance_seg_prediction=instance_seg_prediction,
+            name='{:s}_sparse_gather'.format(name),
+            morph_kernel_size=morph_kernel_size
+        )
+
+    @staticmethod
+    def gather_foreground(binary_seg_prediction, instance_seg_prediction, name, morph_kernel_size=5):
+        """
+        gather the embedding feats of the foreground pixels of the inference results. The postprocess
+        morphological closing only fills pixels within its kernel around the foreground, so the feats are
+        gathered over the foreground dilated by the same kernel size
+        :param binary_seg_prediction:
+        :param instance_seg_prediction:
+        :param name:
+        :param morph_kernel_size: kernel size of the postprocess morphological closing
+        :return: dict of binary_seg_mask uint8 [batch, height, width], foreground_coords int32 [nums, 3] of the
+        [batch_index, y, x] of the gathered pixels in row major order and foreground_embedding_feats
+        [nums, dims]
+        """
+        with tf.name_scope(name):
+            binary_seg_mask = tf.cast(binary_seg_prediction, tf.uint8, name='binary_seg_mask')
+            foreground = tf.nn.max_pool(
+                tf.expand_dims(tf.cast(binary_seg_prediction, tf.float32), axis=-1),
+                ksize=[1, morph_kernel_size, morph_kernel_size, 1],
+                strides=[1, 1, 1, 1],
+                padding='SAME'
+            )
+            foreground_coords = tf.where(tf.greater(tf.squeeze(foreground, axis=-1), 0.0))
+            foreground_embedding_feats = tf.gather_nd(
+                instance_seg_prediction, foreground_coords, name='foreground_embedding_feats')
+            foreground_coords = tf.cast(foreground_coords, tf.int32, name='foreground_coords')
+
+        ret = {
+            'binary_seg_mask': binary_seg_mask,
+            'foreground_coords': foreground_coords,
+            'foreground_embedding_feats': foreground_embedding_feats
+        }
+
+        return ret
+
     def compute_loss(self, input_tensor, binary_label, instance_label, name):
         """
         calculate lanenet loss for training
@@ -106,6 +188,7 @@ class LaneNet(cnn_basenet.CNNBaseModel):
 
     def compute_acc(self, input_tensor, binary_label_tensor, name):
         with tf.variable_scope(name_or_scope=name, reuse=self._reuse):
+            input_tensor = self._normalize_input(input_tensor)
             # first extract image features
             extract_feats_result = self._frontend.build_model(
                 input_tensor=input_tensor,
@@ -187,6 +187,37 @@ class LaneNetBackEnd(cnn_basenet.CNNBaseModel):
 
         return binary_seg_prediction, instance_seg_prediction
 
+    def inference_slim(self, binary_seg_logits, instance_seg_logits, name, reuse, need_layer_norm):
+        """
+        inference time variant of inference restored from the same checkpoint. The binary mask is the uint8
+        argmax of the raw logits since the softmax does not change it and the pix_bn is applied as one scale
+        and offset, it follows the fused decode feats so there is no convolution to fold it into
+        :param binary_seg_logits:
+        :param instance_seg_logits:
+        :param name:
+        :param reuse:
+        :param need_layer_norm:
+        :return:
+        """
+        with tf.variable_scope(name_or_scope=name, reuse=reuse):
+            with tf.variable_scope(name_or_scope='binary_seg'):
+                binary_seg_prediction = tf.cast(
+                    tf.argmax(binary_seg_logits, axis=-1), tf.uint8, name='binary_seg_prediction')
+
+            with tf.variable_scope(name_or_scope='instance_seg'):
+                if need_layer_norm:
+                    instance_seg_logits = self.layerbn_affine(inputdata=instance_seg_logits, name='pix_bn')
+                pix_relu = self.relu(inputdata=instance_seg_logits, name='pix_relu')
+                instance_seg_prediction = self.conv2d(
+                    inputdata=pix_relu,
+                    out_channel=CFG.TRAIN.EMBEDDING_FEATS_DIMS,
+                    kernel_size=1,
+                    use_bias=False,
+                    name='pix_embedding_conv'
+                )
+
+        return binary_seg_prediction, instance_seg_prediction
+
 
 if __name__ == '__main__':
     backend = LaneNetBackEnd(phase='train')
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : lanenet_batcher.py
+# @IDE: PyCharm
+"""
+Dynamic request batcher for serving lanenet
+"""
+import collections
+import queue
+import threading
+import time
+
+import glog as log
+
+
+class BatcherFullError(Exception):
+    """
+    Raised by DynamicBatcher.submit when the pending request queue is full
+    """
+    pass
+
+
+class BatcherStoppedError(Exception):
+    """
+    Raised by DynamicBatcher.submit when the batcher is not running and by BatchRequest.result of the requests
+    still pending when the batcher is stopped
+    """
+    pass
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when a request is not processed before its deadline
+    """
+    pass
+
+
+class BatchRequest(object):
+    """
+    A request submitted to DynamicBatcher, wait for its result with result
+    """
+    def __init__(self, item, deadline=None):
+        """
+
+        :param item: the input item of process_fn
+        :param deadline: time.perf_counter deadline of the request, None for no deadline
+        """
+        self.item = item
+        self.deadline = deadline
+        self._done_event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def is_expired(self, now=None):
+        """
+
+        :param now:
+        :return:
+        """
+        if self.deadline is None:
+            return False
+        now = time.perf_counter() if now is None else now
+
+        return now >= self.deadline
+
+    def set_result(self, result):
+        """
+
+        :param result:
+        :return:
+        """
+        self._result = result
+        self._done_event.set()
+
+    def set_error(self, error):
+        """
+
+        :param error:
+        :return:
+        """
+        self._error = error
+        self._done_event.set()
+
+    def result(self):
+        """
+        block until the request is processed or its deadline passes
+        :return: the process_fn result of the item
+        """
+        timeout = None if self.deadline is None else max(self.deadline - time.perf_counter(), 0.0)
+        if not self._done_event.wait(timeout):
+            raise DeadlineExceededError('Request deadline exceeded before it was processed')
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+
+class DynamicBatcher(object):
+    """
+    Gather the requests submitted by concurrent callers into batches and run them through process_fn in one
+    background thread. A batch is run when it reaches max_batch_size or max_wait_time after its first request
+    arrived, whichever comes first. The pending queue is bounded so overload is rejected at submit instead of
+    growing the latency of every request, and requests whose deadline passed while queued are dropped before
+    they cost an inference
+    """
+    def __init__(self, process_fn, max_batch_size=8, max_wait_time=0.005, max_queue_size=64):
+        """
+
+        :param process_fn: process_fn(items) returns the list of results of a list of items in order
+        :param max_batch_size: max request nums of a batch
+        :param max_wait_time: max seconds to wait for more requests after the first request of a batch
+        :param max_queue_size: max pending request nums
+        """
+        if max_batch_size < 1 or max_queue_size < 1 or max_wait_time < 0:
+            raise ValueError('Wrong batcher settings, batch size and queue size must be positive and wait time '
+                             'not negative')
+        self._process_fn = process_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait_time = max_wait_time
+        self._max_queue_size = max_queue_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        # held by submit from the running check until the request is queued and by start and stop, so no
+        # request is queued after stop drained the queue
+        self._submit_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = collections.OrderedDict(
+            [('request_nums', 0), ('rejected_nums', 0), ('expired_nums', 0), ('failed_nums', 0),
+             ('batch_nums', 0), ('batched_request_nums', 0), ('busy_time', 0.0)])
+
+    def _add_stats(self, **kwargs):
+        """
+
+        :param kwargs:
+        :return:
+        """
+        with self._stats_lock:
+            for key, value in kwargs.items():
+                self._stats[key] += value
+
+    def start(self):
+        """
+
+        :return:
+        """
+        with self._submit_lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        stop the batching thread, the batch being processed is finished and the requests still pending get a
+        BatcherStoppedError
+        :return:
+        """
+        with self._submit_lock:
+            self._stop_event.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                request.set_error(BatcherStoppedError('Batcher stopped before the request was processed'))
+
+    def submit(self, item, timeout=None):
+        """
+        queue an item without blocking
+        :param item:
+        :param timeout: seconds from now until the request deadline, None for no deadline
+        :return: BatchRequest of the item
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        request = BatchRequest(item, deadline)
+        with self._submit_lock:
+            if self._stop_event.is_set() or self._thread is None:
+                raise BatcherStoppedError('Batcher is not running')
+            try:
+                self._queue.put_nowait(request)
+            except queue.Full:
+                self._add_stats(rejected_nums=1)
+                raise BatcherFullError('Batcher queue is full with {:d} pending requests'.format(
+                    self._max_queue_size))
+        self._add_stats(request_nums=1)
+
+        return request
+
+    def _gather_batch(self):
+        """
+        block until the first request and gather more until the batch is full or max_wait_time has passed
+        :return:
+        """
+        while True:
+            if self._stop_event.is_set():
+                return []
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+                break
+            except queue.Empty:
+                continue
+
+        batch_deadline = time.perf_counter() + self._max_wait_time
+        while len(batch) < self._max_batch_size:
+            remaining = batch_deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """
+
+        :return:
+        """
+        while not self._stop_event.is_set():
+            batch = self._gather_batch()
+            now = time.perf_counter()
+            live_batch = []
+            for request in batch:
+                if request.is_expired(now):
+                    request.set_error(DeadlineExceededError('Request deadline exceeded while queued'))
+                else:
+                    live_batch.append(request)
+            self._add_stats(expired_nums=len(batch) - len(live_batch))
+            if not live_batch:
+                continue
+
+            t_start = time.perf_counter()
+            try:
+                results = self._process_fn([request.item for request in live_batch])
+                if len(results) != len(live_batch):
+                    raise ValueError('Wrong process result nums: {:d}, expect {:d}'.format(
+                        len(results), len(live_batch)))
+            except Exception as err:
+                log.error('Batch of {:d} requests failed: {}'.format(len(live_batch), err))
+                for request in live_batch:
+                    request.set_error(err)
+                self._add_stats(failed_nums=len(live_batch))
+            else:
+                for request, result in zip(live_batch, results):
+                    request.set_result(result)
+            self._add_stats(batch_nums=1, batched_request_nums=len(live_batch),
+                            busy_time=time.perf_counter() - t_start)
+
+    def get_stats(self):
+        """
+
+        :return: request counters, the mean batch size and the pending request nums
+        """
+        with self._stats_lock:
+            ret = collections.OrderedDict(self._stats)
+        ret['mean_batch_size'] = ret['batched_request_nums'] / ret['batch_nums'] if ret['batch_nums'] else 0.0
+        ret['pending_nums'] = self._queue.qsize()
+        ret['max_batch_size'] = self._max_batch_size
+        ret['max_queue_size'] = self._max_queue_size
+
+        return ret
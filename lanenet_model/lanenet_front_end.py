@@ -17,15 +17,18 @@ class LaneNetFrondEnd(cnn_basenet.CNNBaseModel):
     """
     LaneNet frontend which is used to extract image features for following process
     """
-    def __init__(self, phase, net_flag):
+    def __init__(self, phase, net_flag, fold_bn=False):
         """
 
+        :param phase:
+        :param net_flag:
+        :param fold_bn: fold the layerbn into the preceding convolution for inference only
         """
         super(LaneNetFrondEnd, self).__init__()
 
         self._frontend_net_map = {
-            'vgg': vgg16_based_fcn.VGG16FCN(phase=phase),
-            'mobilenet_v2': mobilenet_v2_based_fcn.MOBILEV2FCN(phase=phase)
+            'vgg': vgg16_based_fcn.VGG16FCN(phase=phase, fold_bn=fold_bn),
+            'mobilenet_v2': mobilenet_v2_based_fcn.MOBILEV2FCN(phase=phase, fold_bn=fold_bn)
         }
 
         self._net = self._frontend_net_map[net_flag]
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : lanenet_pipeline.py
+# @IDE: PyCharm
+"""
+Pipelined three stage lanenet inference engine
+"""
+import collections
+import queue
+import threading
+import time
+
+import glog as log
+import numpy as np
+
+_END_OF_STREAM = object()
+
+
+class _PipelineStopped(Exception):
+    """
+    Raised in the stage threads when the pipeline is stopped by the failure of another stage
+    """
+    pass
+
+
+class _StageQueue(object):
+    """
+    Bounded queue between two pipeline stages which records its occupancy
+    """
+    def __init__(self, name, capacity, stop_event):
+        """
+
+        :param name:
+        :param capacity: max item nums in the queue
+        :param stop_event: pipeline stop event
+        """
+        self.name = name
+        self.capacity = capacity
+        self._queue = queue.Queue(maxsize=capacity)
+        self._stop_event = stop_event
+        self._occupancy_samples = []
+
+    def put(self, item):
+        """
+        block until there is room for the item or the pipeline is stopped
+        :param item:
+        :return:
+        """
+        while True:
+            if self._stop_event.is_set():
+                raise _PipelineStopped()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self):
+        """
+        block until there is an item or the pipeline is stopped
+        :return:
+        """
+        while True:
+            if self._stop_event.is_set():
+                raise _PipelineStopped()
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def sample_occupancy(self):
+        """
+
+        :return:
+        """
+        self._occupancy_samples.append(self._queue.qsize())
+
+    def get_stats(self):
+        """
+        a queue mostly full means the stage after it is the bottleneck, a queue mostly empty means the stage
+        before it is
+        :return:
+        """
+        samples = np.array(self._occupancy_samples, dtype=np.float64)
+        if samples.size == 0:
+            samples = np.zeros(shape=[1], dtype=np.float64)
+
+        ret = collections.OrderedDict()
+        ret['capacity'] = self.capacity
+        ret['mean_occupancy'] = float(np.mean(samples))
+        ret['max_occupancy'] = int(np.max(samples))
+        ret['full_ratio'] = float(np.mean(samples >= self.capacity))
+        ret['empty_ratio'] = float(np.mean(samples == 0))
+
+        return ret
+
+
+class LaneNetPipeline(object):
+    """
+    Run the frames through a decode stage, an inference stage and a postprocess stage connected by bounded
+    queues, so every stage works on other frames at the same time instead of waiting for the others. The
+    decode and postprocess stages are thread pools, the single inference thread assembles full batches of
+    decoded frames. cv2, numpy and tensorflow release the GIL in their heavy calls
+    """
+    def __init__(self, decode_fn, inference_fn, postprocess_fn, batch_size=8, decode_workers=4,
+                 postprocess_workers=2, queue_size=None, stats_interval=0.05):
+        """
+
+        :param decode_fn: decode_fn(item) reads and preprocesses the frame of an input item, None to skip it.
+        Called from decode_workers threads at the same time
+        :param inference_fn: inference_fn(decoded_frames) runs the net on a list of decoded frames and returns
+        the inference result of the batch. Called from one thread with full batches except the last one
+        :param postprocess_fn: postprocess_fn(items, decoded_frames, inference_result) postprocesses and
+        writes out a batch. Called from postprocess_workers threads at the same time
+        :param batch_size: frame nums of an inference batch
+        :param decode_workers: decode thread nums
+        :param postprocess_workers: postprocess thread nums
+        :param queue_size: capacity of the decoded frame queue in frames, default twice the batch size. The
+        input queue holds twice the decode thread nums and the inference result queue one batch per
+        postprocess thread
+        :param stats_interval: queue occupancy sampling interval in seconds
+        """
+        if batch_size < 1 or decode_workers < 1 or postprocess_workers < 1:
+            raise ValueError('Wrong pipeline settings, batch size and worker nums must be positive')
+        self._decode_fn = decode_fn
+        self._inference_fn = inference_fn
+        self._postprocess_fn = postprocess_fn
+        self._batch_size = batch_size
+        self._decode_workers = decode_workers
+        self._postprocess_workers = postprocess_workers
+        self._queue_size = queue_size if queue_size is not None else 2 * batch_size
+        self._stats_interval = stats_interval
+
+    def run(self, items):
+        """
+        run every input item through the pipeline, blocks until all of them are postprocessed. The first
+        exception raised by a stage stops the pipeline and is raised again here
+        :param items: iterable of input items, for example image paths
+        :return: pipeline stats, see log_pipeline_stats
+        """
+        stop_event = threading.Event()
+        input_queue = _StageQueue('input', 2 * self._decode_workers, stop_event)
+        decoded_queue = _StageQueue('decoded', self._queue_size, stop_event)
+        inference_queue = _StageQueue('inference', self._postprocess_workers, stop_event)
+        stage_queues = [input_queue, decoded_queue, inference_queue]
+
+        lock = threading.Lock()
+        errors = []
+        stage_stats = collections.OrderedDict()
+        for stage_name, worker_nums in [('decode', self._decode_workers), ('inference', 1),
+                                        ('postprocess', self._postprocess_workers)]:
+            stage_stats[stage_name] = collections.OrderedDict(
+                [('workers', worker_nums), ('busy_time', 0.0), ('frame_nums', 0)])
+        stage_stats['inference']['batch_nums'] = 0
+        stage_stats['decode']['skipped_frame_nums'] = 0
+
+        def _add_stage_stats(stage_name, busy_time, frame_nums, **kwargs):
+            with lock:
+                stage_stats[stage_name]['busy_time'] += busy_time
+                stage_stats[stage_name]['frame_nums'] += frame_nums
+                for key, value in kwargs.items():
+                    stage_stats[stage_name][key] += value
+
+        def _run_stage(stage_fn):
+            def _stage_thread():
+                try:
+                    stage_fn()
+                except _PipelineStopped:
+                    pass
+                except Exception as err:
+                    with lock:
+                        errors.append(err)
+                    stop_event.set()
+            return _stage_thread
+
+        def _decode():
+            busy_time = 0.0
+            frame_nums = 0
+            skipped_frame_nums = 0
+            try:
+                while True:
+                    task = input_queue.get()
+                    if task is _END_OF_STREAM:
+                        decoded_queue.put(_END_OF_STREAM)
+                        return
+                    t_start = time.perf_counter()
+                    decoded_frame = self._decode_fn(task)
+                    busy_time += time.perf_counter() - t_start
+                    if decoded_frame is None:
+                        skipped_frame_nums += 1
+                        continue
+                    frame_nums += 1
+                    decoded_queue.put((task, decoded_frame))
+            finally:
+                _add_stage_stats('decode', busy_time, frame_nums, skipped_frame_nums=skipped_frame_nums)
+
+        def _inference():
+            busy_time = 0.0
+            frame_nums = 0
+            batch_nums = 0
+            finished_decode_workers = 0
+            batch = []
+            try:
+                while finished_decode_workers < self._decode_workers:
+                    task = decoded_queue.get()
+                    if task is _END_OF_STREAM:
+                        finished_decode_workers += 1
+                    else:
+                        batch.append(task)
+                    if len(batch) == self._batch_size or \
+                            (batch and finished_decode_workers == self._decode_workers):
+                        batch_items = [tmp[0] for tmp in batch]
+                        batch_frames = [tmp[1] for tmp in batch]
+                        t_start = time.perf_counter()
+                        inference_result = self._inference_fn(batch_frames)
+                        busy_time += time.perf_counter() - t_start
+                        frame_nums += len(batch)
+                        batch_nums += 1
+                        batch = []
+                        inference_queue.put((batch_items, batch_frames, inference_result))
+                for _ in range(self._postprocess_workers):
+                    inference_queue.put(_END_OF_STREAM)
+            finally:
+                _add_stage_stats('inference', busy_time, frame_nums, batch_nums=batch_nums)
+
+        def _postprocess():
+            busy_time = 0.0
+            frame_nums = 0
+            try:
+                while True:
+                    task = inference_queue.get()
+                    if task is _END_OF_STREAM:
+                        return
+                    t_start = time.perf_counter()
+                    self._postprocess_fn(*task)
+                    busy_time += time.perf_counter() - t_start
+                    frame_nums += len(task[0])
+            finally:
+                _add_stage_stats('postprocess', busy_time, frame_nums)
+
+        threads = [threading.Thread(target=_run_stage(_decode)) for _ in range(self._decode_workers)]
+        threads.append(threading.Thread(target=_run_stage(_inference)))
+        threads.extend([threading.Thread(target=_run_stage(_postprocess)) for _ in range(self._postprocess_workers)])
+        for thread in threads:
+            thread.daemon = True
+
+        finished_event = threading.Event()
+
+        def _sample_occupancy():
+            while not finished_event.wait(self._stats_interval):
+                for stage_queue in stage_queues:
+                    stage_queue.sample_occupancy()
+
+        monitor_thread = threading.Thread(target=_sample_occupancy)
+        monitor_thread.daemon = True
+
+        t_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        monitor_thread.start()
+        try:
+            for item in items:
+                input_queue.put(item)
+            for _ in range(self._decode_workers):
+                input_queue.put(_END_OF_STREAM)
+        except _PipelineStopped:
+            pass
+        except BaseException:
+            stop_event.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            finished_event.set()
+            monitor_thread.join()
+        wall_time = time.perf_counter() - t_start
+
+        if errors:
+            raise errors[0]
+
+        ret = collections.OrderedDict()
+        ret['frame_nums'] = stage_stats['postprocess']['frame_nums']
+        ret['wall_time'] = wall_time
+        ret['fps'] = ret['frame_nums'] / wall_time if wall_time > 0 else 0.0
+        ret['stages'] = stage_stats
+        ret['queues'] = collections.OrderedDict(
+            [(stage_queue.name, stage_queue.get_stats()) for stage_queue in stage_queues])
+
+        return ret
+
+
+def log_pipeline_stats(stats):
+    """
+    log the frame rate, the busy time of every stage and the occupancy of every queue of a pipeline run
+    :param stats: LaneNetPipeline.run result
+    :return:
+    """
+    log.info('Pipeline processed {:d} frames in {:.5f}s, {:.2f} fps'.format(
+        stats['frame_nums'], stats['wall_time'], stats['fps']))
+    for stage_name, stage_stats in stats['stages'].items():
+        log.info('Stage {:s}: {:d} workers busy {:.1f}% of the time on {:d} frames'.format(
+            stage_name, stage_stats['workers'],
+            100.0 * stage_stats['busy_time'] / max(stats['wall_time'] * stage_stats['workers'], 1e-12),
+            stage_stats['frame_nums']))
+    for queue_name, queue_stats in stats['queues'].items():
+        log.info('Queue {:s}: capacity {:d} mean occupancy {:.2f} max {:d} full {:.1f}% empty {:.1f}%'.format(
+            queue_name, queue_stats['capacity'], queue_stats['mean_occupancy'], queue_stats['max_occupancy'],
+            100.0 * queue_stats['full_ratio'], 100.0 * queue_stats['empty_ratio']))
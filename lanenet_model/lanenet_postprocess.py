@@ -8,12 +8,22 @@
 """
 LaneNet model post process
 """
-import os.path as ops
+import collections
+import json
 import math
+import multiprocessing
+import os
+import os.path as ops
+import shutil
+import tempfile
+import threading
+import time
 
 import cv2
 import glog as log
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse import csgraph
 from sklearn.cluster import DBSCAN
 from sklearn.cluster import MeanShift
 from sklearn.preprocessing import StandardScaler
@@ -23,31 +33,33 @@ from config import global_config
 CFG = global_config.cfg
 
 
-def _morphological_process(image, kernel_size=5):
+def _morphological_process(image, kernel_size=5, dst=None):
     """
     morphological process to fill the hole in the binary segmentation result
     :param image:
     :param kernel_size:
+    :param dst: optional output buffer
     :return:
     """
     if len(image.shape) == 3:
         raise ValueError('Binary segmentation result image should be a single channel image')
 
-    if image.dtype is not np.uint8:
+    if image.dtype != np.uint8:
         image = np.array(image, np.uint8)
 
     kernel = cv2.getStructuringElement(shape=cv2.MORPH_ELLIPSE, ksize=(kernel_size, kernel_size))
 
     # close operation fille hole
-    closing = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel, iterations=1)
+    closing = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel, dst=dst, iterations=1)
 
     return closing
 
 
-def _connect_components_analysis(image):
+def _connect_components_analysis(image, labels=None):
     """
     connect components analysis to remove the small components
     :param image:
+    :param labels: optional output label image buffer
     :return:
     """
     if len(image.shape) == 3:
@@ -55,7 +67,702 @@ def _connect_components_analysis(image):
     else:
         gray_image = image
 
-    return cv2.connectedComponentsWithStats(gray_image, connectivity=8, ltype=cv2.CV_32S)
+    return cv2.connectedComponentsWithStats(gray_image, labels=labels, connectivity=8, ltype=cv2.CV_32S)
+
+
+def _remove_small_components(image, labels, stats, min_area_threshold, keep_mask=None):
+    """
+    remove the connected components whose area is not bigger than min_area_threshold. A keep / drop lookup
+    table indexed by component label is built from stats and applied to the label image in a single pass so
+    the cost does not depend on the number of components
+    :param image: binary image the components were computed from, modified in place
+    :param labels: label image returned by connect components analysis
+    :param stats: component stats returned by connect components analysis
+    :param min_area_threshold:
+    :param keep_mask: optional uint8 buffer of the image shape
+    :return:
+    """
+    keep_lut = np.array(stats[:, cv2.CC_STAT_AREA] > min_area_threshold, dtype=np.uint8)
+    keep_mask = np.take(keep_lut, labels, out=keep_mask)
+    np.multiply(image, keep_mask, out=image)
+
+    return image
+
+
+class _StageTimer(object):
+    """
+    Wall time of the postprocess stages, a stage nested in another stage is not counted in the outer stage
+    """
+    def __init__(self):
+        """
+
+        """
+        self.timings = collections.OrderedDict()
+        self._stage_stack = []
+
+    def __enter__(self):
+        """
+
+        :return:
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        close the stage opened by the last stage call
+        :return:
+        """
+        stage_name, t_start, nested_cost = self._stage_stack.pop()
+        t_cost = time.perf_counter() - t_start
+        self.timings[stage_name] = self.timings.get(stage_name, 0.0) + t_cost - nested_cost
+        if self._stage_stack:
+            self._stage_stack[-1][2] += t_cost
+
+        return False
+
+    def stage(self, stage_name):
+        """
+        time the stage of stage_name with a with statement, the cost of every stage of the same name adds up
+        :param stage_name:
+        :return:
+        """
+        self._stage_stack.append([stage_name, time.perf_counter(), 0.0])
+
+        return self
+
+
+class _NullStageTimer(object):
+    """
+    Stage timer used when the stage timings are not recorded
+    """
+    timings = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def stage(self, stage_name):
+        return self
+
+
+_NULL_STAGE_TIMER = _NullStageTimer()
+
+
+class PostprocessTimingCollector(object):
+    """
+    Collect the stage timings of many postprocess calls and report their percentiles, timings may be added
+    from several threads
+    """
+    def __init__(self, max_samples=10000):
+        """
+
+        :param max_samples: keep the timings of the last max_samples postprocess calls of every stage
+        """
+        self._max_samples = max_samples
+        self._stage_timings = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, timings):
+        """
+        add the stage timings of one postprocess call
+        :param timings: the timings of a postprocess result
+        :return:
+        """
+        if timings is None:
+            return
+        with self._lock:
+            for stage_name, t_cost in timings.items():
+                if stage_name not in self._stage_timings:
+                    self._stage_timings[stage_name] = collections.deque(maxlen=self._max_samples)
+                self._stage_timings[stage_name].append(t_cost)
+
+    def reset(self):
+        """
+
+        :return:
+        """
+        with self._lock:
+            self._stage_timings = collections.OrderedDict()
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        get the sample nums, mean and percentiles in seconds of every stage
+        :param percentiles:
+        :return:
+        """
+        with self._lock:
+            stage_timings_map = [(stage_name, np.array(stage_timings))
+                                 for stage_name, stage_timings in self._stage_timings.items()]
+
+        ret = collections.OrderedDict()
+        for stage_name, stage_timings in stage_timings_map:
+            stage_summary = collections.OrderedDict()
+            stage_summary['count'] = stage_timings.shape[0]
+            stage_summary['mean'] = float(np.mean(stage_timings))
+            for percentile, value in zip(percentiles, np.percentile(stage_timings, percentiles)):
+                stage_summary['p{:d}'.format(percentile)] = float(value)
+            ret[stage_name] = stage_summary
+
+        return ret
+
+    def log_summary(self, percentiles=(50, 95, 99)):
+        """
+        log the summary of every stage
+        :param percentiles:
+        :return:
+        """
+        for stage_name, stage_summary in self.summary(percentiles).items():
+            log.info('Postprocess stage {:s}: {}'.format(stage_name, ', '.join(
+                '{:s}: {:.5f}s'.format(key, value) if key != 'count' else '{:s}: {:d}'.format(key, value)
+                for key, value in stage_summary.items())))
+
+
+class _BufferPool(object):
+    """
+    Reusable array buffers keyed by name
+    """
+    def __init__(self):
+        """
+
+        """
+        self._buffers = dict()
+
+    def get(self, name, shape, dtype):
+        """
+        get the buffer of name, allocated on first use and reallocated when the shape or dtype changes. The
+        buffer content is left from the previous use
+        :param name:
+        :param shape:
+        :param dtype:
+        :return:
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != np.dtype(dtype):
+            buffer = np.empty(shape=shape, dtype=dtype)
+            self._buffers[name] = buffer
+
+        return buffer
+
+    def reset(self):
+        """
+        release every buffer
+        :return:
+        """
+        self._buffers.clear()
+
+
+def _standardize_feats(feats, sample_weight=None):
+    """
+    standardize feats to zero mean and unit variance, the statistics are weighted by sample_weight if given
+    :param feats:
+    :param sample_weight:
+    :return:
+    """
+    if sample_weight is None:
+        return StandardScaler().fit_transform(feats)
+
+    mean = np.average(feats, axis=0, weights=sample_weight)
+    std = np.sqrt(np.average((feats - mean) ** 2, axis=0, weights=sample_weight))
+    std[std == 0.0] = 1.0
+
+    return (feats - mean) / std
+
+
+def _build_ipm_inverse_lookup(remap_to_ipm_x, remap_to_ipm_y, src_height, src_width):
+    """
+    build the inverse of the ipm remap tables for a source image size. cv2.remap with nearest interpolation
+    fills every ipm pixel from the source pixel at the rounded remap coordinate, so the ipm pixels filled from
+    one source pixel are stored contiguously and indexed by the row major source pixel index
+    :param remap_to_ipm_x:
+    :param remap_to_ipm_y:
+    :param src_height:
+    :param src_width:
+    :return:
+    """
+    # cv2.remap rounds the nearest remap coordinate half to even the same as np.rint
+    src_x = np.rint(remap_to_ipm_x).astype(np.int64)
+    src_y = np.rint(remap_to_ipm_y).astype(np.int64)
+    valid = np.logical_and(np.logical_and(src_x >= 0, src_x < src_width),
+                           np.logical_and(src_y >= 0, src_y < src_height))
+
+    ipm_pixel_index = np.flatnonzero(valid)
+    src_pixel_index = src_y[valid] * src_width + src_x[valid]
+    sort_idx = np.argsort(src_pixel_index, kind='stable')
+
+    src_pixel_offsets = np.zeros(shape=[src_height * src_width + 1], dtype=np.int64)
+    np.cumsum(np.bincount(src_pixel_index, minlength=src_height * src_width), out=src_pixel_offsets[1:])
+
+    ret = {
+        'ipm_pixel_index': ipm_pixel_index[sort_idx],
+        'src_pixel_offsets': src_pixel_offsets,
+        'src_width': src_width,
+        'ipm_height': remap_to_ipm_x.shape[0],
+        'ipm_width': remap_to_ipm_x.shape[1],
+    }
+
+    return ret
+
+
+def _project_to_ipm(src_y, src_x, lane_ids, ipm_inverse_lookup):
+    """
+    project the source image pixels of every lane into the ipm image at once, the result of every lane is the
+    same as the row major nonzero coordinates of its lane mask remapped into the ipm image with cv2.remap
+    :param src_y: source image row coordinates of the lane pixels
+    :param src_x: source image col coordinates of the lane pixels
+    :param lane_ids: lane index of every lane pixel
+    :param ipm_inverse_lookup: inverse remap lookup built by _build_ipm_inverse_lookup
+    :return: lane index, ipm image row and col coordinates of the ipm pixels grouped by lane
+    """
+    src_pixel_offsets = ipm_inverse_lookup['src_pixel_offsets']
+    src_pixel_nums = src_pixel_offsets.shape[0] - 1
+    lane_src_pixel_index = np.unique(lane_ids * src_pixel_nums + src_y * ipm_inverse_lookup['src_width'] + src_x)
+    src_lane_ids, src_pixel_index = np.divmod(lane_src_pixel_index, src_pixel_nums)
+    range_start = src_pixel_offsets[src_pixel_index]
+    range_size = src_pixel_offsets[src_pixel_index + 1] - range_start
+
+    # gather every [start, start + size) range of the ipm pixel index in one pass
+    gather_index = np.repeat(range_start - np.cumsum(range_size) + range_size, range_size) + \
+        np.arange(np.sum(range_size))
+    ipm_pixel_nums = ipm_inverse_lookup['ipm_height'] * ipm_inverse_lookup['ipm_width']
+    lane_ipm_pixel_index = np.sort(
+        np.repeat(src_lane_ids, range_size) * ipm_pixel_nums + ipm_inverse_lookup['ipm_pixel_index'][gather_index])
+    ipm_lane_ids, ipm_pixel_index = np.divmod(lane_ipm_pixel_index, ipm_pixel_nums)
+
+    return (ipm_lane_ids,) + np.divmod(ipm_pixel_index, ipm_inverse_lookup['ipm_width'])
+
+
+def _normalize_lane_y(lane_ids, lane_y, lane_nums, weights):
+    """
+    center and scale the y coordinates of every lane so that the polynomial normal equations stay well
+    conditioned
+    :param lane_ids: lane index of every point
+    :param lane_y: y coordinate of every point
+    :param lane_nums:
+    :param weights: weight of every point
+    :return: y mean and y scale of every lane and the normalized y of every point
+    """
+    lane_weights = np.bincount(lane_ids, weights=weights, minlength=lane_nums)
+    lane_weights[lane_weights == 0] = 1.0
+    y_mean = np.bincount(lane_ids, weights=weights * lane_y, minlength=lane_nums) / lane_weights
+    y_scale = np.sqrt(
+        np.bincount(lane_ids, weights=weights * (lane_y - y_mean[lane_ids]) ** 2, minlength=lane_nums) / lane_weights)
+    y_scale[y_scale == 0] = 1.0
+
+    return y_mean, y_scale, (lane_y - y_mean[lane_ids]) / y_scale[lane_ids]
+
+
+def _denormalize_lane_polynomials(normalized_params, y_mean, y_scale):
+    """
+    convert the polynomials of the normalized y into polynomials of y, highest order first like np.polyfit
+    :param normalized_params: [lane_nums, 3] params c0, c1, c2 of x = c0 + c1 * yn + c2 * yn ** 2
+    :param y_mean:
+    :param y_scale:
+    :return: [lane_nums, 3] params a, b, c of x = a * y ** 2 + b * y + c
+    """
+    c0, c1, c2 = normalized_params[:, 0], normalized_params[:, 1], normalized_params[:, 2]
+    a = c2 / y_scale ** 2
+    b = c1 / y_scale - 2.0 * c2 * y_mean / y_scale ** 2
+    c = c0 - c1 * y_mean / y_scale + c2 * y_mean ** 2 / y_scale ** 2
+
+    return np.stack((a, b, c), axis=1)
+
+
+def _fit_lane_polynomials(lane_ids, lane_y, lane_x, lane_nums, weights=None):
+    """
+    least squares fit x = f(y) second order polynomials of every lane at once by solving the stacked 3 x 3
+    normal equations of all lanes, the moments of every lane are accumulated with np.bincount
+    :param lane_ids: lane index of every point
+    :param lane_y: y coordinate of every point
+    :param lane_x: x coordinate of every point
+    :param lane_nums:
+    :param weights: weight of every point, default one
+    :return: [lane_nums, 3] fit params of every lane, highest order first like np.polyfit
+    """
+    if weights is None:
+        weights = np.ones(shape=lane_ids.shape, dtype=np.float64)
+    y_mean, y_scale, lane_yn = _normalize_lane_y(lane_ids, lane_y, lane_nums, weights)
+
+    yn_power = weights
+    moments = []
+    rhs = []
+    for power in range(5):
+        moments.append(np.bincount(lane_ids, weights=yn_power, minlength=lane_nums))
+        if power < 3:
+            rhs.append(np.bincount(lane_ids, weights=yn_power * lane_x, minlength=lane_nums))
+        yn_power = yn_power * lane_yn
+    moments = np.stack(moments, axis=1)
+    normal_matrix = moments[:, np.add.outer(np.arange(3), np.arange(3))]
+    normalized_params = np.matmul(np.linalg.pinv(normal_matrix), np.stack(rhs, axis=1)[:, :, None])[:, :, 0]
+
+    return _denormalize_lane_polynomials(normalized_params, y_mean, y_scale)
+
+
+def _ransac_fit_lane_polynomials(lane_ids, lane_y, lane_x, lane_nums, random_state=None):
+    """
+    fit x = f(y) second order polynomials of every lane robust to outlier points. For every lane
+    CFG.POSTPROCESS.FIT_RANSAC_ITERATIONS polynomials through three random points are scored by their inlier
+    nums on a random subsample of CFG.POSTPROCESS.FIT_RANSAC_SAMPLE_NUMS points, the inliers of the best
+    polynomial of every lane are then refit with least squares. Every lane is handled at once
+    :param lane_ids: lane index of every point, the points of a lane must be contiguous
+    :param lane_y: y coordinate of every point
+    :param lane_x: x coordinate of every point
+    :param lane_nums:
+    :param random_state: np.random.RandomState, default a fixed seed so that the fit of a frame is reproducible
+    :return: [lane_nums, 3] fit params of every lane, highest order first like np.polyfit
+    """
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    lane_pix_nums = np.bincount(lane_ids, minlength=lane_nums)
+    lane_offsets = np.cumsum(lane_pix_nums) - lane_pix_nums
+    last_index = max(lane_ids.shape[0] - 1, 0)
+    y_mean, y_scale, lane_yn = _normalize_lane_y(
+        lane_ids, lane_y, lane_nums, np.ones(shape=lane_ids.shape, dtype=np.float64))
+
+    # polynomials through three random points of every lane
+    hypothesis_index = lane_offsets[:, None, None] + (random_state.random_sample(
+        (lane_nums, CFG.POSTPROCESS.FIT_RANSAC_ITERATIONS, 3)) * lane_pix_nums[:, None, None]).astype(np.int64)
+    hypothesis_index = np.minimum(hypothesis_index, last_index)
+    hypothesis_yn = lane_yn[hypothesis_index]
+    vandermonde = np.stack((np.ones_like(hypothesis_yn), hypothesis_yn, hypothesis_yn ** 2), axis=-1)
+    hypothesis_params = np.matmul(np.linalg.pinv(vandermonde), lane_x[hypothesis_index][..., None])[..., 0]
+
+    # score every polynomial on a random subsample of its lane
+    eval_index = lane_offsets[:, None] + (random_state.random_sample(
+        (lane_nums, CFG.POSTPROCESS.FIT_RANSAC_SAMPLE_NUMS)) * lane_pix_nums[:, None]).astype(np.int64)
+    eval_index = np.minimum(eval_index, last_index)
+    eval_yn = lane_yn[eval_index][:, None, :]
+    eval_fit_x = hypothesis_params[:, :, 0:1] + hypothesis_params[:, :, 1:2] * eval_yn + \
+        hypothesis_params[:, :, 2:3] * eval_yn ** 2
+    inlier_nums = np.sum(
+        np.abs(eval_fit_x - lane_x[eval_index][:, None, :]) <= CFG.POSTPROCESS.FIT_RANSAC_INLIER_DIST, axis=2)
+    best_params = hypothesis_params[np.arange(lane_nums), np.argmax(inlier_nums, axis=1)]
+
+    # refit the inliers of the best polynomial, lanes with too few inliers are fit on every point
+    fit_x = best_params[lane_ids, 0] + best_params[lane_ids, 1] * lane_yn + best_params[lane_ids, 2] * lane_yn ** 2
+    inlier = np.abs(fit_x - lane_x) <= CFG.POSTPROCESS.FIT_RANSAC_INLIER_DIST
+    lane_inlier_nums = np.bincount(lane_ids, weights=inlier, minlength=lane_nums)
+    weights = np.where(np.logical_or(inlier, lane_inlier_nums[lane_ids] < 3), 1.0, 0.0)
+
+    return _fit_lane_polynomials(lane_ids, lane_y, lane_x, lane_nums, weights=weights)
+
+
+def _get_sample_plot_y(start_plot_y, end_plot_y):
+    """
+    get the rows the lanes are sampled at, along y axis every 10 pixels
+    :param start_plot_y:
+    :param end_plot_y:
+    :return:
+    """
+    step = int(math.floor((end_plot_y - start_plot_y) / 10))
+
+    return np.linspace(start_plot_y, end_plot_y, step)
+
+
+def _sample_lane_pts(src_lane_x, src_lane_y, start_plot_y, end_plot_y, image_width):
+    """
+    sample every lane along y axis every 10 pixels between start_plot_y and end_plot_y. The sample point of a
+    row is interpolated from the nearest lane points on both sides of the row, both found for every lane and
+    every row at once by counting the lane points sorted by y above the row
+    :param src_lane_x: [lane_nums, point_nums] source image lane point x, nan for no point
+    :param src_lane_y: [lane_nums, point_nums] source image lane point y, nan for no point
+    :param start_plot_y:
+    :param end_plot_y:
+    :param image_width: sample points outside the image width are dropped
+    :return: sample points [x, y] of every lane and every row, nan if the lane has no point at the row
+    """
+    plot_y = _get_sample_plot_y(start_plot_y, end_plot_y)
+    src_lane_x = np.asarray(src_lane_x, dtype=np.float64)
+    src_lane_y = np.asarray(src_lane_y, dtype=np.float64)
+    if src_lane_x.shape[0] == 0 or src_lane_x.shape[1] == 0:
+        return np.full(shape=[src_lane_x.shape[0], plot_y.shape[0], 2], fill_value=np.nan, dtype=np.float64)
+
+    # sort the points of every lane by y, the missing points are moved to the end as inf
+    lane_pt_nums = np.sum(~np.isnan(src_lane_y), axis=1)
+    src_lane_y = np.where(np.isnan(src_lane_y), np.inf, src_lane_y)
+    sort_idx = np.argsort(src_lane_y, axis=1, kind='stable')
+    lane_pt_x = np.take_along_axis(src_lane_x, sort_idx, axis=1)
+    lane_pt_y = np.take_along_axis(src_lane_y, sort_idx, axis=1)
+
+    # the first point above the row and the first of the nearest points below or on the row, which starts the
+    # run of the points with the same y as the last point below or on the row
+    idx_high = np.sum(lane_pt_y[:, None, :] <= plot_y[None, :, None], axis=2)
+    has_both_sides = np.logical_and(idx_high > 0, idx_high < lane_pt_nums[:, None])
+    pt_index = np.broadcast_to(np.arange(lane_pt_y.shape[1]), lane_pt_y.shape)
+    with np.errstate(invalid='ignore'):
+        run_start = np.where(np.diff(lane_pt_y, axis=1, prepend=-np.inf) != 0, pt_index, 0)
+    run_start = np.maximum.accumulate(run_start, axis=1)
+    idx_low = np.take_along_axis(run_start, np.maximum(idx_high - 1, 0), axis=1)
+    idx_high = np.minimum(idx_high, np.maximum(lane_pt_nums[:, None] - 1, 0))
+
+    previous_src_pt_x = np.take_along_axis(lane_pt_x, idx_low, axis=1)
+    previous_src_pt_y = np.take_along_axis(lane_pt_y, idx_low, axis=1)
+    last_src_pt_x = np.take_along_axis(lane_pt_x, idx_high, axis=1)
+    last_src_pt_y = np.take_along_axis(lane_pt_y, idx_high, axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        previous_weights = np.abs(previous_src_pt_y - plot_y)
+        last_weights = np.abs(last_src_pt_y - plot_y)
+        interpolation_src_pt_x = (previous_weights * previous_src_pt_x + last_weights * last_src_pt_x) / \
+            (previous_weights + last_weights)
+        interpolation_src_pt_y = (previous_weights * previous_src_pt_y + last_weights * last_src_pt_y) / \
+            (previous_weights + last_weights)
+
+        valid = np.logical_and.reduce((
+            has_both_sides,
+            previous_src_pt_y >= start_plot_y,
+            last_src_pt_y >= start_plot_y,
+            interpolation_src_pt_x <= image_width,
+            interpolation_src_pt_x >= 10
+        ))
+    sample_pts = np.stack((interpolation_src_pt_x, interpolation_src_pt_y), axis=2)
+    sample_pts[~valid] = np.nan
+
+    return sample_pts
+
+
+def _get_label_index(pix_labels, unique_labels):
+    """
+    get the index in unique_labels of the label of every lane pixel through a lookup table
+    :param pix_labels: label of every lane pixel
+    :param unique_labels: sorted unique labels of the lane pixels
+    :return:
+    """
+    label_lut = np.zeros(shape=[unique_labels[-1] - unique_labels[0] + 1], dtype=np.int64)
+    label_lut[unique_labels - unique_labels[0]] = np.arange(unique_labels.shape[0])
+
+    return label_lut[pix_labels - unique_labels[0]]
+
+
+def _group_pixels_by_label(pix_label_index, label_nums):
+    """
+    group the lane pixels by label in one stable counting sort instead of one scan of every pixel per label
+    :param pix_label_index: label index in [0, label_nums) of every lane pixel
+    :param label_nums:
+    :return: the ascending pixel index of every label
+    """
+    # numpy sorts small integer types stably with a radix sort
+    pix_order = np.argsort(pix_label_index.astype(np.min_scalar_type(label_nums)), kind='stable')
+    label_pix_nums = np.bincount(pix_label_index, minlength=label_nums)
+
+    return np.split(pix_order, np.cumsum(label_pix_nums)[:-1])
+
+
+def _paint_lane_pixels(mask, lane_coord, lane_color_index, palette):
+    """
+    paint the lane pixels into the mask image with the palette colors in one scatter, every pixel is written
+    as a single item of all its channels
+    :param mask: C contiguous uint8 [height, width, 3] mask image
+    :param lane_coord: [x, y] coordinates of the lane pixels
+    :param lane_color_index: palette index of every lane pixel, wraps around the palette
+    :param palette: uint8 [colors, 3] palette
+    :return:
+    """
+    pixel_dtype = np.dtype((np.void, mask.shape[2]))
+    mask_pixels = mask.view(pixel_dtype).reshape(mask.shape[:2])
+    palette_pixels = np.ascontiguousarray(palette).view(pixel_dtype).reshape(-1)
+    mask_pixels[lane_coord[:, 1], lane_coord[:, 0]] = palette_pixels[lane_color_index % palette.shape[0]]
+
+
+class SparseInstanceSegResult(object):
+    """
+    Instance segmentation result of a frame holding only the embedding feats of the foreground pixels
+    gathered in graph by LaneNet.inference_sparse, indexed by the lane pixel coordinates like the dense
+    [height, width, dims] instance segmentation result
+    """
+    def __init__(self, foreground_coords, foreground_embedding_feats, image_shape):
+        """
+
+        :param foreground_coords: [y, x] coordinates of the gathered foreground pixels
+        :param foreground_embedding_feats: [nums, dims] embedding feats of the gathered foreground pixels
+        :param image_shape: [height, width] of the binary segmentation result
+        """
+        self._embedding_feats = foreground_embedding_feats
+        self._feats_index = np.full(shape=image_shape[:2], fill_value=-1, dtype=np.int32)
+        self._feats_index[foreground_coords[:, 0], foreground_coords[:, 1]] = np.arange(
+            foreground_coords.shape[0], dtype=np.int32)
+        self.shape = tuple(image_shape[:2]) + (foreground_embedding_feats.shape[1],)
+
+    def __getitem__(self, index):
+        """
+        get the embedding feats of the pixels selected by a (rows, cols) index
+        :param index:
+        :return:
+        """
+        feats_index = self._feats_index[index]
+        if feats_index.size > 0 and feats_index.min() < 0:
+            raise ValueError('Wrong lane pixels, lane pixels must be gathered foreground pixels')
+
+        return self._embedding_feats[feats_index]
+
+    def to_dense(self):
+        """
+        scatter the gathered embedding feats into a dense [height, width, dims] image, zero elsewhere
+        :return:
+        """
+        dense_ret = np.zeros(shape=self.shape, dtype=self._embedding_feats.dtype)
+        gathered = self._feats_index >= 0
+        dense_ret[gathered] = self._embedding_feats[self._feats_index[gathered]]
+
+        return dense_ret
+
+
+def _get_sparse_frame_bounds(foreground_coords, batch_size):
+    """
+    get the [start, end) range of every frame in the batched foreground pixels, LaneNet.inference_sparse
+    gathers them in row major order so the frames are contiguous
+    :param foreground_coords: [batch_index, y, x] coordinates of the gathered foreground pixels
+    :param batch_size:
+    :return:
+    """
+    return np.searchsorted(foreground_coords[:, 0], np.arange(batch_size + 1))
+
+
+def split_sparse_seg_results(sparse_seg_results):
+    """
+    split the batched LaneNet.inference_sparse result into the binary segmentation result and the sparse
+    instance segmentation result of every frame, which postprocess accepts in place of the dense results
+    :param sparse_seg_results: dict of binary_seg_mask, foreground_coords and foreground_embedding_feats
+    :return: binary segmentation results, list of SparseInstanceSegResult
+    """
+    binary_seg_results = sparse_seg_results['binary_seg_mask']
+    foreground_coords = sparse_seg_results['foreground_coords']
+    foreground_embedding_feats = sparse_seg_results['foreground_embedding_feats']
+    frame_bounds = _get_sparse_frame_bounds(foreground_coords, binary_seg_results.shape[0])
+
+    instance_seg_results = [SparseInstanceSegResult(
+        foreground_coords=foreground_coords[frame_bounds[index]:frame_bounds[index + 1], 1:],
+        foreground_embedding_feats=foreground_embedding_feats[frame_bounds[index]:frame_bounds[index + 1]],
+        image_shape=binary_seg_results.shape[1:3]
+    ) for index in range(binary_seg_results.shape[0])]
+
+    return binary_seg_results, instance_seg_results
+
+
+def to_json_result(postprocess_ret):
+    """
+    convert the numpy arrays and scalars of a postprocess result, also the ones nested in lists, tuples and
+    dicts like the fit params of every lane, to json serializable python objects
+    :param postprocess_ret:
+    :return:
+    """
+    if isinstance(postprocess_ret, dict):
+        return {key: to_json_result(value) for key, value in postprocess_ret.items()}
+    if isinstance(postprocess_ret, (list, tuple)):
+        return [to_json_result(value) for value in postprocess_ret]
+    if isinstance(postprocess_ret, np.ndarray):
+        return to_json_result(postprocess_ret.tolist()) if postprocess_ret.dtype == object \
+            else postprocess_ret.tolist()
+    if isinstance(postprocess_ret, np.generic):
+        return postprocess_ret.item()
+
+    return postprocess_ret
+
+
+class _CameraProfile(object):
+    """
+    Source image geometry of a camera and the lookup tables derived from it, built once per camera
+    """
+    def __init__(self, src_height, src_width, start_plot_y, end_plot_y, remap_to_ipm_x, remap_to_ipm_y):
+        """
+
+        :param src_height: source image height
+        :param src_width: source image width
+        :param start_plot_y: first source image row of the lane sample band
+        :param end_plot_y: last source image row of the lane sample band
+        :param remap_to_ipm_x: ipm remap matrix x of the camera
+        :param remap_to_ipm_y: ipm remap matrix y of the camera
+        """
+        self.src_height = src_height
+        self.src_width = src_width
+        self.start_plot_y = start_plot_y
+        self.end_plot_y = end_plot_y
+        self.remap_to_ipm_x = remap_to_ipm_x
+        self.remap_to_ipm_y = remap_to_ipm_y
+        self.ipm_inverse_lookup = _build_ipm_inverse_lookup(remap_to_ipm_x, remap_to_ipm_y, src_height, src_width)
+        self.h_samples = _get_sample_plot_y(start_plot_y, end_plot_y)
+        self.h_samples.flags.writeable = False
+        self._scale_luts = dict()
+
+    def get_scale_luts(self, image_height, image_width):
+        """
+        get the source image row of every segmentation image row and the source image column of every
+        segmentation image column
+        :param image_height: segmentation image height
+        :param image_width: segmentation image width
+        :return:
+        """
+        if (image_height, image_width) not in self._scale_luts:
+            self._scale_luts[(image_height, image_width)] = (
+                np.int_(np.arange(image_height) * self.src_height / image_height),
+                np.int_(np.arange(image_width) * self.src_width / image_width)
+            )
+
+        return self._scale_luts[(image_height, image_width)]
+
+
+_batch_worker_postprocessor = None
+
+
+def _get_batch_pool_context():
+    """
+    get the multiprocessing context the postprocess_batch worker pools are started with. The pools are
+    created lazily while tensorflow sessions and threads are running in the caller and forking such a process
+    may deadlock the workers, so the workers are started by a fork server or spawned if it is not supported
+    :return:
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
+def _init_batch_worker(postprocessor_kwargs):
+    """
+    build the postprocessor of a postprocess_batch worker process
+    :param postprocessor_kwargs:
+    :return:
+    """
+    global _batch_worker_postprocessor
+    _batch_worker_postprocessor = LaneNetPostProcessor(reuse_buffers=True, **postprocessor_kwargs)
+
+
+def _postprocess_batch_frame(frame_task):
+    """
+    postprocess one frame of a batch in a worker process. The frame is read from the memory mapped batch
+    files shared with the caller and the lanes are drawn into the shared source image in place
+    :param frame_task:
+    :return:
+    """
+    index = frame_task['index']
+    binary_seg_result = np.load(frame_task['binary_seg_path'], mmap_mode='r')[index]
+    if frame_task['instance_seg_path'] is not None:
+        instance_seg_result = np.load(frame_task['instance_seg_path'], mmap_mode='r')[index]
+    else:
+        start, end = frame_task['foreground_range']
+        instance_seg_result = SparseInstanceSegResult(
+            foreground_coords=np.load(frame_task['foreground_coords_path'], mmap_mode='r')[start:end, 1:],
+            foreground_embedding_feats=np.load(frame_task['foreground_feats_path'], mmap_mode='r')[start:end],
+            image_shape=binary_seg_result.shape
+        )
+    source_image = None
+    if frame_task['source_image_path'] is not None:
+        source_image = np.load(frame_task['source_image_path'], mmap_mode='r+')
+
+    ret = _batch_worker_postprocessor.postprocess(
+        binary_seg_result=binary_seg_result,
+        instance_seg_result=instance_seg_result,
+        min_area_threshold=frame_task['min_area_threshold'],
+        source_image=source_image,
+        data_source=frame_task['data_source'],
+        headless=frame_task['headless'],
+        with_timings=frame_task['with_timings']
+    )
+    if 'source_image' in ret:
+        ret['source_image'] = None
+
+    return ret
 
 
 class _LaneFeat(object):
@@ -145,9 +852,13 @@ class _LaneNetCluster(object):
      Instance segmentation result cluster
     """
 
-    def __init__(self):
+    def __init__(self, cluster_method=None, cluster_mode=None):
         """
 
+        :param cluster_method: embedding feats cluster backend, default use CFG.POSTPROCESS.CLUSTER_METHOD
+        :param cluster_mode: pixel to cluster every lane pixel, component to cluster the mean embedding
+        feats of every connected component or subsample to cluster a subsample of the lane pixels and assign
+        the rest to the nearest cluster center, default use CFG.POSTPROCESS.CLUSTER_MODE
         """
         self._color_map = [np.array([255, 0, 0]),
                            np.array([0, 255, 0]),
@@ -157,19 +868,42 @@ class _LaneNetCluster(object):
                            np.array([125, 0, 125]),
                            np.array([50, 100, 50]),
                            np.array([100, 50, 100])]
+        self._palette = np.array(self._color_map, dtype=np.uint8)
+
+        self._cluster_method_map = {
+            'dbscan': self._embedding_feats_dbscan_cluster,
+            'meanshift': self._embedding_feats_meanshift_cluster,
+            'voxel_grid': self._embedding_feats_voxel_grid_cluster,
+        }
+
+        if cluster_method is None:
+            cluster_method = CFG.POSTPROCESS.CLUSTER_METHOD
+        if cluster_method not in self._cluster_method_map:
+            raise ValueError('Wrong cluster method {:s} now only support {}'.format(
+                cluster_method, sorted(self._cluster_method_map.keys())))
+        self._cluster_method = cluster_method
+
+        if cluster_mode is None:
+            cluster_mode = CFG.POSTPROCESS.CLUSTER_MODE
+        if cluster_mode not in ['pixel', 'component', 'subsample']:
+            raise ValueError('Wrong cluster mode {:s} now only support pixel, component and subsample'.format(
+                cluster_mode))
+        self._cluster_mode = cluster_mode
 
     @staticmethod
-    def _embedding_feats_dbscan_cluster(embedding_image_feats):
+    def _embedding_feats_dbscan_cluster(embedding_image_feats, sample_weight=None, timer=_NULL_STAGE_TIMER):
         """
         dbscan cluster
         :param embedding_image_feats:
+        :param sample_weight: pixel nums each feat stands for, default one
+        :param timer: stage timer of the postprocess call
         :return:
         """
         db = DBSCAN(eps=CFG.POSTPROCESS.DBSCAN_EPS, min_samples=CFG.POSTPROCESS.DBSCAN_MIN_SAMPLES)
         try:
-            features = StandardScaler().fit_transform(embedding_image_feats)
-            # features = embedding_image_feats
-            db.fit(features)
+            with timer.stage('scaler'):
+                features = _standardize_feats(embedding_image_feats, sample_weight)
+            db.fit(features, sample_weight=sample_weight)
         except Exception as err:
             log.error(err)
             ret = {
@@ -197,14 +931,19 @@ class _LaneNetCluster(object):
         return ret
 
     @staticmethod
-    def _embedding_feats_meanshift_cluster(embedding_image_feats, bandwidth=1.5):
+    def _embedding_feats_meanshift_cluster(embedding_image_feats, sample_weight=None, timer=_NULL_STAGE_TIMER,
+                                           bandwidth=None):
         """
 
         :param embedding_image_feats:
-        :param bandwidth:
+        :param sample_weight: not supported by meanshift and ignored
+        :param timer: stage timer of the postprocess call
+        :param bandwidth: default use CFG.POSTPROCESS.MEANSHIFT_BANDWIDTH
         :return:
         """
-        ms = MeanShift(bandwidth, bin_seeding=True)
+        if bandwidth is None:
+            bandwidth = CFG.POSTPROCESS.MEANSHIFT_BANDWIDTH
+        ms = MeanShift(bandwidth=bandwidth, bin_seeding=True)
         try:
             # features = StandardScaler().fit_transform(embedding_image_feats)
             features = embedding_image_feats
@@ -235,6 +974,126 @@ class _LaneNetCluster(object):
 
         return ret
 
+    @staticmethod
+    def _embedding_feats_voxel_grid_cluster(embedding_image_feats, sample_weight=None, timer=_NULL_STAGE_TIMER):
+        """
+        voxel grid cluster for the low dims embedding space, a grid approximation of dbscan. The standardized
+        feats are hashed into grid cells of size CFG.POSTPROCESS.VOXEL_GRID_CELL_SIZE. A cell is a core cell if
+        it and its neighbour cells hold at least VOXEL_GRID_CORE_MIN_SAMPLES feats, only core cells are linked
+        with their neighbour core cells so the sparse cells between two lanes do not chain them together, and
+        every linked group of core cells holding at least VOXEL_GRID_MIN_SAMPLES feats forms a cluster. The other
+        cells join the cluster of a neighbour core cell and are labeled as noise otherwise, so the cost is near
+        linear in the feats nums
+        :param embedding_image_feats:
+        :param sample_weight: pixel nums each feat stands for, default one
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        try:
+            with timer.stage('scaler'):
+                features = _standardize_feats(embedding_image_feats, sample_weight)
+        except Exception as err:
+            log.error(err)
+            ret = {
+                'origin_features': None,
+                'cluster_nums': 0,
+                'db_labels': None,
+                'unique_labels': None,
+                'cluster_center': None
+            }
+            return ret
+
+        # hash every feature into its grid cell, cells are padded by one so that neighbour keys never wrap
+        voxel_coords = np.floor(features / CFG.POSTPROCESS.VOXEL_GRID_CELL_SIZE).astype(np.int64)
+        voxel_coords -= voxel_coords.min(axis=0) - 1
+        grid_shape = voxel_coords.max(axis=0) + 2
+        voxel_keys = np.ravel_multi_index(voxel_coords.T, grid_shape)
+        cell_keys, feats_cell_index, cell_counts = np.unique(voxel_keys, return_inverse=True, return_counts=True)
+        feats_cell_index = feats_cell_index.reshape(-1)
+        if sample_weight is None:
+            sample_weight = np.ones(features.shape[0], dtype=np.float64)
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+        cell_counts = np.bincount(feats_cell_index, weights=sample_weight, minlength=cell_keys.shape[0])
+
+        # every neighbour offset of a cell expressed in key space
+        grid_strides = np.append(np.cumprod(grid_shape[::-1])[-2::-1], 1)
+        neighbour_offsets = np.array(np.meshgrid(*[[-1, 0, 1]] * features.shape[1], indexing='ij'))
+        neighbour_offsets = neighbour_offsets.reshape(features.shape[1], -1).T.dot(grid_strides)
+        neighbour_offsets = neighbour_offsets[neighbour_offsets != 0]
+
+        # the core cells hold enough feats together with their neighbour cells
+        neighbourhood_counts = cell_counts.copy()
+        for offset in neighbour_offsets:
+            neighbour_index = np.searchsorted(cell_keys, cell_keys + offset)
+            neighbour_index = np.minimum(neighbour_index, cell_keys.shape[0] - 1)
+            hit = cell_keys[neighbour_index] == cell_keys + offset
+            neighbourhood_counts[hit] += cell_counts[neighbour_index[hit]]
+        core_cell_index = np.where(neighbourhood_counts >= CFG.POSTPROCESS.VOXEL_GRID_CORE_MIN_SAMPLES)[0]
+        core_cell_keys = cell_keys[core_cell_index]
+
+        # link the core cells with their core neighbours
+        edge_src = [np.zeros(shape=[0], dtype=np.int64)]
+        edge_dst = [np.zeros(shape=[0], dtype=np.int64)]
+        for offset in neighbour_offsets[neighbour_offsets > 0]:
+            if core_cell_keys.shape[0] == 0:
+                break
+            neighbour_index = np.searchsorted(core_cell_keys, core_cell_keys + offset)
+            neighbour_index = np.minimum(neighbour_index, core_cell_keys.shape[0] - 1)
+            hit = core_cell_keys[neighbour_index] == core_cell_keys + offset
+            edge_src.append(np.where(hit)[0])
+            edge_dst.append(neighbour_index[hit])
+        edge_src = np.concatenate(edge_src)
+        edge_dst = np.concatenate(edge_dst)
+        adjacency = coo_matrix(
+            (np.ones_like(edge_src), (edge_src, edge_dst)),
+            shape=(core_cell_keys.shape[0], core_cell_keys.shape[0])
+        )
+        _, core_cell_labels = csgraph.connected_components(adjacency, directed=False)
+
+        # drop the cell groups holding too few feats
+        group_counts = np.bincount(core_cell_labels, weights=cell_counts[core_cell_index])
+        valid_groups = np.where(group_counts >= CFG.POSTPROCESS.VOXEL_GRID_MIN_SAMPLES)[0]
+        group_lut = np.full(group_counts.shape[0], -1, dtype=np.int64)
+        group_lut[valid_groups] = np.arange(valid_groups.shape[0])
+        cell_labels = np.full(cell_keys.shape[0], -1, dtype=np.int64)
+        cell_labels[core_cell_index] = group_lut[core_cell_labels]
+
+        # the other cells join the cluster of their first clustered core neighbour
+        border_cell_index = np.setdiff1d(np.arange(cell_keys.shape[0]), core_cell_index, assume_unique=True)
+        for offset in neighbour_offsets:
+            if border_cell_index.shape[0] == 0 or core_cell_keys.shape[0] == 0:
+                break
+            neighbour_keys = cell_keys[border_cell_index] + offset
+            neighbour_index = np.searchsorted(core_cell_keys, neighbour_keys)
+            neighbour_index = np.minimum(neighbour_index, core_cell_keys.shape[0] - 1)
+            neighbour_labels = cell_labels[core_cell_index[neighbour_index]]
+            hit = np.logical_and(core_cell_keys[neighbour_index] == neighbour_keys, neighbour_labels >= 0)
+            cell_labels[border_cell_index[hit]] = neighbour_labels[hit]
+            border_cell_index = border_cell_index[~hit]
+
+        db_labels = cell_labels[feats_cell_index]
+        unique_labels = np.unique(db_labels)
+
+        # the cluster centers are the sample weighted mean feats
+        num_clusters = len(unique_labels)
+        clustered = db_labels >= 0
+        cluster_weights = np.bincount(
+            db_labels[clustered], weights=sample_weight[clustered], minlength=valid_groups.shape[0])
+        cluster_centers = np.stack(
+            [np.bincount(db_labels[clustered], weights=features[clustered, i] * sample_weight[clustered],
+                         minlength=valid_groups.shape[0])
+             for i in range(features.shape[1])], axis=1) / np.maximum(cluster_weights, 1e-12)[:, None]
+
+        ret = {
+            'origin_features': features,
+            'cluster_nums': num_clusters,
+            'db_labels': db_labels,
+            'unique_labels': unique_labels,
+            'cluster_center': cluster_centers
+        }
+
+        return ret
+
     @staticmethod
     def _get_lane_embedding_feats(binary_seg_ret, instance_seg_ret):
         """
@@ -258,63 +1117,241 @@ class _LaneNetCluster(object):
 
         return ret
 
-    def apply_lane_feats_cluster(self, binary_seg_result, instance_seg_result):
+    @staticmethod
+    def _split_mixed_components(lane_embedding_feats, lane_rows, lane_component_ids, max_feats_std, band_height):
         """
+        split every component whose embedding feats spread more than max_feats_std, such as two lanes touching
+        near the vanishing point, into sub components. A mixed component is cut into bands of band_height image
+        rows first, so a lane keeps a chain of close sub components and spread noise pixels stay sparse, and
+        the bands still mixed are halved at the mean of their most spread feats dim until every sub component
+        is pure
+        :param lane_embedding_feats: embedding feats of every lane pixel
+        :param lane_rows: image row of every lane pixel
+        :param lane_component_ids: connected component label of every lane pixel
+        :param max_feats_std: max standardized embedding feats std of a pure sub component
+        :param band_height: image row nums of a band of a mixed component
+        :return: sub component index of every lane pixel, the mean embedding feats and the pixel nums of every
+        sub component
+        """
+        feats_dims = lane_embedding_feats.shape[1]
+        feats_var = np.var(lane_embedding_feats, axis=0)
+        feats_var[feats_var == 0.0] = 1.0
+        scaled_feats = lane_embedding_feats / np.sqrt(feats_var)
+        pix_index = np.arange(lane_embedding_feats.shape[0])
+        lane_bands = np.asarray(lane_rows, dtype=np.int64) // band_height
+
+        # every round splits the mixed components of the previous round, the first round into row bands and
+        # the following rounds in the embedding space. The halving depth is bounded by the float precision of
+        # the feats, the round cap only guards degenerate feats
+        pix_component_index = np.asarray(lane_component_ids, dtype=np.int64)
+        for split_round in range(64):
+            _, pix_component_index, component_pix_nums = np.unique(
+                pix_component_index, return_inverse=True, return_counts=True)
+            pix_component_index = pix_component_index.reshape(-1)
+            component_scaled_feats = np.stack(
+                [np.bincount(pix_component_index, weights=scaled_feats[:, i])
+                 for i in range(feats_dims)], axis=1) / component_pix_nums[:, None]
+            component_feats_var = np.stack(
+                [np.bincount(pix_component_index,
+                             weights=(scaled_feats[:, i] - component_scaled_feats[pix_component_index, i]) ** 2)
+                 for i in range(feats_dims)], axis=1) / component_pix_nums[:, None]
+            mixed_component = np.sqrt(np.mean(component_feats_var, axis=1)) > max_feats_std
+            if not np.any(mixed_component):
+                break
+            mixed_pix = mixed_component[pix_component_index]
+
+            if split_round == 0:
+                sub_index = np.where(mixed_pix, lane_bands - lane_bands.min(), 0)
+            else:
+                split_dims = np.argmax(component_feats_var, axis=1)[pix_component_index]
+                sub_index = np.logical_and(mixed_pix, scaled_feats[pix_index, split_dims] >
+                                           component_scaled_feats[pix_component_index, split_dims])
+            pix_component_index = pix_component_index * (np.max(sub_index) + 1) + sub_index
 
-        :param binary_seg_result:
-        :param instance_seg_result:
+        component_embedding_feats = np.stack(
+            [np.bincount(pix_component_index, weights=lane_embedding_feats[:, i])
+             for i in range(feats_dims)], axis=1) / component_pix_nums[:, None]
+
+        return pix_component_index, component_embedding_feats, component_pix_nums
+
+    def _component_feats_cluster(self, lane_embedding_feats, lane_coordinates, lane_component_ids,
+                                 timer=_NULL_STAGE_TIMER):
+        """
+        cluster the mean embedding feats of every connected component weighted by its pixel nums and give
+        every lane pixel the cluster label of its component. Components whose embedding feats spread more
+        than CFG.POSTPROCESS.COMPONENT_MAX_FEATS_STD are split into pure sub components first
+        :param lane_embedding_feats: embedding feats of every lane pixel
+        :param lane_coordinates: [x, y] coordinates of every lane pixel
+        :param lane_component_ids: connected component label of every lane pixel
+        :param timer: stage timer of the postprocess call
         :return:
         """
-        # get embedding feats and coords
-        get_lane_embedding_feats_result = self._get_lane_embedding_feats(
-            binary_seg_ret=binary_seg_result,
-            instance_seg_ret=instance_seg_result
+        pix_component_index, component_embedding_feats, component_pix_nums = self._split_mixed_components(
+            lane_embedding_feats=lane_embedding_feats,
+            lane_rows=lane_coordinates[:, 1],
+            lane_component_ids=lane_component_ids,
+            max_feats_std=CFG.POSTPROCESS.COMPONENT_MAX_FEATS_STD,
+            band_height=CFG.POSTPROCESS.COMPONENT_SPLIT_BAND_HEIGHT
         )
 
-        # dbscan cluster
-        dbscan_cluster_result = self._embedding_feats_dbscan_cluster(
-            embedding_image_feats=get_lane_embedding_feats_result['lane_embedding_feats']
+        cluster_result = self._cluster_method_map[self._cluster_method](
+            embedding_image_feats=component_embedding_feats,
+            sample_weight=component_pix_nums,
+            timer=timer
         )
+        if cluster_result['db_labels'] is None:
+            return cluster_result
+
+        cluster_result['db_labels'] = cluster_result['db_labels'][pix_component_index]
+        cluster_result['unique_labels'] = np.unique(cluster_result['db_labels'])
+        cluster_result['cluster_nums'] = len(cluster_result['unique_labels'])
 
-        # ============================== meanshift
-        # meanshift cluster
-        # meanshift_cluster_result = self._embedding_feats_meanshift_cluster(
-        #     embedding_image_feats=get_lane_embedding_feats_result['lane_embedding_feats'],
-        #     bandwidth=1.0
-        # )
-        # db_labels = meanshift_cluster_result['db_labels']
-        # unique_labels = meanshift_cluster_result['unique_labels']
-        # ==============================
-
-        mask = np.zeros(shape=[binary_seg_result.shape[0], binary_seg_result.shape[1], 3], dtype=np.uint8)
-        db_labels = dbscan_cluster_result['db_labels']
-        unique_labels = dbscan_cluster_result['unique_labels']
+        return cluster_result
+
+    def _subsample_feats_cluster(self, lane_embedding_feats, sample_budget=None, timer=_NULL_STAGE_TIMER):
+        """
+        cluster at most sample_budget lane pixels and label every other lane pixel with its nearest cluster
+        center in one vectorized pass, so the cluster cost is bounded whatever the lane pixel nums. The lane
+        pixels are gathered in row major order so evenly spaced samples spread over the image rows in
+        proportion to the lane pixels of each row. Pixels farther from their nearest center than every sample
+        of that cluster are labeled as noise
+        :param lane_embedding_feats: embedding feats of every lane pixel
+        :param sample_budget: default use CFG.POSTPROCESS.CLUSTER_SAMPLE_BUDGET
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        if sample_budget is None:
+            sample_budget = CFG.POSTPROCESS.CLUSTER_SAMPLE_BUDGET
+        feats_nums = lane_embedding_feats.shape[0]
+        if feats_nums <= sample_budget:
+            return self._cluster_method_map[self._cluster_method](
+                embedding_image_feats=lane_embedding_feats, timer=timer)
+
+        sample_index = np.linspace(0, feats_nums - 1, sample_budget).astype(np.int64)
+        sample_feats = lane_embedding_feats[sample_index]
+
+        # every sample stands for feats_nums / sample_budget pixels
+        cluster_result = self._cluster_method_map[self._cluster_method](
+            embedding_image_feats=sample_feats,
+            sample_weight=np.full(sample_budget, feats_nums / sample_budget),
+            timer=timer
+        )
+        if cluster_result['db_labels'] is None:
+            return cluster_result
+
+        sample_labels = cluster_result['db_labels']
+        cluster_labels = np.unique(sample_labels[sample_labels >= 0])
+        db_labels = np.full(feats_nums, -1, dtype=np.int64)
+        if cluster_labels.shape[0] > 0:
+            # nearest cluster center in the standardized embedding space of the samples
+            feats_std = np.std(sample_feats, axis=0)
+            feats_std[feats_std == 0.0] = 1.0
+            scaled_feats = lane_embedding_feats / feats_std
+            scaled_centers = np.stack(
+                [np.mean(sample_feats[sample_labels == label], axis=0) for label in cluster_labels]) / feats_std
+            center_dists = np.sum(scaled_centers ** 2, axis=1)[None, :] - 2.0 * scaled_feats.dot(scaled_centers.T)
+            nearest_center = np.argmin(center_dists, axis=1)
+            nearest_center_dists = center_dists[np.arange(feats_nums), nearest_center] + \
+                np.sum(scaled_feats ** 2, axis=1)
+            cluster_radius = np.array(
+                [np.max(nearest_center_dists[sample_index][sample_labels == label]) for label in cluster_labels])
+            db_labels = np.where(nearest_center_dists <= cluster_radius[nearest_center],
+                                 cluster_labels[nearest_center], -1)
+        db_labels[sample_index] = sample_labels
+
+        cluster_result['db_labels'] = db_labels
+        cluster_result['unique_labels'] = np.unique(db_labels)
+        cluster_result['cluster_nums'] = len(cluster_result['unique_labels'])
+
+        return cluster_result
+
+    def cluster_lane_feats(self, lane_embedding_feats, lane_coordinates, binary_seg_result,
+                           component_labels=None, timer=_NULL_STAGE_TIMER):
+        """
+        cluster the lane embedding feats with the cluster mode and backend of this cluster
+        :param lane_embedding_feats: embedding feats of every lane pixel
+        :param lane_coordinates: [x, y] coordinates of every lane pixel
+        :param binary_seg_result: binary image the lane pixels were gathered from
+        :param component_labels: connect components analysis label image of binary_seg_result only used by
+        the component cluster mode, computed here if not given
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        with timer.stage('cluster'):
+            if self._cluster_mode == 'component':
+                if component_labels is None:
+                    component_labels = _connect_components_analysis(image=binary_seg_result)[1]
+                cluster_result = self._component_feats_cluster(
+                    lane_embedding_feats=lane_embedding_feats,
+                    lane_coordinates=lane_coordinates,
+                    lane_component_ids=component_labels[lane_coordinates[:, 1], lane_coordinates[:, 0]],
+                    timer=timer
+                )
+            elif self._cluster_mode == 'subsample':
+                cluster_result = self._subsample_feats_cluster(
+                    lane_embedding_feats=lane_embedding_feats,
+                    timer=timer
+                )
+            else:
+                cluster_result = self._cluster_method_map[self._cluster_method](
+                    embedding_image_feats=lane_embedding_feats,
+                    timer=timer
+                )
+
+        return cluster_result
+
+    def apply_lane_feats_cluster(self, binary_seg_result, instance_seg_result, component_labels=None,
+                                 with_mask=True, mask_buffer=None, timer=_NULL_STAGE_TIMER):
+        """
+
+        :param binary_seg_result:
+        :param instance_seg_result:
+        :param component_labels: connect components analysis label image of binary_seg_result only used by
+        the component cluster mode, computed here if not given
+        :param with_mask: if False skip painting the lane mask image and return None instead
+        :param mask_buffer: optional uint8 [height, width, 3] buffer the lane mask image is painted into
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        # get embedding feats and coords
+        with timer.stage('embedding_gather'):
+            get_lane_embedding_feats_result = self._get_lane_embedding_feats(
+                binary_seg_ret=binary_seg_result,
+                instance_seg_ret=instance_seg_result
+            )
         coord = get_lane_embedding_feats_result['lane_coordinates']
 
-        # ============================== meanshift
-        # # 聚类簇超过八个则选择其中类内样本最多的八个聚类簇保留下来
-        # if meanshift_cluster_result['cluster_nums'] > 8:
-        #     cluster_sample_nums = []
-        #     for i in range(meanshift_cluster_result['cluster_nums']):
-        #         cluster_sample_nums.append(len(np.where(db_labels == i)[0]))
-        #     sort_idx = np.argsort(-np.array(cluster_sample_nums, np.int64))
-        #     unique_labels = unique_labels[sort_idx[0:8]]
-        # else:
-        #     unique_labels = unique_labels
-        # ==============================
+        # embedding feats cluster
+        cluster_result = self.cluster_lane_feats(
+            lane_embedding_feats=get_lane_embedding_feats_result['lane_embedding_feats'],
+            lane_coordinates=coord,
+            binary_seg_result=binary_seg_result,
+            component_labels=component_labels,
+            timer=timer
+        )
+
+        db_labels = cluster_result['db_labels']
+        unique_labels = cluster_result['unique_labels']
 
         if db_labels is None:
             return None, None
 
-        lane_coords = []
-
-        for index, label in enumerate(unique_labels.tolist()):
-            if label == -1:
-                continue
-            idx = np.where(db_labels == label)
-            pix_coord_idx = tuple((coord[idx][:, 1], coord[idx][:, 0]))
-            mask[pix_coord_idx] = self._color_map[index]
-            lane_coords.append(coord[idx])
+        with timer.stage('lane_split'):
+            mask = None
+            if with_mask and mask_buffer is not None:
+                mask = mask_buffer
+                mask.fill(0)
+            elif with_mask:
+                mask = np.zeros(shape=[binary_seg_result.shape[0], binary_seg_result.shape[1], 3], dtype=np.uint8)
+
+            # the color of a lane is picked by the index of its label in unique_labels
+            pix_label_index = _get_label_index(db_labels, unique_labels)
+            if with_mask:
+                lane_pix = db_labels != -1
+                _paint_lane_pixels(mask, coord[lane_pix], pix_label_index[lane_pix], self._palette)
+            lane_coords = [coord[idx] for label, idx in zip(
+                unique_labels.tolist(), _group_pixels_by_label(pix_label_index, unique_labels.shape[0]))
+                if label != -1]
 
         return mask, lane_coords
 
@@ -323,19 +1360,76 @@ class LaneNetPostProcessor(object):
     """
     lanenet post process for lane generation
     """
-    def __init__(self, ipm_remap_file_path='./data/tusimple_ipm_remap.yml'):
+    def __init__(self, ipm_remap_file_path='./data/tusimple_ipm_remap.yml', min_area_thresholds=None,
+                 cluster_method=None, cluster_mode=None, use_remap_cache=True, reuse_buffers=False,
+                 camera_profiles=None, fit_method=None):
         """
 
-        :param ipm_remap_file_path: ipm generate file path
+        :param ipm_remap_file_path: ipm generate file path, used by the camera profiles without an ipm generate
+        file of their own
+        :param min_area_thresholds: precomputed connect components min area threshold of each data source,
+        default use CFG.POSTPROCESS.MIN_AREA_THRESHOLDS
+        :param cluster_method: embedding feats cluster backend, default use CFG.POSTPROCESS.CLUSTER_METHOD
+        :param cluster_mode: embedding feats cluster mode, default use CFG.POSTPROCESS.CLUSTER_MODE
+        :param use_remap_cache: load the ipm remap matrix from the memory mapped npy cache next to the ipm
+        generate file, the cache is built on first use and rebuilt when the ipm generate file changes
+        :param reuse_buffers: keep the intermediate images in buffers reused by every postprocess call instead
+        of allocating them per call, call reset to release the buffers. The returned results never alias the
+        buffers. A postprocessor reusing buffers must not be shared between threads
+        :param camera_profiles: camera profile of every data source, default use CFG.POSTPROCESS.CAMERA_PROFILES,
+        see register_camera_profile
+        :param fit_method: lane fit method, least_squares or ransac, default use CFG.POSTPROCESS.FIT_METHOD
         """
         assert ops.exists(ipm_remap_file_path), '{:s} not exist'.format(ipm_remap_file_path)
 
-        self._cluster = _LaneNetCluster()
+        self._cluster = _LaneNetCluster(cluster_method=cluster_method, cluster_mode=cluster_mode)
         self._ipm_remap_file_path = ipm_remap_file_path
+        self._use_remap_cache = use_remap_cache
+        self._buffer_pool = _BufferPool() if reuse_buffers else None
+        self._batch_pools = dict()
+        self._batch_pool_lock = threading.Lock()
+
+        if min_area_thresholds is None:
+            min_area_thresholds = CFG.POSTPROCESS.MIN_AREA_THRESHOLDS
+        self._min_area_thresholds = dict(min_area_thresholds)
+
+        self._fit_method_map = {
+            'least_squares': _fit_lane_polynomials,
+            'ransac': _ransac_fit_lane_polynomials,
+        }
+        if fit_method is None:
+            fit_method = CFG.POSTPROCESS.FIT_METHOD
+        if fit_method not in self._fit_method_map:
+            raise ValueError('Wrong fit method {:s} now only support {}'.format(
+                fit_method, sorted(self._fit_method_map.keys())))
+        self._fit_method = fit_method
+
+        if camera_profiles is None:
+            camera_profiles = CFG.POSTPROCESS.CAMERA_PROFILES
+        self._camera_profile_cfgs = dict()
+        self._camera_profiles = dict()
+        for data_source, camera_profile_cfg in camera_profiles.items():
+            self.register_camera_profile(
+                data_source=data_source,
+                src_height=camera_profile_cfg['SRC_HEIGHT'],
+                src_width=camera_profile_cfg['SRC_WIDTH'],
+                start_plot_y=camera_profile_cfg['SAMPLE_START_Y'],
+                end_plot_y=camera_profile_cfg['SAMPLE_END_Y'],
+                ipm_remap_file_path=camera_profile_cfg.get('IPM_REMAP_FILE_PATH', None)
+            )
+
+        self._postprocessor_kwargs = {
+            'ipm_remap_file_path': ipm_remap_file_path,
+            'min_area_thresholds': self._min_area_thresholds,
+            'cluster_method': cluster_method,
+            'cluster_mode': cluster_mode,
+            'use_remap_cache': use_remap_cache,
+            'camera_profiles': self._camera_profile_cfgs,
+            'fit_method': fit_method,
+        }
 
-        remap_file_load_ret = self._load_remap_matrix()
-        self._remap_to_ipm_x = remap_file_load_ret['remap_to_ipm_x']
-        self._remap_to_ipm_y = remap_file_load_ret['remap_to_ipm_y']
+        self._remap_matrices = dict()
+        self._remap_matrices[ipm_remap_file_path] = self._load_remap_matrix(ipm_remap_file_path)
 
         self._color_map = [np.array([255, 0, 0]),
                            np.array([0, 255, 0]),
@@ -345,13 +1439,91 @@ class LaneNetPostProcessor(object):
                            np.array([125, 0, 125]),
                            np.array([50, 100, 50]),
                            np.array([100, 50, 100])]
+        self._palette = np.array(self._color_map, dtype=np.uint8)
+
+    @staticmethod
+    def _get_remap_cache_paths(ipm_remap_file_path):
+        """
+        get the remap matrix cache file paths next to the ipm generate file
+        :param ipm_remap_file_path:
+        :return:
+        """
+        cache_prefix = ops.splitext(ipm_remap_file_path)[0] + '.remap_cache'
+
+        ret = {
+            'remap_to_ipm_x': cache_prefix + '.x.npy',
+            'remap_to_ipm_y': cache_prefix + '.y.npy',
+            'stamp': cache_prefix + '.json',
+        }
+
+        return ret
 
-    def _load_remap_matrix(self):
+    @staticmethod
+    def _get_remap_file_stamp(ipm_remap_file_path):
+        """
+        get the stamp of the ipm generate file the remap matrix cache is valid for
+        :param ipm_remap_file_path:
+        :return:
+        """
+        file_stat = os.stat(ipm_remap_file_path)
+
+        return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+
+    def _load_remap_matrix_cache(self, ipm_remap_file_path):
+        """
+        load the remap matrix from the memory mapped npy cache, the mapped pages are read only and shared by
+        every process loading the same cache
+        :param ipm_remap_file_path:
+        :return: None if the cache does not exist or is out of date
+        """
+        cache_paths = self._get_remap_cache_paths(ipm_remap_file_path)
+        try:
+            with open(cache_paths['stamp'], 'r') as file:
+                cache_stamp = json.load(file)
+            if cache_stamp != self._get_remap_file_stamp(ipm_remap_file_path):
+                return None
+            ret = {
+                'remap_to_ipm_x': np.load(cache_paths['remap_to_ipm_x'], mmap_mode='r'),
+                'remap_to_ipm_y': np.load(cache_paths['remap_to_ipm_y'], mmap_mode='r'),
+            }
+        except (IOError, OSError, ValueError):
+            return None
+
+        return ret
+
+    def _save_remap_matrix_cache(self, ipm_remap_file_path, remap_file_load_ret):
+        """
+        save the remap matrix cache, every file is written to a temp file and renamed so that concurrent
+        workers never read a partial cache and the stamp is written last
+        :param ipm_remap_file_path:
+        :param remap_file_load_ret:
+        :return:
+        """
+        cache_paths = self._get_remap_cache_paths(ipm_remap_file_path)
+        tmp_suffix = '.{:d}.tmp'.format(os.getpid())
+        try:
+            for key in ['remap_to_ipm_x', 'remap_to_ipm_y']:
+                with open(cache_paths[key] + tmp_suffix, 'wb') as file:
+                    np.save(file, remap_file_load_ret[key])
+                os.replace(cache_paths[key] + tmp_suffix, cache_paths[key])
+            with open(cache_paths['stamp'] + tmp_suffix, 'w') as file:
+                json.dump(self._get_remap_file_stamp(ipm_remap_file_path), file)
+            os.replace(cache_paths['stamp'] + tmp_suffix, cache_paths['stamp'])
+        except (IOError, OSError) as err:
+            log.warning('Save ipm remap matrix cache failed: {}'.format(err))
+
+    def _load_remap_matrix(self, ipm_remap_file_path):
         """
 
+        :param ipm_remap_file_path:
         :return:
         """
-        fs = cv2.FileStorage(self._ipm_remap_file_path, cv2.FILE_STORAGE_READ)
+        if self._use_remap_cache:
+            remap_cache_load_ret = self._load_remap_matrix_cache(ipm_remap_file_path)
+            if remap_cache_load_ret is not None:
+                return remap_cache_load_ret
+
+        fs = cv2.FileStorage(ipm_remap_file_path, cv2.FILE_STORAGE_READ)
 
         remap_to_ipm_x = fs.getNode('remap_ipm_x').mat()
         remap_to_ipm_y = fs.getNode('remap_ipm_y').mat()
@@ -363,141 +1535,761 @@ class LaneNetPostProcessor(object):
 
         fs.release()
 
+        if self._use_remap_cache:
+            self._save_remap_matrix_cache(ipm_remap_file_path, ret)
+
         return ret
 
+    def _get_buffer(self, name, shape, dtype):
+        """
+        get a reusable buffer, None if the postprocessor does not reuse buffers
+        :param name:
+        :param shape:
+        :param dtype:
+        :return:
+        """
+        if self._buffer_pool is None:
+            return None
+
+        return self._buffer_pool.get(name, shape, dtype)
+
+    def reset(self):
+        """
+        release the reusable buffers
+        :return:
+        """
+        if self._buffer_pool is not None:
+            self._buffer_pool.reset()
+
+    def close(self):
+        """
+        shut down the worker processes of postprocess_batch, call it once no thread is in postprocess_batch
+        :return:
+        """
+        with self._batch_pool_lock:
+            batch_pools = list(self._batch_pools.values())
+            self._batch_pools.clear()
+        for batch_pool in batch_pools:
+            batch_pool.close()
+            batch_pool.join()
+
+    def _get_batch_pool(self, workers):
+        """
+        get the worker process pool of postprocess_batch, every worker builds its own postprocessor once. One
+        pool is kept per worker nums and shared by the threads calling postprocess_batch at the same time, so
+        a call with other worker nums never shuts down a pool in use
+        :param workers: worker process nums, default use the cpu nums
+        :return:
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        with self._batch_pool_lock:
+            if workers not in self._batch_pools:
+                self._batch_pools[workers] = _get_batch_pool_context().Pool(
+                    processes=workers,
+                    initializer=_init_batch_worker,
+                    initargs=(self._postprocessor_kwargs,)
+                )
+
+            return self._batch_pools[workers]
+
+    def register_camera_profile(self, data_source, src_height, src_width, start_plot_y, end_plot_y,
+                                ipm_remap_file_path=None):
+        """
+        register the camera profile of a data source or replace it, the profile is built on the first
+        postprocess call of the data source
+        :param data_source: data source name passed to postprocess
+        :param src_height: source image height
+        :param src_width: source image width
+        :param start_plot_y: first source image row of the lane sample band
+        :param end_plot_y: last source image row of the lane sample band
+        :param ipm_remap_file_path: ipm generate file of the camera, default use the ipm generate file of the
+        postprocessor
+        :return:
+        """
+        if ipm_remap_file_path is not None:
+            assert ops.exists(ipm_remap_file_path), '{:s} not exist'.format(ipm_remap_file_path)
+        if not 0 <= start_plot_y < end_plot_y <= src_height:
+            raise ValueError('Wrong sample band [{:d}, {:d}] of data source {:s} with source image height {:d}'.format(
+                start_plot_y, end_plot_y, data_source, src_height))
+
+        self._camera_profile_cfgs[data_source] = {
+            'SRC_HEIGHT': src_height,
+            'SRC_WIDTH': src_width,
+            'SAMPLE_START_Y': start_plot_y,
+            'SAMPLE_END_Y': end_plot_y,
+            'IPM_REMAP_FILE_PATH': ipm_remap_file_path,
+        }
+        self._camera_profiles.pop(data_source, None)
+
+    def _get_camera_profile(self, data_source):
+        """
+        get the camera profile of the data source, built once on first use
+        :param data_source:
+        :return:
+        """
+        if data_source not in self._camera_profiles:
+            if data_source not in self._camera_profile_cfgs:
+                raise ValueError('Wrong data source {:s} now only support {}'.format(
+                    data_source, sorted(self._camera_profile_cfgs.keys())))
+            camera_profile_cfg = self._camera_profile_cfgs[data_source]
+
+            ipm_remap_file_path = camera_profile_cfg['IPM_REMAP_FILE_PATH']
+            if ipm_remap_file_path is None:
+                ipm_remap_file_path = self._ipm_remap_file_path
+            if ipm_remap_file_path not in self._remap_matrices:
+                self._remap_matrices[ipm_remap_file_path] = self._load_remap_matrix(ipm_remap_file_path)
+            remap_file_load_ret = self._remap_matrices[ipm_remap_file_path]
+
+            self._camera_profiles[data_source] = _CameraProfile(
+                src_height=camera_profile_cfg['SRC_HEIGHT'],
+                src_width=camera_profile_cfg['SRC_WIDTH'],
+                start_plot_y=camera_profile_cfg['SAMPLE_START_Y'],
+                end_plot_y=camera_profile_cfg['SAMPLE_END_Y'],
+                remap_to_ipm_x=remap_file_load_ret['remap_to_ipm_x'],
+                remap_to_ipm_y=remap_file_load_ret['remap_to_ipm_y']
+            )
+
+        return self._camera_profiles[data_source]
+
+    def _cluster_lanes(self, binary_seg_result, instance_seg_result, component_labels, with_mask,
+                       timer=_NULL_STAGE_TIMER):
+        """
+        cluster the lane pixels into lanes
+        :param binary_seg_result:
+        :param instance_seg_result:
+        :param component_labels:
+        :param with_mask:
+        :param timer: stage timer of the postprocess call
+        :return: lane mask image and the [x, y] coordinates of every lane, both None if the cluster failed
+        """
+        return self._cluster.apply_lane_feats_cluster(
+            binary_seg_result=binary_seg_result,
+            instance_seg_result=instance_seg_result,
+            component_labels=component_labels,
+            with_mask=with_mask,
+            timer=timer
+        )
+
+    def _get_lane_color(self, lane_index):
+        """
+        get the color the lane of lane_index is drawn with
+        :param lane_index: index of the lane in the lane coords of the frame
+        :return:
+        """
+        return self._color_map[lane_index % len(self._color_map)]
+
+    def _fit_lanes(self, lane_coords, camera_profile, image_shape, timer=_NULL_STAGE_TIMER):
+        """
+        fit every lane in the ipm image with a second order polynomial x = f(y)
+        :param lane_coords: [x, y] coordinates of every lane in the binary segmentation image
+        :param camera_profile: camera profile of the data source
+        :param image_shape: binary segmentation image height and width
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        if len(lane_coords) == 0:
+            return []
+        src_row_lut, src_col_lut = camera_profile.get_scale_luts(image_shape[0], image_shape[1])
+
+        # project the lane pixels into the ipm image without remapping a full resolution lane mask
+        with timer.stage('ipm_remap'):
+            coords = np.concatenate(lane_coords)
+            ipm_lane_ids, nonzero_y, nonzero_x = _project_to_ipm(
+                src_y=src_row_lut[coords[:, 1]],
+                src_x=src_col_lut[coords[:, 0]],
+                lane_ids=np.repeat(np.arange(len(lane_coords)), [tmp.shape[0] for tmp in lane_coords]),
+                ipm_inverse_lookup=camera_profile.ipm_inverse_lookup
+            )
+
+        with timer.stage('polyfit'):
+            fit_params = self._fit_method_map[self._fit_method](
+                lane_ids=ipm_lane_ids,
+                lane_y=nonzero_y.astype(np.float64),
+                lane_x=nonzero_x.astype(np.float64),
+                lane_nums=len(lane_coords)
+            )
+
+        return list(fit_params)
+
+    @staticmethod
+    def _back_project_lanes(fit_params, camera_profile):
+        """
+        sample every fitted lane in the ipm image and project the samples back into the source image
+        :param fit_params:
+        :param camera_profile: camera profile of the data source
+        :return: source image lane point x and y of every lane, [lane_nums, point_nums] with nan for the
+        samples projected outside the source image
+        """
+        remap_to_ipm_x = camera_profile.remap_to_ipm_x
+        remap_to_ipm_y = camera_profile.remap_to_ipm_y
+        [ipm_image_height, ipm_image_width] = remap_to_ipm_x.shape
+        fit_params = np.array(fit_params, dtype=np.float64).reshape(-1, 3)
+
+        # every 5th ipm row, the last row of the linspace would index one past the ipm image. All the lane
+        # polynomials are evaluated in one matmul over the stacked coefficients
+        plot_y = np.linspace(10, ipm_image_height, ipm_image_height - 10)[::5]
+        fit_x = fit_params.dot(np.vander(plot_y, 3).T)
+        ipm_rows = np.broadcast_to(np.minimum(plot_y.astype(np.int64), ipm_image_height - 1), fit_x.shape)
+        ipm_cols = np.clip(fit_x, 0, ipm_image_width - 1).astype(np.int64)
+
+        src_x = remap_to_ipm_x[ipm_rows, ipm_cols]
+        src_y = remap_to_ipm_y[ipm_rows, ipm_cols]
+        src_y = np.where(src_y > 0, src_y, 0)
+        valid = src_x > 0
+
+        return np.where(valid, src_x, np.nan), np.where(valid, src_y, np.nan)
+
     def postprocess(self, binary_seg_result, instance_seg_result=None,
-                    min_area_threshold=100, source_image=None,
-                    data_source='tusimple'):
+                    min_area_threshold=None, source_image=None,
+                    data_source='tusimple', headless=False, with_timings=False):
+        """
+
+        :param binary_seg_result:
+        :param instance_seg_result: dense instance segmentation result or the SparseInstanceSegResult of the
+        frame, see split_sparse_seg_results
+        :param min_area_threshold: connect components min area threshold, default use the precomputed
+        threshold of the data source
+        :param source_image: not needed in headless mode
+        :param data_source:
+        :param headless: skip the mask image painting and the source image drawing and return the lane fit
+        params, the sampled lane x of every h_samples row (-2 if the lane has no point at the row, the same as
+        the tusimple label) and the pixel nums of every lane only
+        :param with_timings: also return the wall time in seconds of every postprocess stage in timings, see
+        PostprocessTimingCollector to aggregate them
+        :return:
         """
+        timer = _StageTimer() if with_timings else _NULL_STAGE_TIMER
+        ret = self._postprocess(
+            binary_seg_result=binary_seg_result,
+            instance_seg_result=instance_seg_result,
+            min_area_threshold=min_area_threshold,
+            source_image=source_image,
+            data_source=data_source,
+            headless=headless,
+            timer=timer
+        )
+        if with_timings:
+            ret['timings'] = dict(timer.timings)
 
+        return ret
+
+    def _postprocess(self, binary_seg_result, instance_seg_result, min_area_threshold, source_image,
+                     data_source, headless, timer):
+        """
+        see postprocess
         :param binary_seg_result:
         :param instance_seg_result:
         :param min_area_threshold:
         :param source_image:
         :param data_source:
+        :param headless:
+        :param timer: stage timer of the postprocess call
         :return:
         """
+        image_shape = binary_seg_result.shape[:2]
+        camera_profile = self._get_camera_profile(data_source)
+
         # convert binary_seg_result
-        binary_seg_result = np.array(binary_seg_result * 255, dtype=np.uint8)
+        with timer.stage('morphology'):
+            binary_seg_image = self._get_buffer('binary_seg_image', image_shape, np.uint8)
+            if binary_seg_image is None:
+                binary_seg_result = np.array(binary_seg_result * 255, dtype=np.uint8)
+            else:
+                binary_seg_result = np.multiply(binary_seg_result, 255, out=binary_seg_image, casting='unsafe')
 
-        # apply image morphology operation to fill in the hold and reduce the small area
-        morphological_ret = _morphological_process(binary_seg_result, kernel_size=5)
+            # apply image morphology operation to fill in the hold and reduce the small area
+            morphological_ret = _morphological_process(
+                binary_seg_result, kernel_size=5,
+                dst=self._get_buffer('morphological_ret', image_shape, np.uint8)
+            )
 
-        connect_components_analysis_ret = _connect_components_analysis(image=morphological_ret)
+        with timer.stage('connect_components'):
+            connect_components_analysis_ret = _connect_components_analysis(
+                image=morphological_ret,
+                labels=self._get_buffer('component_labels', image_shape, np.int32)
+            )
 
         labels = connect_components_analysis_ret[1]
         stats = connect_components_analysis_ret[2]
-        for index, stat in enumerate(stats):
-            if stat[4] <= min_area_threshold:
-                idx = np.where(labels == index)
-                morphological_ret[idx] = 0
+        if min_area_threshold is None:
+            min_area_threshold = self._min_area_thresholds.get(data_source, CFG.POSTPROCESS.MIN_AREA_THRESHOLD)
+        with timer.stage('small_component_filter'):
+            _remove_small_components(
+                morphological_ret, labels, stats, min_area_threshold,
+                keep_mask=self._get_buffer('component_keep_mask', image_shape, np.uint8)
+            )
 
         # apply embedding features cluster
-        mask_image, lane_coords = self._cluster.apply_lane_feats_cluster(
+        mask_image, lane_coords = self._cluster_lanes(
             binary_seg_result=morphological_ret,
-            instance_seg_result=instance_seg_result
+            instance_seg_result=instance_seg_result,
+            component_labels=labels,
+            with_mask=not headless,
+            timer=timer
         )
 
-        if mask_image is None:
+        if headless and lane_coords is None:
+            return {
+                'fit_params': None,
+                'h_samples': None,
+                'lane_xs': None,
+                'lane_pixel_nums': None,
+            }
+        if lane_coords is None:
             return {
                 'mask_image': None,
                 'fit_params': None,
                 'source_image': None,
+                'sample_pts': None,
             }
         # ======================================================== #
         # lane line fit
-        fit_params = []
-        src_lane_pts = []  # lane pts every single lane
-        for lane_index, coords in enumerate(lane_coords):
-            if data_source == 'tusimple':
-                tmp_mask = np.zeros(shape=(720, 1280), dtype=np.uint8)
-                tmp_mask[tuple((np.int_(coords[:, 1] * 720 / 256), np.int_(coords[:, 0] * 1280 / 512)))] = 255
-            elif data_source == 'beec_ccd':
-                tmp_mask = np.zeros(shape=(1350, 2448), dtype=np.uint8)
-                tmp_mask[tuple((np.int_(coords[:, 1] * 1350 / 256), np.int_(coords[:, 0] * 2448 / 512)))] = 255
-            else:
-                raise ValueError('Wrong data source now only support tusimple and beec_ccd')
-            tmp_ipm_mask = cv2.remap(
-                tmp_mask,
-                self._remap_to_ipm_x,
-                self._remap_to_ipm_y,
-                interpolation=cv2.INTER_NEAREST
-            )
-            nonzero_y = np.array(tmp_ipm_mask.nonzero()[0])
-            nonzero_x = np.array(tmp_ipm_mask.nonzero()[1])
-
-            fit_param = np.polyfit(nonzero_y, nonzero_x, 2)
-            fit_params.append(fit_param)
-
-            [ipm_image_height, ipm_image_width] = tmp_ipm_mask.shape
-            plot_y = np.linspace(10, ipm_image_height, ipm_image_height - 10)
-            fit_x = fit_param[0] * plot_y ** 2 + fit_param[1] * plot_y + fit_param[2]
-            # fit_x = fit_param[0] * plot_y ** 3 + fit_param[1] * plot_y ** 2 + fit_param[2] * plot_y + fit_param[3]
-
-            lane_pts = []
-            for index in range(0, plot_y.shape[0], 5):
-                src_x = self._remap_to_ipm_x[
-                    int(plot_y[index]), int(np.clip(fit_x[index], 0, ipm_image_width - 1))]
-                if src_x <= 0:
-                    continue
-                src_y = self._remap_to_ipm_y[
-                    int(plot_y[index]), int(np.clip(fit_x[index], 0, ipm_image_width - 1))]
-                src_y = src_y if src_y > 0 else 0
-
-                lane_pts.append([src_x, src_y])
-
-            src_lane_pts.append(lane_pts)
+        fit_params = self._fit_lanes(lane_coords, camera_profile, image_shape, timer=timer)
+        with timer.stage('ipm_remap'):
+            src_lane_x, src_lane_y = self._back_project_lanes(fit_params, camera_profile)
 
         # tusimple test data sample point along y axis every 10 pixels
-        source_image_width = source_image.shape[1]
-        for index, single_lane_pts in enumerate(src_lane_pts):
-            single_lane_pt_x = np.array(single_lane_pts, dtype=np.float32)[:, 0]
-            single_lane_pt_y = np.array(single_lane_pts, dtype=np.float32)[:, 1]
-            if data_source == 'tusimple':
-                start_plot_y = 240
-                end_plot_y = 720
-            elif data_source == 'beec_ccd':
-                start_plot_y = 820
-                end_plot_y = 1350
-            else:
-                raise ValueError('Wrong data source now only support tusimple and beec_ccd')
-            step = int(math.floor((end_plot_y - start_plot_y) / 10))
-            for plot_y in np.linspace(start_plot_y, end_plot_y, step):
-                diff = single_lane_pt_y - plot_y
-                fake_diff_bigger_than_zero = diff.copy()
-                fake_diff_smaller_than_zero = diff.copy()
-                fake_diff_bigger_than_zero[np.where(diff <= 0)] = float('inf')
-                fake_diff_smaller_than_zero[np.where(diff > 0)] = float('-inf')
-                idx_low = np.argmax(fake_diff_smaller_than_zero)
-                idx_high = np.argmin(fake_diff_bigger_than_zero)
-
-                previous_src_pt_x = single_lane_pt_x[idx_low]
-                previous_src_pt_y = single_lane_pt_y[idx_low]
-                last_src_pt_x = single_lane_pt_x[idx_high]
-                last_src_pt_y = single_lane_pt_y[idx_high]
-
-                if previous_src_pt_y < start_plot_y or last_src_pt_y < start_plot_y or \
-                        fake_diff_smaller_than_zero[idx_low] == float('-inf') or \
-                        fake_diff_bigger_than_zero[idx_high] == float('inf'):
-                    continue
-
-                interpolation_src_pt_x = (abs(previous_src_pt_y - plot_y) * previous_src_pt_x +
-                                          abs(last_src_pt_y - plot_y) * last_src_pt_x) / \
-                                         (abs(previous_src_pt_y - plot_y) + abs(last_src_pt_y - plot_y))
-                interpolation_src_pt_y = (abs(previous_src_pt_y - plot_y) * previous_src_pt_y +
-                                          abs(last_src_pt_y - plot_y) * last_src_pt_y) / \
-                                         (abs(previous_src_pt_y - plot_y) + abs(last_src_pt_y - plot_y))
+        with timer.stage('sampling'):
+            sample_pts = _sample_lane_pts(
+                src_lane_x=src_lane_x,
+                src_lane_y=src_lane_y,
+                start_plot_y=camera_profile.start_plot_y,
+                end_plot_y=camera_profile.end_plot_y,
+                image_width=camera_profile.src_width if headless else source_image.shape[1]
+            )
 
-                if interpolation_src_pt_x > source_image_width or interpolation_src_pt_x < 10:
-                    continue
+        if headless:
+            with timer.stage('sampling'):
+                lane_xs = np.where(np.isnan(sample_pts[:, :, 0]), -2, sample_pts[:, :, 0])
+            ret = {
+                'fit_params': fit_params,
+                'h_samples': camera_profile.h_samples,
+                'lane_xs': lane_xs,
+                'lane_pixel_nums': np.array([coords.shape[0] for coords in lane_coords], dtype=np.int64),
+            }
+            return ret
 
-                lane_color = self._color_map[index].tolist()
-                cv2.circle(source_image, (int(interpolation_src_pt_x),
-                                          int(interpolation_src_pt_y)), 5, lane_color, -1)
+        with timer.stage('drawing'):
+            for index, single_lane_sample_pts in enumerate(sample_pts):
+                lane_color = self._get_lane_color(index).tolist()
+                for sample_pt in single_lane_sample_pts[~np.isnan(single_lane_sample_pts[:, 0])]:
+                    cv2.circle(source_image, (int(sample_pt[0]), int(sample_pt[1])), 5, lane_color, -1)
         ret = {
             'mask_image': mask_image,
             'fit_params': fit_params,
             'source_image': source_image,
+            'sample_pts': sample_pts,
         }
 
         return ret
+
+    def postprocess_batch(self, binary_seg_results, instance_seg_results=None, source_images=None,
+                          min_area_threshold=None, data_source='tusimple', headless=False, with_timings=False,
+                          workers=None):
+        """
+        postprocess a batch of frames in a pool of worker processes. The segmentation results and the source
+        images are handed to the workers through memory mapped files in shared memory instead of being
+        pickled, the lanes are drawn into the source images in place like postprocess does. The worker pool
+        is kept for the next batches until close is called
+        :param binary_seg_results: [batch, height, width] binary segmentation results or the dict returned by
+        LaneNet.inference_sparse
+        :param instance_seg_results: [batch, height, width, dims] instance segmentation results, None if
+        binary_seg_results is the LaneNet.inference_sparse result
+        :param source_images: source images of every frame, not needed in headless mode
+        :param min_area_threshold: see postprocess
+        :param data_source: see postprocess
+        :param headless: see postprocess
+        :param with_timings: see postprocess
+        :param workers: worker process nums, 0 to postprocess the frames one by one in the calling thread,
+        default use the cpu nums
+        :return: the postprocess result of every frame in input order
+        """
+        if workers == 0:
+            if isinstance(binary_seg_results, dict):
+                binary_seg_results, instance_seg_results = split_sparse_seg_results(binary_seg_results)
+            return [self.postprocess(
+                binary_seg_result=binary_seg_result,
+                instance_seg_result=instance_seg_results[index],
+                min_area_threshold=min_area_threshold,
+                source_image=None if source_images is None else source_images[index],
+                data_source=data_source,
+                headless=headless,
+                with_timings=with_timings
+            ) for index, binary_seg_result in enumerate(binary_seg_results)]
+
+        sparse_seg_results = None
+        if isinstance(binary_seg_results, dict):
+            sparse_seg_results = binary_seg_results
+            binary_seg_results = sparse_seg_results['binary_seg_mask']
+        else:
+            assert len(binary_seg_results) == len(instance_seg_results), \
+                'binary_seg_results and instance_seg_results have different batch size'
+        if not headless:
+            assert source_images is not None and len(source_images) == len(binary_seg_results), \
+                'source_images is needed for every frame if not in headless mode'
+        if len(binary_seg_results) == 0:
+            return []
+
+        shm_dir = tempfile.mkdtemp(prefix='lanenet_batch_', dir='/dev/shm' if ops.isdir('/dev/shm') else None)
+        try:
+            binary_seg_path = ops.join(shm_dir, 'binary_seg.npy')
+            np.save(binary_seg_path, np.asarray(binary_seg_results))
+            instance_seg_path = None
+            foreground_coords_path = None
+            foreground_feats_path = None
+            frame_bounds = None
+            if sparse_seg_results is None:
+                instance_seg_path = ops.join(shm_dir, 'instance_seg.npy')
+                np.save(instance_seg_path, np.asarray(instance_seg_results))
+            else:
+                foreground_coords_path = ops.join(shm_dir, 'foreground_coords.npy')
+                foreground_feats_path = ops.join(shm_dir, 'foreground_feats.npy')
+                np.save(foreground_coords_path, sparse_seg_results['foreground_coords'])
+                np.save(foreground_feats_path, sparse_seg_results['foreground_embedding_feats'])
+                frame_bounds = _get_sparse_frame_bounds(
+                    sparse_seg_results['foreground_coords'], len(binary_seg_results)).tolist()
+            # one file per source image so the frames of a batch may come from cameras of different sizes
+            source_image_paths = [None] * len(binary_seg_results)
+            if not headless:
+                for index, source_image in enumerate(source_images):
+                    source_image_paths[index] = ops.join(shm_dir, 'source_image_{:d}.npy'.format(index))
+                    np.save(source_image_paths[index], source_image)
+
+            frame_tasks = [{
+                'index': index,
+                'binary_seg_path': binary_seg_path,
+                'instance_seg_path': instance_seg_path,
+                'foreground_coords_path': foreground_coords_path,
+                'foreground_feats_path': foreground_feats_path,
+                'foreground_range': None if frame_bounds is None else frame_bounds[index:index + 2],
+                'source_image_path': source_image_paths[index],
+                'min_area_threshold': min_area_threshold,
+                'data_source': data_source,
+                'headless': headless,
+                'with_timings': with_timings,
+            } for index in range(len(binary_seg_results))]
+            ret = self._get_batch_pool(workers).map(_postprocess_batch_frame, frame_tasks)
+
+            if not headless:
+                for index, frame_ret in enumerate(ret):
+                    if frame_ret['fit_params'] is None:
+                        continue
+                    source_images[index][...] = np.load(source_image_paths[index])
+                    frame_ret['source_image'] = source_images[index]
+        finally:
+            shutil.rmtree(shm_dir, ignore_errors=True)
+
+        return ret
+
+
+class LaneNetStreamPostProcessor(LaneNetPostProcessor):
+    """
+    lanenet post process for the consecutive frames of a video stream. The lanes of the previous frame are
+    kept as tracks with a stable lane id, the mean raw embedding feats of the lane and the smoothed lane fit
+    params. Lane pixels of a new frame are assigned to the nearest track center and the embedding feats are
+    only clustered again when too few lane pixels could be assigned, when no lane is tracked or every
+    CFG.POSTPROCESS.TRACK_MAX_SKIP_FRAMES frames. A stream postprocessor keeps the state of one stream and
+    must not be shared between streams or threads
+    """
+    def __init__(self, ipm_remap_file_path='./data/tusimple_ipm_remap.yml', min_area_thresholds=None,
+                 cluster_method=None, cluster_mode=None, use_remap_cache=True, reuse_buffers=False,
+                 camera_profiles=None, fit_method=None):
+        """
+
+        :param ipm_remap_file_path: ipm generate file path
+        :param min_area_thresholds: see LaneNetPostProcessor
+        :param cluster_method: see LaneNetPostProcessor
+        :param cluster_mode: see LaneNetPostProcessor
+        :param use_remap_cache: see LaneNetPostProcessor
+        :param reuse_buffers: see LaneNetPostProcessor
+        :param camera_profiles: see LaneNetPostProcessor
+        :param fit_method: see LaneNetPostProcessor
+        """
+        super(LaneNetStreamPostProcessor, self).__init__(
+            ipm_remap_file_path=ipm_remap_file_path,
+            min_area_thresholds=min_area_thresholds,
+            cluster_method=cluster_method,
+            cluster_mode=cluster_mode,
+            use_remap_cache=use_remap_cache,
+            reuse_buffers=reuse_buffers,
+            camera_profiles=camera_profiles,
+            fit_method=fit_method
+        )
+
+        self._tracks = dict()
+        self._next_track_id = 0
+        self._frames_since_cluster = 0
+        self._clustered_ratio = 1.0
+        self._frame_lane_ids = []
+
+    def reset_tracks(self):
+        """
+        forget every tracked lane, call it before processing the frames of a new stream
+        :return:
+        """
+        self._tracks = dict()
+        self._next_track_id = 0
+        self._frames_since_cluster = 0
+        self._clustered_ratio = 1.0
+        self._frame_lane_ids = []
+
+    def _assign_to_tracks(self, lane_embedding_feats, lane_component_ids):
+        """
+        assign every lane pixel to the nearest track center within CFG.POSTPROCESS.TRACK_ASSIGN_MAX_DIST.
+        Pixels of a track holding less than CFG.POSTPROCESS.TRACK_MIN_COMPONENT_RATIO of a connected
+        component are left unassigned, they are outliers of the embedding feats of another lane
+        :param lane_embedding_feats:
+        :param lane_component_ids: connected component label of every lane pixel
+        :return: track id of every lane pixel, -1 if it is too far from every track, and the association
+        confidence, the assigned pixel ratio relative to the clustered pixel ratio of the last clustering
+        """
+        track_ids = np.array(sorted(self._tracks.keys()), dtype=np.int64)
+        track_centers = np.array([self._tracks[track_id]['center'] for track_id in track_ids.tolist()])
+
+        pix_center_dists = np.zeros(shape=[lane_embedding_feats.shape[0], track_ids.shape[0]], dtype=np.float64)
+        for dim in range(track_centers.shape[1]):
+            pix_center_dists += np.square(lane_embedding_feats[:, dim:dim + 1] - track_centers[:, dim])
+        nearest_track_index = np.argmin(pix_center_dists, axis=1)
+        nearest_dists = pix_center_dists[np.arange(nearest_track_index.shape[0]), nearest_track_index]
+        assigned = nearest_dists <= CFG.POSTPROCESS.TRACK_ASSIGN_MAX_DIST ** 2
+
+        _, pix_component_index = np.unique(lane_component_ids, return_inverse=True)
+        pix_component_index = pix_component_index.reshape(-1)
+        component_pix_nums = np.bincount(pix_component_index)
+        pix_component_track_index = pix_component_index * track_ids.shape[0] + nearest_track_index
+        component_track_pix_nums = np.bincount(
+            pix_component_track_index[assigned], minlength=component_pix_nums.shape[0] * track_ids.shape[0])
+        assigned &= component_track_pix_nums[pix_component_track_index] >= \
+            CFG.POSTPROCESS.TRACK_MIN_COMPONENT_RATIO * component_pix_nums[pix_component_index]
+
+        pix_track_ids = np.where(assigned, track_ids[nearest_track_index], -1)
+        confidence = np.mean(assigned) / max(self._clustered_ratio, 1e-6)
+
+        return pix_track_ids, confidence
+
+    def _match_clusters_to_tracks(self, lane_embedding_feats, cluster_result):
+        """
+        greedily match the clusters to the tracks from the nearest pair of cluster center and track center
+        on, clusters without a track within CFG.POSTPROCESS.TRACK_MATCH_MAX_DIST start a new track and tracks
+        without a cluster are dropped
+        :param lane_embedding_feats:
+        :param cluster_result:
+        :return: track id of every lane pixel, -1 for the pixels not belonging to any cluster
+        """
+        db_labels = cluster_result['db_labels']
+        unique_labels = cluster_result['unique_labels']
+        cluster_labels = unique_labels[unique_labels != -1].tolist()
+        pix_label_index = _get_label_index(db_labels, unique_labels)
+        label_pix_nums = np.bincount(pix_label_index, minlength=unique_labels.shape[0])
+        label_centers = np.stack(
+            [np.bincount(pix_label_index, weights=lane_embedding_feats[:, i], minlength=unique_labels.shape[0])
+             for i in range(lane_embedding_feats.shape[1])], axis=1) / np.maximum(label_pix_nums, 1)[:, None]
+        cluster_centers = list(label_centers[unique_labels != -1])
+        track_ids = sorted(self._tracks.keys())
+
+        candidate_pairs = []
+        for cluster_index, cluster_center in enumerate(cluster_centers):
+            for track_id in track_ids:
+                dist = np.linalg.norm(cluster_center - self._tracks[track_id]['center'])
+                if dist <= CFG.POSTPROCESS.TRACK_MATCH_MAX_DIST:
+                    candidate_pairs.append((dist, cluster_index, track_id))
+        candidate_pairs.sort()
+
+        cluster_track_ids = [-1] * len(cluster_labels)
+        matched_track_ids = set()
+        for _, cluster_index, track_id in candidate_pairs:
+            if cluster_track_ids[cluster_index] != -1 or track_id in matched_track_ids:
+                continue
+            cluster_track_ids[cluster_index] = track_id
+            matched_track_ids.add(track_id)
+
+        tracks = dict()
+        for cluster_index, track_id in enumerate(cluster_track_ids):
+            if track_id == -1:
+                track_id = self._next_track_id
+                self._next_track_id += 1
+                cluster_track_ids[cluster_index] = track_id
+                tracks[track_id] = {'center': cluster_centers[cluster_index], 'fit_param': None}
+            else:
+                tracks[track_id] = self._tracks[track_id]
+        self._tracks = tracks
+
+        label_track_ids = np.full(shape=unique_labels.shape, fill_value=-1, dtype=np.int64)
+        label_track_ids[unique_labels != -1] = cluster_track_ids
+        self._clustered_ratio = np.mean(db_labels != -1)
+
+        return label_track_ids[pix_label_index]
+
+    def _cluster_lanes(self, binary_seg_result, instance_seg_result, component_labels, with_mask,
+                       timer=_NULL_STAGE_TIMER):
+        """
+        assign the lane pixels to the tracked lanes and fall back to the embedding feats cluster when the
+        association confidence drops below CFG.POSTPROCESS.TRACK_MIN_CONFIDENCE
+        :param binary_seg_result:
+        :param instance_seg_result:
+        :param component_labels:
+        :param with_mask:
+        :param timer: stage timer of the postprocess call
+        :return: lane mask image colored by lane id and the [x, y] coordinates of every lane in lane id order
+        """
+        self._frame_lane_ids = []
+
+        with timer.stage('embedding_gather'):
+            get_lane_embedding_feats_result = self._cluster._get_lane_embedding_feats(
+                binary_seg_ret=binary_seg_result,
+                instance_seg_ret=instance_seg_result
+            )
+        lane_embedding_feats = get_lane_embedding_feats_result['lane_embedding_feats']
+        coord = get_lane_embedding_feats_result['lane_coordinates']
+        if lane_embedding_feats.shape[0] == 0:
+            self._frames_since_cluster += 1
+            return None, None
+
+        pix_track_ids = None
+        if self._tracks and self._frames_since_cluster < CFG.POSTPROCESS.TRACK_MAX_SKIP_FRAMES:
+            if component_labels is None:
+                component_labels = _connect_components_analysis(image=binary_seg_result)[1]
+            with timer.stage('track_assign'):
+                pix_track_ids, confidence = self._assign_to_tracks(
+                    lane_embedding_feats=lane_embedding_feats,
+                    lane_component_ids=component_labels[coord[:, 1], coord[:, 0]]
+                )
+            if confidence < CFG.POSTPROCESS.TRACK_MIN_CONFIDENCE:
+                pix_track_ids = None
+
+        if pix_track_ids is None:
+            cluster_result = self._cluster.cluster_lane_feats(
+                lane_embedding_feats=lane_embedding_feats,
+                lane_coordinates=coord,
+                binary_seg_result=binary_seg_result,
+                component_labels=component_labels,
+                timer=timer
+            )
+            if cluster_result['db_labels'] is None:
+                self._frames_since_cluster += 1
+                return None, None
+            with timer.stage('track_assign'):
+                pix_track_ids = self._match_clusters_to_tracks(lane_embedding_feats, cluster_result)
+            self._frames_since_cluster = 0
+        else:
+            self._frames_since_cluster += 1
+
+        with timer.stage('lane_split'):
+            mask = None
+            if with_mask:
+                mask = np.zeros(shape=[binary_seg_result.shape[0], binary_seg_result.shape[1], 3], dtype=np.uint8)
+            lane_coords = []
+
+            # label index 0 holds the pixels of no track
+            track_ids = np.array([-1] + sorted(self._tracks.keys()), dtype=np.int64)
+            pix_label_index = _get_label_index(pix_track_ids, track_ids)
+            label_lane = np.zeros(shape=track_ids.shape, dtype=np.bool_)
+
+            smooth_factor = CFG.POSTPROCESS.TRACK_CENTER_SMOOTH_FACTOR
+            track_pix_index = _group_pixels_by_label(pix_label_index, track_ids.shape[0])
+            for label_index, track_id in enumerate(track_ids.tolist()):
+                idx = track_pix_index[label_index]
+                if track_id == -1 or idx.shape[0] < CFG.POSTPROCESS.TRACK_MIN_LANE_PIXELS:
+                    continue
+                track = self._tracks[track_id]
+                track['center'] = (1 - smooth_factor) * track['center'] + \
+                    smooth_factor * np.mean(lane_embedding_feats[idx], axis=0)
+                lane_coords.append(coord[idx])
+                self._frame_lane_ids.append(track_id)
+                label_lane[label_index] = True
+
+            if with_mask:
+                lane_pix = label_lane[pix_label_index]
+                _paint_lane_pixels(mask, coord[lane_pix], track_ids[pix_label_index[lane_pix]], self._palette)
+
+        return mask, lane_coords
+
+    def _fit_lanes(self, lane_coords, camera_profile, image_shape, timer=_NULL_STAGE_TIMER):
+        """
+        fit every lane and smooth the fit params of every tracked lane with its fit params of the previous
+        frames by CFG.POSTPROCESS.TRACK_FIT_SMOOTH_FACTOR
+        :param lane_coords:
+        :param camera_profile:
+        :param image_shape:
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        fit_params = super(LaneNetStreamPostProcessor, self)._fit_lanes(
+            lane_coords, camera_profile, image_shape, timer=timer)
+
+        smooth_factor = CFG.POSTPROCESS.TRACK_FIT_SMOOTH_FACTOR
+        for index, track_id in enumerate(self._frame_lane_ids):
+            track = self._tracks[track_id]
+            if track['fit_param'] is not None:
+                fit_params[index] = (1 - smooth_factor) * track['fit_param'] + smooth_factor * fit_params[index]
+            track['fit_param'] = fit_params[index]
+
+        return fit_params
+
+    def _get_lane_color(self, lane_index):
+        """
+        get the color of the lane id of the lane so a tracked lane keeps its color
+        :param lane_index:
+        :return:
+        """
+        return self._color_map[self._frame_lane_ids[lane_index] % len(self._color_map)]
+
+    def _postprocess(self, binary_seg_result, instance_seg_result, min_area_threshold, source_image,
+                     data_source, headless, timer):
+        """
+        postprocess the next frame of the stream, see LaneNetPostProcessor.postprocess. The result also
+        holds the lane ids of the lanes in lane_ids
+        :param binary_seg_result:
+        :param instance_seg_result:
+        :param min_area_threshold:
+        :param source_image:
+        :param data_source:
+        :param headless:
+        :param timer: stage timer of the postprocess call
+        :return:
+        """
+        ret = super(LaneNetStreamPostProcessor, self)._postprocess(
+            binary_seg_result=binary_seg_result,
+            instance_seg_result=instance_seg_result,
+            min_area_threshold=min_area_threshold,
+            source_image=source_image,
+            data_source=data_source,
+            headless=headless,
+            timer=timer
+        )
+        ret['lane_ids'] = list(self._frame_lane_ids) if ret['fit_params'] is not None else None
+
+        return ret
+
+    def postprocess_batch(self, binary_seg_results, instance_seg_results=None, source_images=None,
+                          min_area_threshold=None, data_source='tusimple', headless=False, with_timings=False,
+                          workers=None):
+        """
+        postprocess a batch of consecutive frames of the stream one by one in frame order, the tracks of a
+        frame depend on the previous frame so the frames are not spread over worker processes
+        :param binary_seg_results:
+        :param instance_seg_results:
+        :param source_images:
+        :param min_area_threshold:
+        :param data_source:
+        :param headless:
+        :param with_timings:
+        :param workers: unused
+        :return: the postprocess result of every frame in input order
+        """
+        if isinstance(binary_seg_results, dict):
+            binary_seg_results, instance_seg_results = split_sparse_seg_results(binary_seg_results)
+        ret = []
+        for index, binary_seg_result in enumerate(binary_seg_results):
+            ret.append(self.postprocess(
+                binary_seg_result=binary_seg_result,
+                instance_seg_result=instance_seg_results[index],
+                min_area_threshold=min_area_threshold,
+                source_image=None if source_images is None else source_images[index],
+                data_source=data_source,
+                headless=headless,
+                with_timings=with_timings
+            ))
+
+        return ret
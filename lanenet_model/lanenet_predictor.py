@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : lanenet_predictor.py
+# @IDE: PyCharm
+"""
+Warm in process LaneNet predictor
+"""
+import abc
+import os.path as ops
+import threading
+
+import cv2
+import glog as log
+import numpy as np
+import tensorflow as tf
+
+from config import global_config
+from lanenet_model import lanenet
+from lanenet_model import lanenet_postprocess
+
+CFG = global_config.cfg
+
+# the outputs of the inference graph, convert_pb.py exports them under these names and keys
+INPUT_TENSOR_KEY = 'input_tensor'
+OUTPUT_SCOPE = 'lanenet_outputs'
+DENSE_OUTPUT_KEYS = ('binary_seg_ret', 'instance_seg_ret')
+SPARSE_OUTPUT_KEYS = ('binary_seg_mask', 'foreground_coords', 'foreground_embedding_feats')
+
+
+def build_inference_graph(net_flag='vgg', slim=False, batch_size=None):
+    """
+    build the lanenet inference graph of a uint8 image batch in the default graph, the outputs are named
+    OUTPUT_SCOPE/key so a frozen graph of it can be fetched by name
+    :param net_flag:
+    :param slim: see LaneNet
+    :param batch_size: static batch size of the input tensor, default any batch size
+    :return: the input tensor and the dict of the DENSE_OUTPUT_KEYS and SPARSE_OUTPUT_KEYS output tensors
+    """
+    input_tensor = tf.placeholder(
+        dtype=tf.uint8, shape=[batch_size, CFG.TRAIN.IMG_HEIGHT, CFG.TRAIN.IMG_WIDTH, 3], name=INPUT_TENSOR_KEY)
+    net = lanenet.LaneNet(phase='test', net_flag=net_flag, slim=slim)
+    binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
+    sparse_ret = net.gather_foreground(
+        binary_seg_prediction=binary_seg_ret,
+        instance_seg_prediction=instance_seg_ret,
+        name='lanenet_model_sparse_gather'
+    )
+
+    outputs = dict(sparse_ret)
+    outputs['binary_seg_ret'] = binary_seg_ret
+    outputs['instance_seg_ret'] = instance_seg_ret
+    with tf.name_scope(OUTPUT_SCOPE):
+        ret = {key: tf.identity(outputs[key], name=key) for key in DENSE_OUTPUT_KEYS + SPARSE_OUTPUT_KEYS}
+
+    return input_tensor, ret
+
+
+class _LaneNetPredictorBase(abc.ABC):
+    """
+    Preprocessing and lane prediction shared by the predictor backends, the backends implement warmup,
+    inference and _close_backend
+    """
+    def __init__(self, net_flag='vgg', postprocessor=None):
+        """
+
+        :param net_flag: backbone of the model, selects the image preprocessing
+        :param postprocessor: LaneNetPostProcessor of the predictions, default build one with the default settings
+        """
+        if net_flag not in ('vgg', 'mobilenet_v2'):
+            raise ValueError('Wrong net flag: {}, now only support vgg and mobilenet_v2'.format(net_flag))
+        self._net_flag = net_flag
+        self._image_size = (CFG.TRAIN.IMG_WIDTH, CFG.TRAIN.IMG_HEIGHT)
+        self._postprocessor = postprocessor if postprocessor is not None else \
+            lanenet_postprocess.LaneNetPostProcessor()
+        self._input_dtype = np.uint8
+        self._sparse_fetches = None
+
+    @property
+    def postprocessor(self):
+        """
+
+        :return:
+        """
+        return self._postprocessor
+
+    @property
+    def has_sparse_outputs(self):
+        """
+
+        :return: True if inference supports sparse
+        """
+        return self._sparse_fetches is not None
+
+    @abc.abstractmethod
+    def warmup(self, batch_size=1):
+        """
+        run a dummy batch so the backend setup is paid up front
+        :param batch_size:
+        :return:
+        """
+
+    @abc.abstractmethod
+    def inference(self, images, sparse=False, preprocessed=False):
+        """
+        see LaneNetPredictor.inference
+        :param images:
+        :param sparse:
+        :param preprocessed:
+        :return:
+        """
+
+    @abc.abstractmethod
+    def _close_backend(self):
+        """
+
+        :return:
+        """
+
+    def preprocess(self, image):
+        """
+        resize a uint8 BGR source image to the net input size. The image is normalized like the backbone was
+        trained in graph, only the legacy frozen graphs with a float32 input get it normalized here
+        :param image:
+        :return:
+        """
+        if image.shape[1] != self._image_size[0] or image.shape[0] != self._image_size[1]:
+            image = cv2.resize(image, self._image_size, interpolation=cv2.INTER_LINEAR)
+        if self._input_dtype == np.uint8:
+            return np.asarray(image, dtype=np.uint8)
+
+        if self._net_flag == 'vgg':
+            image = image / np.float32(127.5) - np.float32(1.0)
+        else:
+            image = image - np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+        return np.asarray(image, dtype=np.float32)
+
+    def predict(self, image, headless=False, data_source='tusimple', with_timings=False):
+        """
+        predict the lanes of one image, the lanes are drawn into the image in place like postprocess does
+        :param image: BGR source image
+        :param headless: see LaneNetPostProcessor.postprocess
+        :param data_source:
+        :param with_timings:
+        :return: the postprocess result
+        """
+        binary_seg_images, instance_seg_images = self.inference([image])
+
+        return self._postprocessor.postprocess(
+            binary_seg_result=binary_seg_images[0],
+            instance_seg_result=instance_seg_images[0],
+            source_image=None if headless else image,
+            data_source=data_source,
+            headless=headless,
+            with_timings=with_timings
+        )
+
+    def predict_batch(self, images, headless=False, data_source='tusimple', with_timings=False, workers=None,
+                      preprocessed=False):
+        """
+        predict the lanes of a batch of images in one inference, the frames are postprocessed by
+        LaneNetPostProcessor.postprocess_batch from the sparse outputs if the model has them
+        :param images: list of BGR source images
+        :param headless:
+        :param data_source:
+        :param with_timings:
+        :param workers: postprocess worker process nums, see LaneNetPostProcessor.postprocess_batch
+        :param preprocessed: the images are preprocess results, only supported in headless mode
+        :return: the postprocess result of every image in input order
+        """
+        if preprocessed and not headless:
+            raise ValueError('Wrong predict mode, preprocessed images are only supported in headless mode')
+        if len(images) == 0:
+            return []
+        if self.has_sparse_outputs:
+            binary_seg_results = self.inference(images, sparse=True, preprocessed=preprocessed)
+            instance_seg_results = None
+        else:
+            binary_seg_results, instance_seg_results = self.inference(images, preprocessed=preprocessed)
+
+        return self._postprocessor.postprocess_batch(
+            binary_seg_results=binary_seg_results,
+            instance_seg_results=instance_seg_results,
+            source_images=None if headless else images,
+            data_source=data_source,
+            headless=headless,
+            with_timings=with_timings,
+            workers=workers
+        )
+
+    def close(self):
+        """
+        close the backend and the postprocess worker processes
+        :return:
+        """
+        self._postprocessor.close()
+        self._close_backend()
+
+
+class LaneNetPredictor(_LaneNetPredictorBase):
+    """
+    Load a lanenet checkpoint, frozen graph or SavedModel once, warm it up and predict the lanes of images. A
+    session runs concurrent calls safely, so one predictor can serve several threads
+    """
+    def __init__(self, weights_path, net_flag='vgg', slim=False, use_gpu=True, postprocessor=None,
+                 warmup_batch_size=1, input_tensor_name='input_tensor:0', binary_seg_tensor_name=None,
+                 instance_seg_tensor_name=None, num_threads=None):
+        """
+
+        :param weights_path: checkpoint path, frozen graph .pb file path or SavedModel dir exported by
+        convert_pb.py. The exported models are imported as they are, without building the net. None builds
+        the net with randomly initialized weights, only meant for benchmarking
+        :param net_flag: backbone of the model, selects the image preprocessing
+        :param slim: build the slim inference graph of the checkpoint, see LaneNet
+        :param use_gpu:
+        :param postprocessor: LaneNetPostProcessor of the predictions, default build one with the default settings
+        :param warmup_batch_size: batch size of the dummy batch run once to warm up the graph, 0 to skip it
+        :param input_tensor_name: input tensor name of a frozen graph not exported by convert_pb.py
+        :param binary_seg_tensor_name: binary segmentation tensor name of a frozen graph not exported by
+        convert_pb.py, default the backend binary_seg ArgMax of net_flag
+        :param instance_seg_tensor_name: instance segmentation tensor name of a frozen graph not exported by
+        convert_pb.py, default the backend pix_embedding_conv Conv2D of net_flag
+        :param num_threads: session intra op thread nums, default let tensorflow decide
+        """
+        super(LaneNetPredictor, self).__init__(net_flag=net_flag, postprocessor=postprocessor)
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            sess_config = tf.ConfigProto(allow_soft_placement=True)
+            if not use_gpu:
+                sess_config.device_count['GPU'] = 0
+            if num_threads is not None:
+                sess_config.intra_op_parallelism_threads = num_threads
+            sess_config.gpu_options.per_process_gpu_memory_fraction = CFG.TEST.GPU_MEMORY_FRACTION
+            sess_config.gpu_options.allow_growth = CFG.TRAIN.TF_ALLOW_GROWTH
+            sess_config.gpu_options.allocator_type = 'BFC'
+            self._sess = tf.Session(config=sess_config, graph=self._graph)
+
+            if weights_path is None:
+                self._build_graph(slim)
+                self._sess.run(tf.global_variables_initializer())
+                log.warning('No weights path given, the lanenet weights are randomly initialized')
+            elif ops.isdir(weights_path):
+                self._load_saved_model(weights_path)
+            elif weights_path.endswith('.pb'):
+                self._load_frozen_graph(
+                    weights_path, input_tensor_name, binary_seg_tensor_name, instance_seg_tensor_name)
+            else:
+                self._build_graph(slim)
+                tf.train.Saver().restore(sess=self._sess, save_path=weights_path)
+        self._graph.finalize()
+
+        if warmup_batch_size > 0:
+            self.warmup(warmup_batch_size)
+
+    def _set_fetches(self, input_tensor, outputs):
+        """
+
+        :param input_tensor:
+        :param outputs: dict of the output tensors, the sparse outputs are optional
+        :return:
+        """
+        self._input_tensor = input_tensor
+        self._input_dtype = input_tensor.dtype.as_numpy_dtype
+        self._dense_fetches = [outputs[key] for key in DENSE_OUTPUT_KEYS]
+        self._sparse_fetches = None
+        if all(key in outputs for key in SPARSE_OUTPUT_KEYS):
+            self._sparse_fetches = {key: outputs[key] for key in SPARSE_OUTPUT_KEYS}
+
+    def _build_graph(self, slim):
+        """
+        build the inference graph of the checkpoint with both the dense and the sparse outputs
+        :param slim:
+        :return:
+        """
+        input_tensor, outputs = build_inference_graph(net_flag=self._net_flag, slim=slim)
+        self._set_fetches(input_tensor, outputs)
+
+    def _load_saved_model(self, saved_model_dir):
+        """
+        load the serving signature of a SavedModel exported by convert_pb.py
+        :param saved_model_dir:
+        :return:
+        """
+        meta_graph_def = tf.saved_model.loader.load(
+            self._sess, [tf.saved_model.tag_constants.SERVING], saved_model_dir)
+        signature = meta_graph_def.signature_def[tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+        outputs = {key: self._graph.get_tensor_by_name(tensor_info.name)
+                   for key, tensor_info in signature.outputs.items()}
+        self._set_fetches(self._graph.get_tensor_by_name(signature.inputs[INPUT_TENSOR_KEY].name), outputs)
+
+    def _load_frozen_graph(self, pb_file_path, input_tensor_name, binary_seg_tensor_name, instance_seg_tensor_name):
+        """
+        import the frozen graph. The graphs exported by convert_pb.py have the named dense and sparse outputs,
+        other graphs are fetched by the given tensor names and only have the dense outputs. Graphs frozen with a
+        float32 input tensor are fed images normalized in numpy, graphs with a uint8 input tensor normalize
+        them in graph
+        :param pb_file_path:
+        :param input_tensor_name:
+        :param binary_seg_tensor_name:
+        :param instance_seg_tensor_name:
+        :return:
+        """
+        assert ops.exists(pb_file_path), '{:s} not exist'.format(pb_file_path)
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(pb_file_path, 'rb') as file:
+            graph_def.ParseFromString(file.read())
+        tf.import_graph_def(graph_def, name='')
+
+        node_names = set(node.name for node in graph_def.node)
+        exported_names = ['{:s}/{:s}'.format(OUTPUT_SCOPE, key) for key in DENSE_OUTPUT_KEYS + SPARSE_OUTPUT_KEYS]
+        if binary_seg_tensor_name is None and instance_seg_tensor_name is None and \
+                all(name in node_names for name in exported_names[:len(DENSE_OUTPUT_KEYS)]):
+            outputs = {key: self._graph.get_tensor_by_name('{:s}:0'.format(name))
+                       for key, name in zip(DENSE_OUTPUT_KEYS + SPARSE_OUTPUT_KEYS, exported_names)
+                       if name in node_names}
+            self._set_fetches(self._graph.get_tensor_by_name('{:s}:0'.format(INPUT_TENSOR_KEY)), outputs)
+            return
+
+        if binary_seg_tensor_name is None:
+            binary_seg_tensor_name = self._get_backend_tensor_name('binary_seg/ArgMax:0')
+        if instance_seg_tensor_name is None:
+            instance_seg_tensor_name = self._get_backend_tensor_name('instance_seg/pix_embedding_conv/Conv2D:0')
+        outputs = {
+            'binary_seg_ret': self._graph.get_tensor_by_name(binary_seg_tensor_name),
+            'instance_seg_ret': self._graph.get_tensor_by_name(instance_seg_tensor_name)
+        }
+        self._set_fetches(self._graph.get_tensor_by_name(input_tensor_name), outputs)
+
+    def _get_backend_tensor_name(self, tensor_name):
+        """
+
+        :param tensor_name: tensor name in the backend scope
+        :return:
+        """
+        return 'lanenet_model/{:s}_backend/{:s}'.format(self._net_flag, tensor_name)
+
+    def warmup(self, batch_size=1):
+        """
+        run a dummy batch so the session setup and the first run graph optimization are paid up front
+        :param batch_size:
+        :return:
+        """
+        fetches = self._sparse_fetches if self._sparse_fetches is not None else self._dense_fetches
+        dummy_images = np.zeros(
+            shape=[batch_size, self._image_size[1], self._image_size[0], 3],
+            dtype=self._input_dtype
+        )
+        self._sess.run(fetches, feed_dict={self._input_tensor: dummy_images})
+        log.info('LaneNet predictor warmed up with a batch of {:d} images'.format(batch_size))
+
+    def inference(self, images, sparse=False, preprocessed=False):
+        """
+        run the net on a batch of images
+        :param images: list of BGR source images, or of preprocess results if preprocessed
+        :param sparse: return the LaneNet.inference_sparse result instead of the dense results, not supported
+        by the frozen graphs without the sparse outputs
+        :param preprocessed:
+        :return: [batch, height, width] binary and [batch, height, width, dims] instance segmentation results
+        or the LaneNet.inference_sparse result dict
+        """
+        if sparse and self._sparse_fetches is None:
+            raise ValueError('Wrong inference mode, the loaded graph has no sparse outputs')
+        if not preprocessed:
+            images = [self.preprocess(image) for image in images]
+
+        fetches = self._sparse_fetches if sparse else self._dense_fetches
+        ret = self._sess.run(fetches, feed_dict={self._input_tensor: np.stack(images, axis=0)})
+
+        return ret if sparse else tuple(ret)
+
+    def _close_backend(self):
+        """
+
+        :return:
+        """
+        self._sess.close()
+
+
+class LaneNetTFLitePredictor(_LaneNetPredictorBase):
+    """
+    Predict the lanes of images with a TFLite model exported by convert_tflite.py. The TFLite interpreter is
+    not thread safe, the inference calls of several threads are serialized
+    """
+    def __init__(self, tflite_model_path, net_flag='vgg', postprocessor=None, warmup_batch_size=1,
+                 num_threads=None):
+        """
+
+        :param tflite_model_path:
+        :param net_flag: backbone of the model, selects the image preprocessing
+        :param postprocessor: LaneNetPostProcessor of the predictions, default build one with the default settings
+        :param warmup_batch_size: image nums run once to warm up the interpreter, 0 to skip it
+        :param num_threads: interpreter cpu thread nums, default let tflite decide. Needs tensorflow 2.3 or above
+        """
+        super(LaneNetTFLitePredictor, self).__init__(net_flag=net_flag, postprocessor=postprocessor)
+        assert ops.exists(tflite_model_path), '{:s} not exist'.format(tflite_model_path)
+
+        interpreter_kwargs = {} if num_threads is None else {'num_threads': num_threads}
+        self._interpreter = tf.lite.Interpreter(model_path=tflite_model_path, **interpreter_kwargs)
+        self._interpreter.allocate_tensors()
+        self._interpreter_lock = threading.Lock()
+
+        input_details = self._interpreter.get_input_details()[0]
+        self._input_index = input_details['index']
+        self._input_dtype = input_details['dtype']
+        self._input_shape = tuple(input_details['shape'])
+        if self._input_shape[1:3] != (self._image_size[1], self._image_size[0]):
+            raise ValueError('Wrong tflite model input shape: {}, now only support [1, {:d}, {:d}, 3]'.format(
+                self._input_shape, self._image_size[1], self._image_size[0]))
+
+        output_details = {
+            detail['name'].split(':')[0]: detail for detail in self._interpreter.get_output_details()
+        }
+        self._output_details = []
+        for key in DENSE_OUTPUT_KEYS:
+            output_name = '{:s}/{:s}'.format(OUTPUT_SCOPE, key)
+            if output_name not in output_details:
+                raise ValueError('Wrong tflite model, output {:s} not found'.format(output_name))
+            self._output_details.append(output_details[output_name])
+
+        if warmup_batch_size > 0:
+            self.warmup(warmup_batch_size)
+
+    def _get_output(self, output_details):
+        """
+        get an output of the last invoke, dequantized if the output is quantized
+        :param output_details:
+        :return:
+        """
+        output = self._interpreter.get_tensor(output_details['index'])
+        scale, zero_point = output_details['quantization']
+        if scale > 0 and np.issubdtype(output.dtype, np.integer) and output.ndim == 4:
+            output = (output.astype(np.float32) - zero_point) * scale
+
+        return output
+
+    def warmup(self, batch_size=1):
+        """
+        invoke the interpreter once per dummy image so the first real call does not pay the kernel setup
+        :param batch_size:
+        :return:
+        """
+        dummy_images = np.zeros(shape=[batch_size, self._image_size[1], self._image_size[0], 3],
+                                dtype=self._input_dtype)
+        self.inference(dummy_images, preprocessed=True)
+        log.info('LaneNet tflite predictor warmed up with {:d} images'.format(batch_size))
+
+    def inference(self, images, sparse=False, preprocessed=False):
+        """
+        run the model on a batch of images, the tflite model has a fixed batch size of 1 so the images are
+        invoked one by one
+        :param images: list of BGR source images, or of preprocess results if preprocessed
+        :param sparse: not supported by tflite models
+        :param preprocessed:
+        :return: [batch, height, width] binary and [batch, height, width, dims] instance segmentation results
+        """
+        if sparse:
+            raise ValueError('Wrong inference mode, tflite models have no sparse outputs')
+        if not preprocessed:
+            images = [self.preprocess(image) for image in images]
+
+        binary_seg_images = []
+        instance_seg_images = []
+        with self._interpreter_lock:
+            for image in images:
+                self._interpreter.set_tensor(self._input_index, np.expand_dims(image, axis=0))
+                self._interpreter.invoke()
+                binary_seg_images.append(self._get_output(self._output_details[0])[0])
+                instance_seg_images.append(self._get_output(self._output_details[1])[0])
+
+        return np.stack(binary_seg_images, axis=0), np.stack(instance_seg_images, axis=0)
+
+    def _close_backend(self):
+        """
+
+        :return:
+        """
+        self._interpreter = None
+
+
+def load_predictor(weights_path, net_flag='vgg', slim=False, use_gpu=True, postprocessor=None,
+                   warmup_batch_size=1, num_threads=None):
+    """
+    load the predictor backend of the weights, a LaneNetTFLitePredictor for .tflite models and a
+    LaneNetPredictor for checkpoints, frozen graphs and SavedModels
+    :param weights_path:
+    :param net_flag:
+    :param slim: see LaneNetPredictor
+    :param use_gpu: see LaneNetPredictor
+    :param postprocessor:
+    :param warmup_batch_size:
+    :param num_threads: see LaneNetPredictor and LaneNetTFLitePredictor
+    :return:
+    """
+    if weights_path is not None and weights_path.endswith('.tflite'):
+        return LaneNetTFLitePredictor(
+            tflite_model_path=weights_path,
+            net_flag=net_flag,
+            postprocessor=postprocessor,
+            warmup_batch_size=warmup_batch_size,
+            num_threads=num_threads
+        )
+
+    return LaneNetPredictor(
+        weights_path=weights_path,
+        net_flag=net_flag,
+        slim=slim,
+        use_gpu=use_gpu,
+        postprocessor=postprocessor,
+        warmup_batch_size=warmup_batch_size,
+        num_threads=num_threads
+    )
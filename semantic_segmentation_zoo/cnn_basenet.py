@@ -316,6 +316,79 @@ class CNNBaseModel(object):
 
         return tf.layers.batch_normalization(inputs=inputdata, training=is_training, name=name)
 
+    @staticmethod
+    def layerbn_fold_params(channel_nums, name, epsilon=1e-3):
+        """
+        get the inference time scale and offset of a layerbn from its moving statistics. The variables are
+        named like the ones of tf.layers.batch_normalization so the same checkpoint restores both
+        :param channel_nums:
+        :param name: name of the layerbn
+        :param epsilon: the tf.layers.batch_normalization default epsilon
+        :return: scale, offset
+        """
+        with tf.variable_scope(name):
+            gamma = tf.get_variable('gamma', [channel_nums], initializer=tf.ones_initializer())
+            beta = tf.get_variable('beta', [channel_nums], initializer=tf.zeros_initializer())
+            moving_mean = tf.get_variable(
+                'moving_mean', [channel_nums], initializer=tf.zeros_initializer(), trainable=False)
+            moving_variance = tf.get_variable(
+                'moving_variance', [channel_nums], initializer=tf.ones_initializer(), trainable=False)
+
+            scale = tf.multiply(gamma, tf.rsqrt(moving_variance + epsilon), name='fold_scale')
+            offset = tf.subtract(beta, moving_mean * scale, name='fold_offset')
+
+        return scale, offset
+
+    @staticmethod
+    def layerbn_affine(inputdata, name):
+        """
+        inference time layerbn which does not follow a convolution and can not be folded, applied as one
+        scale and offset
+        :param inputdata:
+        :param name: name of the layerbn
+        :return:
+        """
+        scale, offset = CNNBaseModel.layerbn_fold_params(
+            channel_nums=inputdata.get_shape().as_list()[-1], name=name)
+
+        return tf.nn.bias_add(tf.multiply(inputdata, scale), offset)
+
+    @staticmethod
+    def conv2d_bn(inputdata, out_channel, kernel_size, bn_name, padding='SAME', stride=1,
+                  w_init=None, use_bias=False, name=None):
+        """
+        inference time conv2d followed by the layerbn named bn_name with the layerbn folded into the
+        convolution weights and bias, restored from the checkpoint of the conv2d and layerbn pair
+        :param inputdata:
+        :param out_channel:
+        :param kernel_size: int so only support square kernel convolution
+        :param bn_name: name of the layerbn
+        :param padding:
+        :param stride: int so only support square stride
+        :param w_init:
+        :param use_bias:
+        :param name: name of the conv2d
+        :return:
+        """
+        with tf.variable_scope(name):
+            in_channel = inputdata.get_shape().as_list()[3]
+            assert in_channel is not None, "[Conv2D] Input cannot have unknown channel!"
+
+            if w_init is None:
+                w_init = tf.contrib.layers.variance_scaling_initializer()
+            w = tf.get_variable('w', [kernel_size, kernel_size, in_channel, out_channel], initializer=w_init)
+            b = None
+            if use_bias:
+                b = tf.get_variable('b', [out_channel], initializer=tf.constant_initializer())
+
+        scale, offset = CNNBaseModel.layerbn_fold_params(channel_nums=out_channel, name=bn_name)
+        if b is not None:
+            offset = offset + b * scale
+
+        conv = tf.nn.conv2d(inputdata, w * scale, [1, stride, stride, 1], padding.upper())
+
+        return tf.nn.bias_add(conv, offset)
+
     @staticmethod
     def layergn(inputdata, name, group_size=32, esp=1e-5):
         """
@@ -402,6 +475,59 @@ class CNNBaseModel(object):
                                              name=name)
         return ret
 
+    @staticmethod
+    def deconv2d_bn(inputdata, out_channel, kernel_size, bn_name, padding='SAME', stride=1,
+                    w_init=None, use_bias=False, name=None):
+        """
+        inference time deconv2d followed by the layerbn named bn_name with the layerbn folded into the
+        transposed convolution kernel and bias, restored from the checkpoint of the deconv2d and layerbn pair
+        :param inputdata:
+        :param out_channel:
+        :param kernel_size: int so only support square kernel convolution
+        :param bn_name: name of the layerbn
+        :param padding: 'VALID' or 'SAME'
+        :param stride: int so only support square stride
+        :param w_init:
+        :param use_bias:
+        :param name: name of the deconv2d
+        :return:
+        """
+        padding = padding.upper()
+        in_shape = inputdata.get_shape().as_list()
+        assert in_shape[3] is not None, "[Deconv2D] Input cannot have unknown channel!"
+
+        # deconv2d builds its tf.layers.conv2d_transpose of the same name inside its own variable scope
+        with tf.variable_scope(name), tf.variable_scope(name):
+            if w_init is None:
+                w_init = tf.contrib.layers.variance_scaling_initializer()
+            kernel = tf.get_variable(
+                'kernel', [kernel_size, kernel_size, out_channel, in_shape[3]], initializer=w_init)
+            bias = None
+            if use_bias:
+                bias = tf.get_variable('bias', [out_channel], initializer=tf.constant_initializer())
+
+        scale, offset = CNNBaseModel.layerbn_fold_params(channel_nums=out_channel, name=bn_name)
+        if bias is not None:
+            offset = offset + bias * scale
+
+        def _get_output_length(input_length):
+            if padding == 'SAME':
+                return input_length * stride
+            return input_length * stride + max(kernel_size - stride, 0)
+
+        input_shape = tf.shape(inputdata)
+        output_shape = tf.stack([input_shape[0], _get_output_length(input_shape[1]),
+                                 _get_output_length(input_shape[2]), out_channel])
+        deconv = tf.nn.conv2d_transpose(
+            inputdata, kernel * tf.reshape(scale, [1, 1, out_channel, 1]), output_shape,
+            [1, stride, stride, 1], padding)
+        deconv.set_shape([in_shape[0],
+                          None if in_shape[1] is None else _get_output_length(in_shape[1]),
+                          None if in_shape[2] is None else _get_output_length(in_shape[2]),
+                          out_channel])
+
+        return tf.nn.bias_add(deconv, offset)
+
     @staticmethod
     def dilation_conv(input_tensor, k_size, out_dims, rate, padding='SAME',
                       w_init=None, b_init=None, use_bias=False, name=None):
@@ -505,6 +631,44 @@ class CNNBaseModel(object):
 
             return conv
 
+    @staticmethod
+    def dwise_conv_bn(input, bn_name, k_h=3, k_w=3, channel_multiplier=1, strides=[1, 1, 1, 1],
+                      padding='SAME', stddev=0.02, name='dwise_conv', bias=False):
+        """
+        inference time dwise_conv followed by the layerbn named bn_name with the layerbn folded into the
+        depthwise convolution weights and bias, restored from the checkpoint of the dwise_conv and layerbn pair
+        :param input:
+        :param bn_name: name of the layerbn
+        :param k_h:
+        :param k_w:
+        :param channel_multiplier:
+        :param strides:
+        :param padding:
+        :param stddev:
+        :param name: name of the dwise_conv
+        :param bias:
+        :return:
+        """
+        with tf.variable_scope(name):
+            in_channel = input.get_shape().as_list()[-1]
+            w = tf.get_variable('w', [k_h, k_w, in_channel, channel_multiplier],
+                                regularizer=tf.contrib.layers.l2_regularizer(weight_decay),
+                                initializer=tf.truncated_normal_initializer(stddev=stddev))
+            biases = None
+            if bias:
+                biases = tf.get_variable('bias', [in_channel * channel_multiplier],
+                                         initializer=tf.constant_initializer(0.0))
+
+        scale, offset = CNNBaseModel.layerbn_fold_params(channel_nums=in_channel * channel_multiplier, name=bn_name)
+        if biases is not None:
+            offset = offset + biases * scale
+
+        # the output channel of input channel i and multiplier m is i * channel_multiplier + m
+        conv = tf.nn.depthwise_conv2d(
+            input, w * tf.reshape(scale, [in_channel, channel_multiplier]), strides, padding)
+
+        return tf.nn.bias_add(conv, offset)
+
     @staticmethod
     def relu6(inputdata, name=None):
         """
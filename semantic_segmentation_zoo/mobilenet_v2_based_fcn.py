@@ -22,12 +22,16 @@ class MOBILEV2FCN(cnn_basenet.CNNBaseModel):
     """
     VGG 16 based fcn net for semantic segmentation
     """
-    def __init__(self, phase):
+    def __init__(self, phase, fold_bn=False):
         """
 
+        :param phase:
+        :param fold_bn: fold the layerbn into the preceding convolution for inference only, the folded net
+        restores from the same checkpoint
         """
         super(MOBILEV2FCN, self).__init__()
         self._phase = phase
+        self._fold_bn = fold_bn
         self._is_training = self._is_net_for_training()
         self._net_intermediate_results = collections.OrderedDict()
 
@@ -56,6 +60,17 @@ class MOBILEV2FCN(cnn_basenet.CNNBaseModel):
         :return:
         """
         with tf.name_scope(name), tf.variable_scope(name):
+            if need_layer_norm and self._fold_bn:
+                bn = self.conv2d_bn(
+                    inputdata=input_tensor, out_channel=out_dims,
+                    kernel_size=k_size, bn_name='bn', stride=stride,
+                    use_bias=False, padding=pad, name='conv2d'
+                )
+
+                relu = self.relu(inputdata=bn, name='relu')
+
+                return relu
+
             conv = self.conv2d(
                 inputdata=input_tensor, out_channel=out_dims,
                 kernel_size=k_size, stride=stride,
@@ -75,21 +90,34 @@ class MOBILEV2FCN(cnn_basenet.CNNBaseModel):
         with tf.name_scope(name), tf.variable_scope(name):
             # pw
             bottleneck_dim = round(expansion_ratio * input.get_shape().as_list()[-1])
-            with tf.name_scope('pw'):
-                net = self.conv2d(inputdata=input, out_channel=bottleneck_dim,
-                                  kernel_size=1, name='pw', use_bias=bias)
-            
-            net = self.layerbn(net, is_training=is_train, name='pw_bn')
-            net = self.relu6(net)
-            # dw
-            net = self.dwise_conv(net, strides=[1, stride, stride, 1], name='dw', bias=bias)
-            net = self.layerbn(net, is_training=is_train, name='dw_bn')
-            net = self.relu6(net)
-            # pw & linear
-            with tf.name_scope('pw_linear'):
-                net = self.conv2d(inputdata=net, out_channel=output_dim,
-                                  kernel_size=1, name='pw_linear', use_bias=bias)
-            net = self.layerbn(net, is_training=is_train, name='pw_linear_bn')
+            if self._fold_bn:
+                with tf.name_scope('pw'):
+                    net = self.conv2d_bn(inputdata=input, out_channel=bottleneck_dim,
+                                         kernel_size=1, bn_name='pw_bn', name='pw', use_bias=bias)
+                net = self.relu6(net)
+                # dw
+                net = self.dwise_conv_bn(net, bn_name='dw_bn', strides=[1, stride, stride, 1], name='dw', bias=bias)
+                net = self.relu6(net)
+                # pw & linear
+                with tf.name_scope('pw_linear'):
+                    net = self.conv2d_bn(inputdata=net, out_channel=output_dim,
+                                         kernel_size=1, bn_name='pw_linear_bn', name='pw_linear', use_bias=bias)
+            else:
+                with tf.name_scope('pw'):
+                    net = self.conv2d(inputdata=input, out_channel=bottleneck_dim,
+                                      kernel_size=1, name='pw', use_bias=bias)
+
+                net = self.layerbn(net, is_training=is_train, name='pw_bn')
+                net = self.relu6(net)
+                # dw
+                net = self.dwise_conv(net, strides=[1, stride, stride, 1], name='dw', bias=bias)
+                net = self.layerbn(net, is_training=is_train, name='dw_bn')
+                net = self.relu6(net)
+                # pw & linear
+                with tf.name_scope('pw_linear'):
+                    net = self.conv2d(inputdata=net, out_channel=output_dim,
+                                      kernel_size=1, name='pw_linear', use_bias=bias)
+                net = self.layerbn(net, is_training=is_train, name='pw_linear_bn')
 
             # element wise add, only for stride==1
             if shortcut and stride == 1:
@@ -130,13 +158,20 @@ class MOBILEV2FCN(cnn_basenet.CNNBaseModel):
             deconv_weights_init = tf.truncated_normal_initializer(
                 mean=0.0, stddev=deconv_weights_stddev)
 
-            deconv = self.deconv2d(
-                inputdata=input_tensor, out_channel=out_channels_nums, kernel_size=kernel_size,
-                stride=stride, use_bias=use_bias, w_init=deconv_weights_init,
-                name='deconv'
-            )
+            if self._fold_bn:
+                deconv = self.deconv2d_bn(
+                    inputdata=input_tensor, out_channel=out_channels_nums, kernel_size=kernel_size,
+                    bn_name='deconv_bn', stride=stride, use_bias=use_bias, w_init=deconv_weights_init,
+                    name='deconv'
+                )
+            else:
+                deconv = self.deconv2d(
+                    inputdata=input_tensor, out_channel=out_channels_nums, kernel_size=kernel_size,
+                    stride=stride, use_bias=use_bias, w_init=deconv_weights_init,
+                    name='deconv'
+                )
 
-            deconv = self.layerbn(inputdata=deconv, is_training=self._is_training, name='deconv_bn')
+                deconv = self.layerbn(inputdata=deconv, is_training=self._is_training, name='deconv_bn')
 
             deconv = self.relu(inputdata=deconv, name='deconv_relu')
 
@@ -146,9 +181,13 @@ class MOBILEV2FCN(cnn_basenet.CNNBaseModel):
 
             if need_activate:
 
-                fuse_feats = self.layerbn(
-                    inputdata=fuse_feats, is_training=self._is_training, name='fuse_gn'
-                )
+                if self._fold_bn:
+                    # the fused feats are not a convolution output so the layerbn can not be folded
+                    fuse_feats = self.layerbn_affine(inputdata=fuse_feats, name='fuse_gn')
+                else:
+                    fuse_feats = self.layerbn(
+                        inputdata=fuse_feats, is_training=self._is_training, name='fuse_gn'
+                    )
 
                 fuse_feats = self.relu(inputdata=fuse_feats, name='fuse_relu')
 
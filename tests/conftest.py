@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : conftest.py
+# @IDE: PyCharm
+"""
+Shared fixtures of the lanenet tests
+"""
+import os.path as ops
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT_DIR = ops.dirname(ops.dirname(ops.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def write_ipm_remap_file(file_path):
+    """
+    write a synthetic tusimple ipm remap file, the 640x640 ipm image covers the road of the 1280x720 source image
+    :param file_path:
+    :return:
+    """
+    src = np.float32([[0, 0], [640, 0], [640, 640], [0, 640]])
+    dst = np.float32([[300, 240], [980, 240], [3780, 720], [-2500, 720]])
+    homography = cv2.getPerspectiveTransform(src, dst)
+    ys, xs = np.mgrid[0:640, 0:640].astype(np.float64)
+    coords = homography.dot(np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)]))
+    remap_x = (coords[0] / coords[2]).reshape(640, 640).astype(np.float32)
+    remap_y = (coords[1] / coords[2]).reshape(640, 640).astype(np.float32)
+
+    fs = cv2.FileStorage(file_path, cv2.FILE_STORAGE_WRITE)
+    fs.write('remap_ipm_x', remap_x)
+    fs.write('remap_ipm_y', remap_y)
+    fs.release()
+
+
+@pytest.fixture(scope='session')
+def ipm_remap_file_path(tmp_path_factory):
+    """
+    the synthetic tusimple ipm remap file, the data/tusimple_ipm_remap.yml of the repo is not shipped
+    :param tmp_path_factory:
+    :return:
+    """
+    file_path = str(tmp_path_factory.mktemp('ipm') / 'tusimple_ipm_remap.yml')
+    write_ipm_remap_file(file_path)
+
+    return file_path
+
+
+@pytest.fixture(scope='session')
+def seg_results():
+    """
+    the saved binary_seg_image and instance_seg_image net outputs of a tusimple frame
+    :return:
+    """
+    seg_result_path = ops.join(ROOT_DIR, 'seg_iamge.npz')
+    if not ops.exists(seg_result_path):
+        pytest.skip('{:s} not exist'.format(seg_result_path))
+    seg_results = np.load(seg_result_path)
+
+    return seg_results['binary_seg_image'][0], seg_results['instance_seg_image'][0]
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : test_lanenet_batcher.py
+# @IDE: PyCharm
+"""
+Test the dynamic request batcher of the lanenet server
+"""
+import threading
+import time
+
+import pytest
+
+from lanenet_model import lanenet_batcher
+
+
+class _BlockingProcessFn(object):
+    """
+    process_fn doubling the items of a batch, the first batch blocks until release is called so the later
+    requests pile up in the queue
+    """
+    def __init__(self):
+        """
+
+        """
+        self.batches = []
+        self.entered = threading.Event()
+        self._released = threading.Event()
+
+    def release(self):
+        """
+
+        :return:
+        """
+        self._released.set()
+
+    def __call__(self, items):
+        """
+
+        :param items:
+        :return:
+        """
+        self.batches.append(list(items))
+        self.entered.set()
+        assert self._released.wait(5.0), 'process_fn was never released'
+
+        return [item * 2 for item in items]
+
+
+@pytest.fixture()
+def process_fn():
+    """
+
+    :return:
+    """
+    ret = _BlockingProcessFn()
+    yield ret
+    ret.release()
+
+
+def _start_batcher(process_fn, **kwargs):
+    """
+    start a batcher and block its processing on a first request of item 0
+    :param process_fn:
+    :param kwargs: DynamicBatcher kwargs
+    :return: the batcher and the first request
+    """
+    batcher = lanenet_batcher.DynamicBatcher(process_fn, **kwargs)
+    batcher.start()
+    first_request = batcher.submit(0)
+    assert process_fn.entered.wait(5.0)
+
+    return batcher, first_request
+
+
+def test_requests_are_batched_up_to_max_batch_size(process_fn):
+    """
+    the requests queued while a batch is processed are gathered into batches of at most max_batch_size in
+    submit order
+    :param process_fn:
+    :return:
+    """
+    batcher, first_request = _start_batcher(process_fn, max_batch_size=3, max_wait_time=0.05)
+    try:
+        requests = [batcher.submit(item) for item in range(1, 8)]
+        process_fn.release()
+        results = [request.result() for request in requests]
+        assert first_request.result() == 0
+    finally:
+        batcher.stop()
+
+    assert results == [item * 2 for item in range(1, 8)]
+    assert process_fn.batches == [[0], [1, 2, 3], [4, 5, 6], [7]]
+    stats = batcher.get_stats()
+    assert stats['request_nums'] == 8
+    assert stats['batch_nums'] == 4
+    assert stats['mean_batch_size'] == 2.0
+
+
+def test_submit_rejects_requests_when_queue_is_full(process_fn):
+    """
+    submit raises BatcherFullError instead of blocking once max_queue_size requests are pending
+    :param process_fn:
+    :return:
+    """
+    batcher, _ = _start_batcher(process_fn, max_batch_size=4, max_wait_time=0.0, max_queue_size=2)
+    try:
+        requests = [batcher.submit(item) for item in range(1, 3)]
+        with pytest.raises(lanenet_batcher.BatcherFullError):
+            batcher.submit(3)
+        stats = batcher.get_stats()
+        process_fn.release()
+        results = [request.result() for request in requests]
+    finally:
+        batcher.stop()
+
+    assert results == [2, 4]
+    assert stats['rejected_nums'] == 1
+    assert stats['pending_nums'] == 2
+
+
+def test_expired_requests_are_dropped(process_fn):
+    """
+    a request whose deadline passes while queued is dropped before it reaches process_fn, waiting for a
+    request gives up at its deadline
+    :param process_fn:
+    :return:
+    """
+    batcher, _ = _start_batcher(process_fn, max_batch_size=4, max_wait_time=0.0)
+    try:
+        expired_request = batcher.submit(1, timeout=0.05)
+        live_request = batcher.submit(2)
+        t_start = time.perf_counter()
+        with pytest.raises(lanenet_batcher.DeadlineExceededError):
+            expired_request.result()
+        assert time.perf_counter() - t_start < 1.0
+        process_fn.release()
+        assert live_request.result() == 4
+    finally:
+        batcher.stop()
+
+    assert process_fn.batches == [[0], [2]]
+    assert batcher.get_stats()['expired_nums'] == 1
+
+
+def test_stop_fails_pending_requests(process_fn):
+    """
+    stop finishes the batch being processed, fails the pending requests with BatcherStoppedError and later
+    submits are rejected with BatcherStoppedError
+    :param process_fn:
+    :return:
+    """
+    batcher, first_request = _start_batcher(process_fn, max_batch_size=4, max_wait_time=0.0)
+    pending_requests = [batcher.submit(item) for item in range(1, 4)]
+    stop_thread = threading.Thread(target=batcher.stop)
+    stop_thread.start()
+    process_fn.release()
+    stop_thread.join(5.0)
+    assert not stop_thread.is_alive()
+
+    assert first_request.result() == 0
+    for request in pending_requests:
+        with pytest.raises(lanenet_batcher.BatcherStoppedError):
+            request.result()
+    with pytest.raises(lanenet_batcher.BatcherStoppedError):
+        batcher.submit(4)
+    assert process_fn.batches == [[0]]
+
+
+def test_stop_during_concurrent_submits_answers_every_request():
+    """
+    every request queued by submitters racing stop is either processed or failed by stop, none is left
+    pending after stop returns
+    :return:
+    """
+    batcher = lanenet_batcher.DynamicBatcher(lambda items: list(items), max_batch_size=4, max_wait_time=0.0,
+                                             max_queue_size=1024)
+    batcher.start()
+    requests = []
+    requests_lock = threading.Lock()
+    submit_stopped = threading.Event()
+
+    def _submit():
+        while not submit_stopped.is_set():
+            try:
+                request = batcher.submit(0)
+            except lanenet_batcher.BatcherFullError:
+                continue
+            except lanenet_batcher.BatcherStoppedError:
+                return
+            with requests_lock:
+                requests.append(request)
+
+    submit_threads = [threading.Thread(target=_submit) for _ in range(4)]
+    for thread in submit_threads:
+        thread.start()
+    time.sleep(0.05)
+    batcher.stop()
+    submit_stopped.set()
+    for thread in submit_threads:
+        thread.join(5.0)
+
+    assert requests
+    for request in requests:
+        assert request._done_event.is_set()
@@ -0,0 +1,955 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : test_lanenet_postprocess.py
+# @IDE: PyCharm
+"""
+Test the lanenet postprocess on the saved net outputs of seg_iamge.npz
+"""
+import json
+import os
+import os.path as ops
+import shutil
+import time
+
+import cv2
+import numpy as np
+import pytest
+from sklearn.metrics import adjusted_rand_score
+
+from config import global_config
+from lanenet_model import lanenet_postprocess
+
+CFG = global_config.cfg
+
+BASELINE_RESULT_PATH = ops.join(ops.dirname(ops.abspath(__file__)), 'data', 'baseline_postprocess.npz')
+HEADLESS_TIMING_STAGES = {
+    'morphology', 'connect_components', 'small_component_filter', 'embedding_gather', 'scaler', 'cluster',
+    'lane_split', 'polyfit', 'ipm_remap', 'sampling'
+}
+
+
+def _get_lane_embedding_feats(seg_results):
+    """
+
+    :param seg_results:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+
+    return instance_seg_image[np.where(binary_seg_image == 1)]
+
+
+def _sort_lane_xs(lane_xs):
+    """
+    sort the sampled lanes from left to right, so the cluster label order does not matter
+    :param lane_xs:
+    :return:
+    """
+    mean_xs = [np.mean(xs[xs != -2]) if np.any(xs != -2) else np.inf for xs in lane_xs]
+
+    return np.asarray(lane_xs, dtype=np.float64)[np.argsort(mean_xs, kind='stable')]
+
+
+def _postprocess_headless(seg_results, ipm_remap_file_path, **kwargs):
+    """
+    postprocess the saved net outputs in headless mode twice, the result must be deterministic
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param kwargs: LaneNetPostProcessor kwargs
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path, **kwargs)
+    try:
+        ret = postprocessor.postprocess(seg_results[0], seg_results[1], headless=True)
+        repeated_ret = postprocessor.postprocess(seg_results[0], seg_results[1], headless=True)
+    finally:
+        postprocessor.close()
+
+    assert len(ret['fit_params']) > 0
+    np.testing.assert_array_equal(ret['lane_xs'], repeated_ret['lane_xs'])
+
+    return ret
+
+
+def _assert_baseline_lanes(lane_xs, baseline_lane_xs):
+    """
+    the lanes are the baseline lanes within a few source image pixels
+    :param lane_xs:
+    :param baseline_lane_xs: sorted baseline lanes
+    :return:
+    """
+    assert len(lane_xs) == baseline_lane_xs.shape[0]
+    lane_xs = _sort_lane_xs(lane_xs)
+    sampled = np.logical_and(lane_xs != -2, baseline_lane_xs != -2)
+    assert np.mean(sampled == (lane_xs != -2)) > 0.95
+    lane_xs_diff = np.abs(lane_xs - baseline_lane_xs)[sampled]
+    assert np.percentile(lane_xs_diff, 95) < 20.0
+    assert np.max(lane_xs_diff) < 40.0
+
+
+@pytest.fixture(scope='module')
+def baseline_lane_xs(seg_results, ipm_remap_file_path):
+    """
+    the sampled lanes of the default postprocess, which matches the baseline, sorted from left to right
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    return _sort_lane_xs(_postprocess_headless(seg_results, ipm_remap_file_path)['lane_xs'])
+
+
+def _get_lane_coordinates(seg_results):
+    """
+
+    :param seg_results:
+    :return:
+    """
+    idx = np.where(seg_results[0] == 1)
+
+    return np.vstack((idx[1], idx[0])).transpose()
+
+
+def test_default_postprocess_matches_baseline(seg_results, ipm_remap_file_path):
+    """
+    the default postprocess gives the mask image, fit params and drawn source image of the postprocess before
+    the optimizations, saved to data/baseline_postprocess.npz with the same synthetic ipm remap file
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    baseline_ret = np.load(BASELINE_RESULT_PATH)
+    source_image = np.zeros(shape=[720, 1280, 3], dtype=np.uint8)
+
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image)
+    finally:
+        postprocessor.close()
+
+    np.testing.assert_array_equal(ret['mask_image'], baseline_ret['mask_image'])
+    np.testing.assert_array_equal(ret['source_image'], baseline_ret['source_image'])
+    np.testing.assert_allclose(np.array(ret['fit_params']), baseline_ret['fit_params'], rtol=1e-9)
+
+
+@pytest.mark.parametrize('cluster_method', ['dbscan', 'meanshift', 'voxel_grid'])
+def test_cluster_methods(seg_results, ipm_remap_file_path, baseline_lane_xs, cluster_method):
+    """
+    every cluster backend finds lanes, the voxel grid dbscan approximation finds the baseline lanes. Meanshift
+    is not a dbscan approximation and finds a different lane nums
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param baseline_lane_xs:
+    :param cluster_method:
+    :return:
+    """
+    ret = _postprocess_headless(seg_results, ipm_remap_file_path, cluster_method=cluster_method)
+    if cluster_method != 'meanshift':
+        _assert_baseline_lanes(ret['lane_xs'], baseline_lane_xs)
+
+
+def test_sample_lane_pts_batches_lanes():
+    """
+    sampling the lanes together gives the samples of every lane sampled alone, also for lanes with missing
+    points, points sharing a row and a lane without points
+    :return:
+    """
+    random_state = np.random.RandomState(0)
+    src_lane_y = np.tile(np.round(np.linspace(230.0, 720.0, 126) / 4.0) * 4.0, (4, 1))
+    src_lane_x = 640.0 + np.array([[-300.0], [-100.0], [150.0], [400.0]]) * (src_lane_y - 230.0) / 490.0 + \
+        random_state.uniform(-2.0, 2.0, size=src_lane_y.shape)
+    missing = random_state.uniform(size=src_lane_y.shape) < 0.2
+    missing[3] = True
+    src_lane_x[missing] = np.nan
+    src_lane_y[missing] = np.nan
+
+    sample_pts = lanenet_postprocess._sample_lane_pts(src_lane_x, src_lane_y, 240, 720, 1280)
+    assert sample_pts.shape == (4, 48, 2)
+    assert np.all(np.isnan(sample_pts[3]))
+    assert np.count_nonzero(~np.isnan(sample_pts[:3, :, 0])) > 100
+    for index in range(4):
+        single_sample_pts = lanenet_postprocess._sample_lane_pts(
+            src_lane_x[index:index + 1], src_lane_y[index:index + 1], 240, 720, 1280)
+        np.testing.assert_array_equal(sample_pts[index], single_sample_pts[0])
+
+
+def test_voxel_grid_cluster_matches_dbscan(seg_results):
+    """
+    the voxel grid cluster approximates dbscan, the lanes must not be chained together
+    :param seg_results:
+    :return:
+    """
+    lane_embedding_feats = _get_lane_embedding_feats(seg_results)
+    dbscan_ret = lanenet_postprocess._LaneNetCluster._embedding_feats_dbscan_cluster(lane_embedding_feats)
+    voxel_grid_ret = lanenet_postprocess._LaneNetCluster._embedding_feats_voxel_grid_cluster(lane_embedding_feats)
+
+    dbscan_labels = dbscan_ret['db_labels']
+    voxel_grid_labels = voxel_grid_ret['db_labels']
+    assert np.unique(voxel_grid_labels[voxel_grid_labels >= 0]).size == \
+        np.unique(dbscan_labels[dbscan_labels >= 0]).size
+    assert adjusted_rand_score(dbscan_labels, voxel_grid_labels) > 0.9
+
+    # every dbscan cluster is matched by a single voxel grid cluster
+    for label in np.unique(dbscan_labels[dbscan_labels >= 0]):
+        matched_labels = voxel_grid_labels[dbscan_labels == label]
+        assert np.mean(matched_labels == np.bincount(matched_labels[matched_labels >= 0]).argmax()) > 0.95
+
+
+def test_voxel_grid_cluster_centers_are_weighted(seg_results):
+    """
+    a feat standing for several pixels pulls the cluster center like the same nums of repeated feats
+    :param seg_results:
+    :return:
+    """
+    lane_embedding_feats = _get_lane_embedding_feats(seg_results)[::4]
+    sample_weight = np.random.RandomState(0).randint(1, 5, size=lane_embedding_feats.shape[0])
+    weighted_ret = lanenet_postprocess._LaneNetCluster._embedding_feats_voxel_grid_cluster(
+        lane_embedding_feats, sample_weight=sample_weight)
+    repeated_ret = lanenet_postprocess._LaneNetCluster._embedding_feats_voxel_grid_cluster(
+        np.repeat(lane_embedding_feats, sample_weight, axis=0))
+
+    assert weighted_ret['cluster_nums'] == repeated_ret['cluster_nums']
+    np.testing.assert_array_equal(np.repeat(weighted_ret['db_labels'], sample_weight), repeated_ret['db_labels'])
+    np.testing.assert_allclose(weighted_ret['cluster_center'], repeated_ret['cluster_center'], atol=1e-6)
+
+
+@pytest.mark.parametrize('cluster_method', ['dbscan', 'meanshift', 'voxel_grid'])
+def test_component_cluster_mode(seg_results, ipm_remap_file_path, baseline_lane_xs, cluster_method):
+    """
+    the component cluster mode finds the lanes of the pixel cluster mode
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param baseline_lane_xs:
+    :param cluster_method:
+    :return:
+    """
+    ret = _postprocess_headless(
+        seg_results, ipm_remap_file_path, cluster_method=cluster_method, cluster_mode='component')
+    if cluster_method != 'meanshift':
+        _assert_baseline_lanes(ret['lane_xs'], baseline_lane_xs)
+
+
+def test_component_cluster_splits_mixed_components(seg_results):
+    """
+    the mixed components are clustered as sub components, not pixel by pixel, and give the pixel mode clusters
+    :param seg_results:
+    :return:
+    """
+    binary_seg_image = np.array(seg_results[0] * 255, dtype=np.uint8)
+    lane_embedding_feats = _get_lane_embedding_feats(seg_results)
+    lane_coordinates = _get_lane_coordinates(seg_results)
+    component_labels = lanenet_postprocess._connect_components_analysis(image=binary_seg_image)[1]
+    lane_component_ids = component_labels[lane_coordinates[:, 1], lane_coordinates[:, 0]]
+
+    pix_component_index, component_embedding_feats, component_pix_nums = \
+        lanenet_postprocess._LaneNetCluster._split_mixed_components(
+            lane_embedding_feats=lane_embedding_feats,
+            lane_rows=lane_coordinates[:, 1],
+            lane_component_ids=lane_component_ids,
+            max_feats_std=CFG.POSTPROCESS.COMPONENT_MAX_FEATS_STD,
+            band_height=CFG.POSTPROCESS.COMPONENT_SPLIT_BAND_HEIGHT
+        )
+    assert component_embedding_feats.shape[0] * 10 < lane_embedding_feats.shape[0]
+    assert np.sum(component_pix_nums) == lane_embedding_feats.shape[0]
+    np.testing.assert_allclose(
+        component_embedding_feats[pix_component_index[0]],
+        np.mean(lane_embedding_feats[pix_component_index == pix_component_index[0]], axis=0), rtol=1e-5)
+
+    cluster = lanenet_postprocess._LaneNetCluster(cluster_method='dbscan', cluster_mode='component')
+    component_ret = cluster.cluster_lane_feats(
+        lane_embedding_feats, lane_coordinates, binary_seg_image, component_labels=component_labels)
+    pixel_ret = cluster._embedding_feats_dbscan_cluster(lane_embedding_feats)
+    assert component_ret['cluster_nums'] == pixel_ret['cluster_nums']
+    assert adjusted_rand_score(pixel_ret['db_labels'], component_ret['db_labels']) > 0.95
+
+
+@pytest.mark.parametrize('cluster_method', ['dbscan', 'meanshift', 'voxel_grid'])
+def test_subsample_cluster_mode(seg_results, ipm_remap_file_path, baseline_lane_xs, cluster_method):
+    """
+    the subsample cluster mode labels every lane pixel and finds the lanes of the pixel cluster mode
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param baseline_lane_xs:
+    :param cluster_method:
+    :return:
+    """
+    ret = _postprocess_headless(
+        seg_results, ipm_remap_file_path, cluster_method=cluster_method, cluster_mode='subsample')
+    if cluster_method != 'meanshift':
+        _assert_baseline_lanes(ret['lane_xs'], baseline_lane_xs)
+
+
+def test_subsample_cluster_labels_every_pixel(seg_results):
+    """
+    the pixels not sampled get the label of their nearest cluster center, the samples keep their own label
+    :param seg_results:
+    :return:
+    """
+    lane_embedding_feats = _get_lane_embedding_feats(seg_results)
+    cluster = lanenet_postprocess._LaneNetCluster(cluster_method='dbscan', cluster_mode='subsample')
+    ret = cluster._subsample_feats_cluster(lane_embedding_feats, sample_budget=2000)
+
+    assert ret['db_labels'].shape[0] == lane_embedding_feats.shape[0]
+    sample_index = np.linspace(0, lane_embedding_feats.shape[0] - 1, 2000).astype(np.int64)
+    sample_ret = cluster._embedding_feats_dbscan_cluster(
+        lane_embedding_feats[sample_index],
+        sample_weight=np.full(2000, lane_embedding_feats.shape[0] / 2000.0))
+    np.testing.assert_array_equal(ret['db_labels'][sample_index], sample_ret['db_labels'])
+    pixel_ret = cluster._embedding_feats_dbscan_cluster(lane_embedding_feats)
+    assert adjusted_rand_score(pixel_ret['db_labels'], ret['db_labels']) > 0.9
+
+
+@pytest.mark.parametrize('fit_method', ['least_squares', 'ransac'])
+def test_fit_methods(seg_results, ipm_remap_file_path, baseline_lane_xs, fit_method):
+    """
+    every lane fit method finds the baseline lanes
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param baseline_lane_xs:
+    :param fit_method:
+    :return:
+    """
+    ret = _postprocess_headless(seg_results, ipm_remap_file_path, fit_method=fit_method)
+    _assert_baseline_lanes(ret['lane_xs'], baseline_lane_xs)
+
+
+def test_ransac_fit_ignores_outlier_points():
+    """
+    the ransac fit recovers the lane polynomials of every lane at once from points with gross outliers, which
+    pull the least squares fit away
+    :return:
+    """
+    random_state = np.random.RandomState(1)
+    fit_params = np.array([[2e-3, -1.5, 600.0], [-1e-3, 0.5, 200.0]])
+    lane_ids = np.repeat(np.arange(2), 400)
+    lane_y = random_state.uniform(0, 640, size=lane_ids.shape[0])
+    lane_x = np.sum(fit_params[lane_ids] * np.vander(lane_y, 3), axis=1) + random_state.normal(
+        scale=0.5, size=lane_ids.shape[0])
+    outlier = random_state.random_sample(lane_ids.shape[0]) < 0.2
+    lane_x[outlier] += random_state.uniform(50, 200, size=np.count_nonzero(outlier))
+
+    plot_y = np.linspace(0, 640, 65)
+    ransac_fit_params = lanenet_postprocess._ransac_fit_lane_polynomials(lane_ids, lane_y, lane_x, 2)
+    least_squares_fit_params = lanenet_postprocess._fit_lane_polynomials(lane_ids, lane_y, lane_x, 2)
+    expected_x = fit_params.dot(np.vander(plot_y, 3).T)
+    assert np.max(np.abs(ransac_fit_params.dot(np.vander(plot_y, 3).T) - expected_x)) < 2.0
+    assert np.max(np.abs(least_squares_fit_params.dot(np.vander(plot_y, 3).T) - expected_x)) > 10.0
+
+
+def test_postprocess_batch_mixed_size_source_images(seg_results, ipm_remap_file_path):
+    """
+    the frames of a batch may have source images of different sizes, the lanes are drawn like postprocess does
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    source_images = [np.zeros(shape=[720, 1280, 3], dtype=np.uint8), np.zeros(shape=[360, 640, 3], dtype=np.uint8)]
+    expected_source_images = [source_image.copy() for source_image in source_images]
+
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        expected_rets = [postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image)
+                         for source_image in expected_source_images]
+        rets = postprocessor.postprocess_batch(
+            binary_seg_results=[binary_seg_image] * 2,
+            instance_seg_results=[instance_seg_image] * 2,
+            source_images=source_images,
+            workers=2
+        )
+    finally:
+        postprocessor.close()
+
+    assert len(rets) == 2
+    for ret, expected_ret, source_image in zip(rets, expected_rets, source_images):
+        assert ret['source_image'] is source_image
+        np.testing.assert_array_equal(source_image, expected_ret['source_image'])
+        np.testing.assert_array_equal(ret['mask_image'], expected_ret['mask_image'])
+        assert np.count_nonzero(source_image) > 0
+
+
+def test_postprocess_batch_keeps_a_pool_per_worker_nums(seg_results, ipm_remap_file_path):
+    """
+    a batch with other worker nums gets a pool of its own instead of shutting down the pool in use, close
+    shuts down every pool
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        expected_ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        rets = []
+        for workers in (1, 2, 1):
+            rets.extend(postprocessor.postprocess_batch(
+                binary_seg_results=[binary_seg_image],
+                instance_seg_results=[instance_seg_image],
+                headless=True,
+                workers=workers
+            ))
+        batch_pools = dict(postprocessor._batch_pools)
+    finally:
+        postprocessor.close()
+
+    assert sorted(batch_pools.keys()) == [1, 2]
+    assert postprocessor._batch_pools == {}
+    for ret in rets:
+        np.testing.assert_array_equal(ret['lane_xs'], expected_ret['lane_xs'])
+
+
+def _gather_sparse_seg_results(binary_seg_images, instance_seg_images, morph_kernel_size=5):
+    """
+    gather the dense net outputs like LaneNet.gather_foreground does in graph, the embedding feats of the
+    foreground dilated by the morphological closing kernel in row major order
+    :param binary_seg_images:
+    :param instance_seg_images:
+    :param morph_kernel_size:
+    :return:
+    """
+    binary_seg_mask = np.asarray(binary_seg_images).astype(np.uint8)
+    kernel = np.ones(shape=[morph_kernel_size, morph_kernel_size], dtype=np.uint8)
+    foreground = np.stack([cv2.dilate(mask, kernel) for mask in binary_seg_mask])
+    foreground_coords = np.argwhere(foreground > 0)
+
+    return {
+        'binary_seg_mask': binary_seg_mask,
+        'foreground_coords': foreground_coords.astype(np.int32),
+        'foreground_embedding_feats': np.asarray(instance_seg_images)[tuple(foreground_coords.T)],
+    }
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_sparse_seg_results_match_dense_results(seg_results, ipm_remap_file_path, workers):
+    """
+    the sparse seg results of LaneNet.inference_sparse give the lanes of the dense seg results, frame by frame
+    and batched
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param workers:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    binary_seg_images = [binary_seg_image, np.ascontiguousarray(binary_seg_image[:, ::-1])]
+    instance_seg_images = [instance_seg_image, np.ascontiguousarray(instance_seg_image[:, ::-1])]
+    sparse_seg_results = _gather_sparse_seg_results(binary_seg_images, instance_seg_images)
+    sparse_binary_seg_images, sparse_instance_seg_images = lanenet_postprocess.split_sparse_seg_results(
+        sparse_seg_results)
+
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        expected_rets = [postprocessor.postprocess(binary_seg_images[index], instance_seg_images[index],
+                                                   source_image=np.zeros(shape=[720, 1280, 3], dtype=np.uint8))
+                         for index in range(2)]
+        rets = [postprocessor.postprocess(sparse_binary_seg_images[index], sparse_instance_seg_images[index],
+                                          source_image=np.zeros(shape=[720, 1280, 3], dtype=np.uint8))
+                for index in range(2)]
+        rets.extend(postprocessor.postprocess_batch(
+            binary_seg_results=sparse_seg_results,
+            source_images=[np.zeros(shape=[720, 1280, 3], dtype=np.uint8) for _ in range(2)],
+            workers=workers
+        ))
+        with pytest.raises(ValueError):
+            sparse_instance_seg_images[0][np.array([0]), np.array([0])]
+    finally:
+        postprocessor.close()
+
+    assert len(rets) == 4
+    for ret, expected_ret in zip(rets, expected_rets * 2):
+        np.testing.assert_array_equal(ret['mask_image'], expected_ret['mask_image'])
+        np.testing.assert_array_equal(ret['source_image'], expected_ret['source_image'])
+        np.testing.assert_allclose(np.array(ret['fit_params']), np.array(expected_ret['fit_params']))
+
+
+def test_postprocess_draws_more_lanes_than_colors(ipm_remap_file_path):
+    """
+    a frame with more lanes than the color map colors is drawn with wrapped around colors
+    :param ipm_remap_file_path:
+    :return:
+    """
+    lane_nums = 10
+    binary_seg_image = np.zeros(shape=[256, 512], dtype=np.int64)
+    instance_seg_image = np.zeros(shape=[256, 512, 4], dtype=np.float32)
+    for index in range(lane_nums):
+        lane_x = 26 + index * 50
+        angle = 2.0 * np.pi * index / lane_nums
+        binary_seg_image[120:, lane_x:lane_x + 8] = 1
+        instance_seg_image[120:, lane_x:lane_x + 8, :2] = [5.0 * np.cos(angle), 5.0 * np.sin(angle)]
+    source_image = np.zeros(shape=[720, 1280, 3], dtype=np.uint8)
+
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image)
+    finally:
+        postprocessor.close()
+
+    assert len(ret['fit_params']) == lane_nums
+    assert ret['sample_pts'].shape[0] == lane_nums
+    # every color of the color map and the black background
+    mask_colors = np.unique(ret['mask_image'].reshape(-1, 3), axis=0)
+    assert mask_colors.shape[0] == len(postprocessor._color_map) + 1
+
+
+def test_headless_result_matches_drawn_result(seg_results, ipm_remap_file_path):
+    """
+    the headless result holds the lanes of the drawn result as tusimple h samples and lane xs without touching
+    a source image
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    source_image = np.zeros(shape=[720, 1280, 3], dtype=np.uint8)
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        headless_ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image)
+    finally:
+        postprocessor.close()
+
+    assert set(headless_ret.keys()) == {'fit_params', 'h_samples', 'lane_xs', 'lane_pixel_nums'}
+    lane_nums = len(headless_ret['fit_params'])
+    assert headless_ret['lane_xs'].shape == (lane_nums, len(headless_ret['h_samples']))
+    assert headless_ret['lane_pixel_nums'].shape == (lane_nums,)
+    assert np.all(headless_ret['lane_pixel_nums'] > 0)
+    np.testing.assert_allclose(np.array(headless_ret['fit_params']), np.array(ret['fit_params']))
+    np.testing.assert_array_equal(
+        headless_ret['lane_xs'], np.where(np.isnan(ret['sample_pts'][:, :, 0]), -2, ret['sample_pts'][:, :, 0]))
+
+
+def test_headless_result_is_json_serializable(seg_results, ipm_remap_file_path):
+    """
+    a headless postprocess result holds the fit params of every lane as a list of arrays
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True, with_timings=True)
+    finally:
+        postprocessor.close()
+
+    json_ret = json.loads(json.dumps(lanenet_postprocess.to_json_result(ret)))
+    assert set(json_ret.keys()) == set(ret.keys())
+    assert len(json_ret['fit_params']) == len(ret['fit_params']) > 0
+    for fit_param, json_fit_param in zip(ret['fit_params'], json_ret['fit_params']):
+        np.testing.assert_allclose(json_fit_param, fit_param)
+    np.testing.assert_array_equal(json_ret['lane_xs'], ret['lane_xs'])
+    np.testing.assert_array_equal(json_ret['h_samples'], ret['h_samples'])
+    assert json_ret['lane_pixel_nums'] == ret['lane_pixel_nums'].tolist()
+
+
+def test_postprocess_batch_in_calling_thread(seg_results, ipm_remap_file_path):
+    """
+    zero workers postprocess the frames in the calling thread without a worker pool
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        expected_ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        rets = postprocessor.postprocess_batch(
+            binary_seg_results=[binary_seg_image] * 2,
+            instance_seg_results=[instance_seg_image] * 2,
+            headless=True,
+            workers=0
+        )
+        assert postprocessor._batch_pools == {}
+    finally:
+        postprocessor.close()
+
+    assert len(rets) == 2
+    for ret in rets:
+        np.testing.assert_array_equal(ret['lane_xs'], expected_ret['lane_xs'])
+
+
+def _postprocess_frames(postprocessor, frames):
+    """
+    postprocess every binary and instance seg result pair of frames on a black source image
+    :param postprocessor:
+    :param frames:
+    :return:
+    """
+    return [postprocessor.postprocess(binary_seg_image, instance_seg_image,
+                                      source_image=np.zeros(shape=[720, 1280, 3], dtype=np.uint8))
+            for binary_seg_image, instance_seg_image in frames]
+
+
+def test_reused_buffers_do_not_alias_results(seg_results, ipm_remap_file_path):
+    """
+    a postprocessor reusing buffers must return the same results as one allocating per call, the result of a
+    frame must not be overwritten by the next frame and the buffers are reused across frames
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    frames = [
+        (binary_seg_image, instance_seg_image),
+        (np.ascontiguousarray(binary_seg_image[:, ::-1]), np.ascontiguousarray(instance_seg_image[:, ::-1])),
+    ]
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    reuse_postprocessor = lanenet_postprocess.LaneNetPostProcessor(
+        ipm_remap_file_path=ipm_remap_file_path, reuse_buffers=True)
+    try:
+        expected_rets = _postprocess_frames(postprocessor, frames)
+        rets = _postprocess_frames(reuse_postprocessor, frames)
+        buffer = reuse_postprocessor._get_buffer('morphological_ret', binary_seg_image.shape, np.uint8)
+        _postprocess_frames(reuse_postprocessor, frames[:1])
+        assert reuse_postprocessor._get_buffer('morphological_ret', binary_seg_image.shape, np.uint8) is buffer
+    finally:
+        postprocessor.close()
+        reuse_postprocessor.close()
+
+    assert not np.array_equal(expected_rets[0]['mask_image'], expected_rets[1]['mask_image'])
+    for ret, expected_ret in zip(rets, expected_rets):
+        for key in ('mask_image', 'source_image', 'sample_pts'):
+            np.testing.assert_array_equal(ret[key], expected_ret[key])
+        np.testing.assert_allclose(np.array(ret['fit_params']), np.array(expected_ret['fit_params']))
+
+
+def test_buffer_pool_reallocates_on_shape_change():
+    """
+    a buffer is reused while its shape and dtype stay the same and reallocated when they change
+    :return:
+    """
+    buffer_pool = lanenet_postprocess._BufferPool()
+    buffer = buffer_pool.get('image', (256, 512), np.uint8)
+    assert buffer_pool.get('image', [256, 512], np.uint8) is buffer
+
+    resized_buffer = buffer_pool.get('image', (128, 256), np.uint8)
+    assert resized_buffer.shape == (128, 256)
+    assert buffer_pool.get('image', (128, 256), np.uint8) is resized_buffer
+    assert buffer_pool.get('image', (128, 256), np.int32).dtype == np.int32
+    assert len(buffer_pool._buffers) == 1
+
+    buffer_pool.reset()
+    assert buffer_pool.get('image', (128, 256), np.int32) is not resized_buffer
+
+
+@pytest.mark.parametrize('headless', [True, False])
+def test_postprocess_timings(seg_results, ipm_remap_file_path, headless):
+    """
+    with_timings returns the cost of every postprocess stage, the stages do not overlap so they add up to at
+    most the wall time of the call
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param headless:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    source_image = None if headless else np.zeros(shape=[720, 1280, 3], dtype=np.uint8)
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image,
+                                        headless=headless)
+        t_start = time.perf_counter()
+        timed_ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, source_image=source_image,
+                                              headless=headless, with_timings=True)
+        t_cost = time.perf_counter() - t_start
+    finally:
+        postprocessor.close()
+
+    assert 'timings' not in ret
+    expected_stages = HEADLESS_TIMING_STAGES if headless else HEADLESS_TIMING_STAGES | {'drawing'}
+    assert set(timed_ret['timings'].keys()) == expected_stages
+    assert all(stage_cost >= 0.0 for stage_cost in timed_ret['timings'].values())
+    assert sum(timed_ret['timings'].values()) <= t_cost
+    np.testing.assert_allclose(np.array(timed_ret['fit_params']), np.array(ret['fit_params']))
+
+
+def test_timing_collector_summary():
+    """
+    the collector summary holds the sample nums, mean and percentiles of the last max_samples timings of
+    every stage
+    :return:
+    """
+    collector = lanenet_postprocess.PostprocessTimingCollector(max_samples=50)
+    for index in range(100):
+        collector.add({'cluster': float(index), 'polyfit': 1.0})
+    collector.add({'drawing': 2.0})
+    collector.add(None)
+
+    summary = collector.summary(percentiles=(50, 90))
+    assert list(summary.keys()) == ['cluster', 'polyfit', 'drawing']
+    cluster_timings = np.arange(50, 100, dtype=np.float64)
+    assert summary['cluster'] == {
+        'count': 50,
+        'mean': float(np.mean(cluster_timings)),
+        'p50': float(np.percentile(cluster_timings, 50)),
+        'p90': float(np.percentile(cluster_timings, 90)),
+    }
+    assert summary['polyfit'] == {'count': 50, 'mean': 1.0, 'p50': 1.0, 'p90': 1.0}
+    assert summary['drawing']['count'] == 1
+    assert list(collector.summary()['drawing'].keys()) == ['count', 'mean', 'p50', 'p95', 'p99']
+
+    collector.reset()
+    assert collector.summary() == {}
+
+
+def _shift_seg_results(seg_results, shift):
+    """
+    shift the binary and instance seg result horizontally to make the next frame of a stream
+    :param seg_results:
+    :param shift:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    return np.roll(binary_seg_image, shift, axis=1), np.roll(instance_seg_image, shift, axis=1)
+
+
+def test_stream_lane_ids_are_stable(seg_results, ipm_remap_file_path):
+    """
+    the lanes of a similar next frame are assigned to the tracked lanes without clustering and keep their
+    lane ids
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetStreamPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        first_ret = postprocessor.postprocess(*_shift_seg_results(seg_results, 0), headless=True)
+        second_ret = postprocessor.postprocess(*_shift_seg_results(seg_results, 2), headless=True)
+        frames_since_cluster = postprocessor._frames_since_cluster
+    finally:
+        postprocessor.close()
+
+    assert len(first_ret['lane_ids']) == 4
+    assert second_ret['lane_ids'] == first_ret['lane_ids']
+    assert frames_since_cluster == 1
+    for key in ('lane_xs', 'lane_pixel_nums'):
+        assert second_ret[key].shape == first_ret[key].shape
+
+
+def test_stream_reclusters_after_max_skip_frames(seg_results, ipm_remap_file_path, monkeypatch):
+    """
+    the tracked lanes are clustered again every TRACK_MAX_SKIP_FRAMES frames and keep their lane ids, a frame
+    without lanes returns no lane ids and reset_tracks forgets every tracked lane
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(CFG.POSTPROCESS, 'TRACK_MAX_SKIP_FRAMES', 1)
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetStreamPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        rets = []
+        frames_since_cluster = []
+        for shift in (0, 2, 4):
+            rets.append(postprocessor.postprocess(*_shift_seg_results(seg_results, shift), headless=True))
+            frames_since_cluster.append(postprocessor._frames_since_cluster)
+        lane_ids = rets[0]['lane_ids']
+        assert frames_since_cluster == [0, 1, 0]
+        assert all(ret['lane_ids'] == lane_ids for ret in rets)
+        assert postprocessor._next_track_id == len(lane_ids)
+
+        empty_ret = postprocessor.postprocess(np.zeros_like(binary_seg_image), instance_seg_image, headless=True)
+        assert empty_ret['lane_ids'] is None
+        assert empty_ret['fit_params'] is None
+
+        postprocessor.reset_tracks()
+        assert postprocessor._tracks == {}
+        assert postprocessor._next_track_id == 0
+        reset_ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        assert postprocessor._frames_since_cluster == 0
+    finally:
+        postprocessor.close()
+
+    assert reset_ret['lane_ids'] == list(range(len(lane_ids)))
+    np.testing.assert_array_equal(reset_ret['lane_xs'], rets[0]['lane_xs'])
+
+
+@pytest.fixture()
+def tmp_ipm_remap_file_path(ipm_remap_file_path, tmp_path):
+    """
+    a copy of the synthetic ipm remap file in its own dir, so its remap matrix cache starts empty
+    :param ipm_remap_file_path:
+    :param tmp_path:
+    :return:
+    """
+    file_path = str(tmp_path / 'tusimple_ipm_remap.yml')
+    shutil.copy(ipm_remap_file_path, file_path)
+
+    return file_path
+
+
+def _read_remap_matrix(ipm_remap_file_path):
+    """
+
+    :param ipm_remap_file_path:
+    :return:
+    """
+    fs = cv2.FileStorage(ipm_remap_file_path, cv2.FILE_STORAGE_READ)
+    ret = fs.getNode('remap_ipm_x').mat(), fs.getNode('remap_ipm_y').mat()
+    fs.release()
+
+    return ret
+
+
+def test_remap_matrix_cache_is_saved_and_loaded(tmp_ipm_remap_file_path):
+    """
+    the first load saves the cache next to the ipm remap file, the next load maps it
+    :param tmp_ipm_remap_file_path:
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=tmp_ipm_remap_file_path)
+    remap_x, remap_y = _read_remap_matrix(tmp_ipm_remap_file_path)
+
+    postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    cache_paths = postprocessor._get_remap_cache_paths(tmp_ipm_remap_file_path)
+    assert all(ops.exists(path) for path in cache_paths.values())
+
+    ret = postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    assert isinstance(ret['remap_to_ipm_x'], np.memmap)
+    np.testing.assert_array_equal(ret['remap_to_ipm_x'], remap_x)
+    np.testing.assert_array_equal(ret['remap_to_ipm_y'], remap_y)
+
+
+def test_remap_matrix_cache_is_rebuilt_when_stale(tmp_ipm_remap_file_path):
+    """
+    a cache saved for an older ipm remap file or with a different stamp is not used and is rebuilt
+    :param tmp_ipm_remap_file_path:
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=tmp_ipm_remap_file_path)
+    cache_paths = postprocessor._get_remap_cache_paths(tmp_ipm_remap_file_path)
+    postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+
+    # rewrite the ipm remap file with shifted remap matrix and a newer mtime
+    remap_x, remap_y = _read_remap_matrix(tmp_ipm_remap_file_path)
+    fs = cv2.FileStorage(tmp_ipm_remap_file_path, cv2.FILE_STORAGE_WRITE)
+    fs.write('remap_ipm_x', remap_x + 1.0)
+    fs.write('remap_ipm_y', remap_y)
+    fs.release()
+    file_stat = os.stat(tmp_ipm_remap_file_path)
+    os.utime(tmp_ipm_remap_file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10 ** 9))
+
+    ret = postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    np.testing.assert_array_equal(ret['remap_to_ipm_x'], remap_x + 1.0)
+    np.testing.assert_array_equal(np.load(cache_paths['remap_to_ipm_x']), remap_x + 1.0)
+    with open(cache_paths['stamp'], 'r') as file:
+        assert json.load(file) == postprocessor._get_remap_file_stamp(tmp_ipm_remap_file_path)
+
+    # a stamp of another key is stale as well
+    with open(cache_paths['stamp'], 'w') as file:
+        json.dump({'size': 0}, file)
+    assert postprocessor._load_remap_matrix_cache(tmp_ipm_remap_file_path) is None
+    postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    assert postprocessor._load_remap_matrix_cache(tmp_ipm_remap_file_path) is not None
+
+
+@pytest.mark.parametrize('corrupt_file, corrupt_data', [
+    ('stamp', b'{not json'),
+    ('remap_to_ipm_x', b'not a npy file'),
+    ('remap_to_ipm_y', None),
+])
+def test_corrupt_remap_matrix_cache_is_tolerated(tmp_ipm_remap_file_path, corrupt_file, corrupt_data):
+    """
+    a corrupt or truncated cache file is ignored, the remap matrix is loaded from the ipm remap file and
+    the cache saved again
+    :param tmp_ipm_remap_file_path:
+    :param corrupt_file:
+    :param corrupt_data: the corrupt file content, None to truncate the file
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=tmp_ipm_remap_file_path)
+    cache_paths = postprocessor._get_remap_cache_paths(tmp_ipm_remap_file_path)
+    postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    with open(cache_paths[corrupt_file], 'r+b') as file:
+        if corrupt_data is None:
+            file.truncate(1024)
+        else:
+            file.truncate(0)
+            file.write(corrupt_data)
+
+    assert postprocessor._load_remap_matrix_cache(tmp_ipm_remap_file_path) is None
+    remap_x, remap_y = _read_remap_matrix(tmp_ipm_remap_file_path)
+    ret = postprocessor._load_remap_matrix(tmp_ipm_remap_file_path)
+    np.testing.assert_array_equal(ret['remap_to_ipm_x'], remap_x)
+    np.testing.assert_array_equal(ret['remap_to_ipm_y'], remap_y)
+    assert postprocessor._load_remap_matrix_cache(tmp_ipm_remap_file_path) is not None
+
+
+def test_register_camera_profile(seg_results, ipm_remap_file_path, tmp_ipm_remap_file_path):
+    """
+    a registered data source is sampled in its own sample band with its own ipm remap file, the lanes fit in
+    the ipm space are the same as the tusimple data source of the same camera
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :param tmp_ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        postprocessor.register_camera_profile(
+            data_source='near_band', src_height=720, src_width=1280, start_plot_y=400, end_plot_y=720,
+            ipm_remap_file_path=tmp_ipm_remap_file_path)
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        near_band_ret = postprocessor.postprocess(
+            binary_seg_image, instance_seg_image, data_source='near_band', headless=True)
+        remap_file_paths = set(postprocessor._remap_matrices.keys())
+        with pytest.raises(ValueError):
+            postprocessor.postprocess(binary_seg_image, instance_seg_image, data_source='unknown', headless=True)
+    finally:
+        postprocessor.close()
+
+    assert remap_file_paths == {ipm_remap_file_path, tmp_ipm_remap_file_path}
+    np.testing.assert_array_equal(near_band_ret['h_samples'], np.linspace(400, 720, 32))
+    assert near_band_ret['lane_xs'].shape == (len(ret['fit_params']), 32)
+    assert np.any(near_band_ret['lane_xs'] >= 0)
+    np.testing.assert_allclose(np.array(near_band_ret['fit_params']), np.array(ret['fit_params']))
+
+
+@pytest.mark.parametrize('start_plot_y, end_plot_y', [(-10, 720), (400, 400), (500, 400), (240, 730)])
+def test_register_camera_profile_rejects_bad_sample_band(ipm_remap_file_path, start_plot_y, end_plot_y):
+    """
+    the sample band must be a non empty row range of the source image
+    :param ipm_remap_file_path:
+    :param start_plot_y:
+    :param end_plot_y:
+    :return:
+    """
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        with pytest.raises(ValueError):
+            postprocessor.register_camera_profile(
+                data_source='bad_band', src_height=720, src_width=1280, start_plot_y=start_plot_y,
+                end_plot_y=end_plot_y)
+        with pytest.raises(ValueError):
+            postprocessor._get_camera_profile('bad_band')
+    finally:
+        postprocessor.close()
+
+
+def test_register_camera_profile_replaces_built_profile(seg_results, ipm_remap_file_path):
+    """
+    registering a data source again drops the camera profile built for it, the next postprocess call builds
+    and samples the new profile
+    :param seg_results:
+    :param ipm_remap_file_path:
+    :return:
+    """
+    binary_seg_image, instance_seg_image = seg_results
+    postprocessor = lanenet_postprocess.LaneNetPostProcessor(ipm_remap_file_path=ipm_remap_file_path)
+    try:
+        camera_profile = postprocessor._get_camera_profile('tusimple')
+        assert postprocessor._get_camera_profile('tusimple') is camera_profile
+        postprocessor.register_camera_profile(
+            data_source='tusimple', src_height=720, src_width=1280, start_plot_y=400, end_plot_y=720)
+        ret = postprocessor.postprocess(binary_seg_image, instance_seg_image, headless=True)
+        new_camera_profile = postprocessor._get_camera_profile('tusimple')
+    finally:
+        postprocessor.close()
+
+    assert new_camera_profile is not camera_profile
+    assert camera_profile.start_plot_y == 240
+    assert new_camera_profile.start_plot_y == 400
+    np.testing.assert_array_equal(ret['h_samples'], new_camera_profile.h_samples)
+    assert ret['h_samples'][0] == 400
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : test_lanenet_slim.py
+# @IDE: PyCharm
+"""
+Test the slim lanenet inference graph against the standard one on randomly initialized weights
+"""
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from lanenet_model import lanenet
+from tools import check_slim_lanenet
+
+
+@pytest.fixture(scope='module')
+def image():
+    """
+    a random uint8 BGR image batch of the net input size
+    :return:
+    """
+    return np.random.RandomState(0).randint(0, 256, size=[1, 256, 512, 3]).astype(np.uint8)
+
+
+def _run_normalized_lanenet(image, weights_path, net_flag):
+    """
+    run the standard lanenet inference graph on an image normalized in numpy fed as float32
+    :param image:
+    :param weights_path:
+    :param net_flag:
+    :return:
+    """
+    if net_flag == 'vgg':
+        image = image / np.float32(127.5) - np.float32(1.0)
+    else:
+        image = image - np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+    with tf.Graph().as_default():
+        input_tensor = tf.placeholder(dtype=tf.float32, shape=[1, 256, 512, 3], name='input_tensor')
+        net = lanenet.LaneNet(phase='test', net_flag=net_flag)
+        binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
+        saver = tf.train.Saver()
+
+        with tf.Session() as sess:
+            saver.restore(sess=sess, save_path=weights_path)
+            binary_seg_image, instance_seg_image = sess.run(
+                [binary_seg_ret, instance_seg_ret], feed_dict={input_tensor: image.astype(np.float32)})
+
+    return binary_seg_image, instance_seg_image
+
+
+@pytest.mark.parametrize('net_flag', ['vgg', 'mobilenet_v2'])
+def test_slim_graph_matches_standard_graph(image, net_flag, tmp_path):
+    """
+    the slim graph folds the batch norms with random statistics into the convolutions and normalizes the uint8
+    input in graph, its outputs must match the standard graph and the standard graph fed a float32 input
+    normalized in numpy
+    :param image:
+    :param net_flag:
+    :param tmp_path:
+    :return:
+    """
+    weights_path = str(tmp_path / 'random_lanenet.ckpt')
+    binary_seg_image, instance_seg_image = check_slim_lanenet._run_lanenet(
+        image, None, net_flag, slim=False, save_path=weights_path)
+    slim_binary_seg_image, slim_instance_seg_image = check_slim_lanenet._run_lanenet(
+        image, weights_path, net_flag, slim=True)
+    normalized_binary_seg_image, normalized_instance_seg_image = _run_normalized_lanenet(
+        image, weights_path, net_flag)
+
+    embedding_scale = max(np.max(np.abs(instance_seg_image)), 1e-12)
+    assert slim_binary_seg_image.dtype == np.uint8
+    assert np.mean(binary_seg_image != slim_binary_seg_image) <= 1e-4
+    np.testing.assert_allclose(slim_instance_seg_image / embedding_scale, instance_seg_image / embedding_scale,
+                               rtol=0.0, atol=1e-3)
+    assert np.mean(binary_seg_image != normalized_binary_seg_image) <= 1e-4
+    np.testing.assert_allclose(normalized_instance_seg_image / embedding_scale,
+                               instance_seg_image / embedding_scale, rtol=0.0, atol=1e-4)
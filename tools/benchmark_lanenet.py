@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : benchmark_lanenet.py
+# @IDE: PyCharm
+"""
+Benchmark the lanenet preprocess, inference and postprocess stages over a sweep of backbones, batch sizes,
+thread nums and source image resolutions, and write the latency percentiles and throughput as json
+"""
+import argparse
+import collections
+import glob
+import itertools
+import json
+import multiprocessing
+import os.path as ops
+import platform
+import sys
+import time
+sys.path.append('./')
+
+import cv2
+import glog as log
+import numpy as np
+import tensorflow as tf
+
+from lanenet_model import lanenet_predictor
+
+STAGE_NAMES = ('preprocess', 'inference', 'postprocess', 'total')
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--net_flags', type=str, nargs='+', default=['vgg', 'mobilenet_v2'],
+                        help='The backbones to benchmark')
+    parser.add_argument('--vgg_weights_path', type=str, default=None,
+                        help='The vgg model weights path, default randomly initialized weights')
+    parser.add_argument('--mobilenet_v2_weights_path', type=str, default=None,
+                        help='The mobilenet_v2 model weights path, default randomly initialized weights')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8], help='The batch sizes')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0],
+                        help='The intra op thread nums, 0 to let tensorflow decide')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1280x720'],
+                        help='The source image resolutions as WIDTHxHEIGHT')
+    parser.add_argument('--source', type=str, default='synthetic',
+                        help='The input images, synthetic or tusimple to sample from --image_dir')
+    parser.add_argument('--image_dir', type=str, default='./data/tusimple_test_image',
+                        help='The image dir sampled by the tusimple source')
+    parser.add_argument('--iterations', type=int, default=20, help='The timed batch nums of every config')
+    parser.add_argument('--warmup_iterations', type=int, default=3,
+                        help='The untimed batch nums run before the timed ones of every config')
+    parser.add_argument('--headless', type=int, default=1,
+                        help='If postprocess without drawing the lanes set 1 or 0 instead')
+    parser.add_argument('--use_gpu', type=int, default=1, help='If use gpu set 1 or 0 instead')
+    parser.add_argument('--seed', type=int, default=1234, help='The random seed of the synthetic images')
+    parser.add_argument('--output_path', type=str, default=None, help='The json result path, default stdout')
+    parser.add_argument('--compare_path', type=str, default=None,
+                        help='A json result of an earlier run to compare the p50 latencies with')
+
+    return parser.parse_args()
+
+
+def _parse_resolution(resolution):
+    """
+
+    :param resolution: WIDTHxHEIGHT
+    :return: (width, height)
+    """
+    try:
+        width, height = [int(tmp) for tmp in resolution.lower().split('x')]
+    except ValueError:
+        raise ValueError('Wrong resolution: {:s}, now only support WIDTHxHEIGHT'.format(resolution))
+
+    return width, height
+
+
+def _get_synthetic_images(image_nums, seed):
+    """
+    noisy gray road images with a few bright lane like lines, so a trained model finds lanes to postprocess
+    :param image_nums:
+    :param seed:
+    :return: 1280x720 BGR images
+    """
+    random_state = np.random.RandomState(seed)
+    images = []
+    for _ in range(image_nums):
+        image = random_state.normal(90.0, 20.0, size=[720, 1280, 3]).clip(0, 255).astype(np.uint8)
+        for _ in range(random_state.randint(2, 5)):
+            bottom_x = int(random_state.uniform(0, 1280))
+            top_x = int(640 + random_state.uniform(-80, 80))
+            cv2.line(image, (bottom_x, 719), (top_x, 280), (230, 230, 230), 12)
+        images.append(image)
+
+    return images
+
+
+def _get_tusimple_images(image_dir, image_nums):
+    """
+
+    :param image_dir:
+    :param image_nums:
+    :return:
+    """
+    image_paths = sorted(glob.glob(ops.join(image_dir, '*.jpg')) + glob.glob(ops.join(image_dir, '*.png')))
+    if not image_paths:
+        raise ValueError('Wrong image dir: {:s}, no jpg or png images found'.format(image_dir))
+
+    return [cv2.imread(image_paths[index % len(image_paths)], cv2.IMREAD_COLOR) for index in range(image_nums)]
+
+
+def _summarize(latencies, batch_size):
+    """
+
+    :param latencies: batch latencies in seconds
+    :param batch_size:
+    :return:
+    """
+    latencies = np.array(latencies, dtype=np.float64)
+    ret = collections.OrderedDict()
+    ret['mean_ms'] = float(np.mean(latencies) * 1000.0)
+    for percentile in (50, 95, 99):
+        ret['p{:d}_ms'.format(percentile)] = float(np.percentile(latencies, percentile) * 1000.0)
+    ret['images_per_sec'] = float(batch_size * latencies.size / max(np.sum(latencies), 1e-12))
+
+    return ret
+
+
+def benchmark_config(predictor, images, batch_size, iterations, warmup_iterations, headless=True):
+    """
+    time the stages of a batch of images, the warmup iterations are excluded
+    :param predictor:
+    :param images: source images, cycled to fill the batches
+    :param batch_size:
+    :param iterations:
+    :param warmup_iterations:
+    :param headless:
+    :return: the latency percentiles and throughput of every stage
+    """
+    latencies = collections.OrderedDict([(name, []) for name in STAGE_NAMES])
+    image_index = 0
+    for iteration in range(warmup_iterations + iterations):
+        batch_images = [images[(image_index + index) % len(images)] for index in range(batch_size)]
+        image_index += batch_size
+        if not headless:
+            batch_images = [image.copy() for image in batch_images]
+
+        t_start = time.perf_counter()
+        preprocessed_images = [predictor.preprocess(image) for image in batch_images]
+        t_preprocess = time.perf_counter()
+        if predictor.has_sparse_outputs:
+            binary_seg_results = predictor.inference(preprocessed_images, sparse=True, preprocessed=True)
+            instance_seg_results = None
+        else:
+            binary_seg_results, instance_seg_results = predictor.inference(preprocessed_images, preprocessed=True)
+        t_inference = time.perf_counter()
+        predictor.postprocessor.postprocess_batch(
+            binary_seg_results=binary_seg_results,
+            instance_seg_results=instance_seg_results,
+            source_images=None if headless else batch_images,
+            headless=headless
+        )
+        t_end = time.perf_counter()
+
+        if iteration < warmup_iterations:
+            continue
+        latencies['preprocess'].append(t_preprocess - t_start)
+        latencies['inference'].append(t_inference - t_preprocess)
+        latencies['postprocess'].append(t_end - t_inference)
+        latencies['total'].append(t_end - t_start)
+
+    return collections.OrderedDict([(name, _summarize(values, batch_size)) for name, values in latencies.items()])
+
+
+def _get_config_key(config):
+    """
+
+    :param config:
+    :return:
+    """
+    return '{:s}/batch_{:d}/threads_{:d}/{:s}'.format(
+        config['net_flag'], config['batch_size'], config['threads'], config['resolution'])
+
+
+def compare_results(results, baseline_results):
+    """
+    log the p50 latency ratio of every stage of the configs found in both runs
+    :param results:
+    :param baseline_results:
+    :return:
+    """
+    baseline = {_get_config_key(tmp['config']): tmp['stages'] for tmp in baseline_results['results']}
+    for result in results['results']:
+        config_key = _get_config_key(result['config'])
+        if config_key not in baseline:
+            continue
+        ratios = [result['stages'][name]['p50_ms'] / max(baseline[config_key][name]['p50_ms'], 1e-12)
+                  for name in STAGE_NAMES]
+        log.info('{:s} p50 latency vs baseline: {:s}'.format(config_key, ', '.join(
+            '{:s} {:.3f}x'.format(name, ratio) for name, ratio in zip(STAGE_NAMES, ratios))))
+
+
+def benchmark_lanenet(net_flags, weights_paths, batch_sizes, threads, resolutions, source='synthetic',
+                      image_dir=None, iterations=20, warmup_iterations=3, headless=True, use_gpu=True, seed=1234):
+    """
+
+    :param net_flags:
+    :param weights_paths: dict of the weights path of every net flag, None for random weights
+    :param batch_sizes:
+    :param threads:
+    :param resolutions:
+    :param source: synthetic or tusimple
+    :param image_dir:
+    :param iterations:
+    :param warmup_iterations:
+    :param headless:
+    :param use_gpu:
+    :param seed:
+    :return: the run metadata and the stage results of every config
+    """
+    if source == 'synthetic':
+        source_images = _get_synthetic_images(max(batch_sizes), seed)
+    elif source == 'tusimple':
+        source_images = _get_tusimple_images(image_dir, max(batch_sizes))
+    else:
+        raise ValueError('Wrong source: {}, now only support synthetic and tusimple'.format(source))
+
+    meta = collections.OrderedDict()
+    meta['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    meta['platform'] = platform.platform()
+    meta['python'] = platform.python_version()
+    meta['tensorflow'] = tf.__version__
+    meta['cpu_count'] = multiprocessing.cpu_count()
+    meta['use_gpu'] = use_gpu
+    meta['source'] = source
+    meta['headless'] = headless
+    meta['iterations'] = iterations
+    meta['warmup_iterations'] = warmup_iterations
+    meta['weights_paths'] = {net_flag: weights_paths.get(net_flag) for net_flag in net_flags}
+
+    results = []
+    for net_flag, thread_nums in itertools.product(net_flags, threads):
+        predictor = lanenet_predictor.load_predictor(
+            weights_path=weights_paths.get(net_flag),
+            net_flag=net_flag,
+            use_gpu=use_gpu,
+            warmup_batch_size=0,
+            num_threads=thread_nums if thread_nums > 0 else None
+        )
+        try:
+            for resolution in resolutions:
+                images = [cv2.resize(image, _parse_resolution(resolution), interpolation=cv2.INTER_LINEAR)
+                          for image in source_images]
+                for batch_size in batch_sizes:
+                    config = collections.OrderedDict(
+                        [('net_flag', net_flag), ('batch_size', batch_size), ('threads', thread_nums),
+                         ('resolution', resolution)])
+                    stages = benchmark_config(predictor, images, batch_size, iterations, warmup_iterations, headless)
+                    results.append(collections.OrderedDict([('config', config), ('stages', stages)]))
+                    log.info('{:s}: {:s}'.format(_get_config_key(config), ', '.join(
+                        '{:s} p50 {:.2f}ms {:.1f} img/s'.format(name, stages[name]['p50_ms'],
+                                                                stages[name]['images_per_sec'])
+                        for name in STAGE_NAMES)))
+        finally:
+            predictor.close()
+
+    return collections.OrderedDict([('meta', meta), ('results', results)])
+
+
+if __name__ == '__main__':
+    """
+    benchmark lanenet
+    """
+    args = init_args()
+
+    benchmark_results = benchmark_lanenet(
+        net_flags=args.net_flags,
+        weights_paths={'vgg': args.vgg_weights_path, 'mobilenet_v2': args.mobilenet_v2_weights_path},
+        batch_sizes=args.batch_sizes,
+        threads=args.threads,
+        resolutions=args.resolutions,
+        source=args.source,
+        image_dir=args.image_dir,
+        iterations=args.iterations,
+        warmup_iterations=args.warmup_iterations,
+        headless=bool(args.headless),
+        use_gpu=bool(args.use_gpu),
+        seed=args.seed
+    )
+    if args.compare_path is not None:
+        with open(args.compare_path, 'r') as file:
+            compare_results(benchmark_results, json.load(file))
+    if args.output_path is not None:
+        with open(args.output_path, 'w') as file:
+            json.dump(benchmark_results, file, indent=4)
+        log.info('Benchmark results saved to {:s}'.format(args.output_path))
+    else:
+        print(json.dumps(benchmark_results, indent=4))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : benchmark_postprocess.py
+# @IDE: PyCharm
+"""
+Replay saved lanenet outputs through the postprocessor under every cluster and fit mode, time every stage and
+check the lanes against a golden reference. Needs no tensorflow, model or gpu, so a postprocess optimization
+can be shown both faster and equivalent
+"""
+import argparse
+import collections
+import itertools
+import json
+import os.path as ops
+import sys
+import time
+sys.path.append('./')
+
+import glog as log
+import numpy as np
+
+from lanenet_model import lanenet_postprocess
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seg_result_path', type=str, default='./seg_iamge.npz',
+                        help='The npz of the saved binary_seg_image and instance_seg_image net outputs')
+    parser.add_argument('--ipm_remap_file_path', type=str, default='./data/tusimple_ipm_remap.yml',
+                        help='The ipm generate file path')
+    parser.add_argument('--data_source', type=str, default='tusimple', help='The camera profile of the outputs')
+    parser.add_argument('--cluster_methods', type=str, nargs='+', default=['dbscan', 'meanshift', 'voxel_grid'],
+                        help='The cluster methods to replay')
+    parser.add_argument('--cluster_modes', type=str, nargs='+', default=['pixel', 'component', 'subsample'],
+                        help='The cluster modes to replay')
+    parser.add_argument('--fit_methods', type=str, nargs='+', default=['least_squares', 'ransac'],
+                        help='The fit methods to replay')
+    parser.add_argument('--iterations', type=int, default=10, help='The timed postprocess nums of every mode')
+    parser.add_argument('--warmup_iterations', type=int, default=2,
+                        help='The untimed postprocess nums run before the timed ones of every mode')
+    parser.add_argument('--golden_path', type=str, default=None,
+                        help='The golden lanes json to check the lanes of every mode against')
+    parser.add_argument('--save_golden', action='store_true',
+                        help='Save the lanes of every mode to --golden_path instead of checking them')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='The max source image x difference in pixels of a lane sample from the golden one')
+    parser.add_argument('--output_path', type=str, default=None, help='The json result path, default stdout')
+
+    return parser.parse_args()
+
+
+def _get_mode_key(cluster_method, cluster_mode, fit_method):
+    """
+
+    :param cluster_method:
+    :param cluster_mode:
+    :param fit_method:
+    :return:
+    """
+    return '{:s}/{:s}/{:s}'.format(cluster_method, cluster_mode, fit_method)
+
+
+def _sort_lanes(lane_xs):
+    """
+    sort the lanes from left to right by their mean sampled x, so the cluster label order does not matter
+    :param lane_xs: [lane_nums, h_sample_nums] sampled lane x, -2 for no sample
+    :return:
+    """
+    lane_xs = np.array(lane_xs, dtype=np.float64)
+    valid = lane_xs != -2
+    mean_xs = [np.mean(xs[mask]) if np.any(mask) else np.inf for xs, mask in zip(lane_xs, valid)]
+
+    return lane_xs[np.argsort(mean_xs, kind='stable')]
+
+
+def get_lanes(postprocess_ret):
+    """
+
+    :param postprocess_ret: headless postprocess result
+    :return: the lanes as json serializable lists
+    """
+    if postprocess_ret['lane_xs'] is None:
+        return {'h_samples': [], 'lane_xs': []}
+
+    return {
+        'h_samples': np.asarray(postprocess_ret['h_samples']).tolist(),
+        'lane_xs': _sort_lanes(postprocess_ret['lane_xs']).tolist()
+    }
+
+
+def compare_lanes(lanes, golden_lanes, tolerance):
+    """
+
+    :param lanes:
+    :param golden_lanes:
+    :param tolerance: max sampled x difference in pixels
+    :return: None if the lanes match, else the reason they do not
+    """
+    if len(lanes['lane_xs']) != len(golden_lanes['lane_xs']):
+        return 'lane nums {:d} != golden {:d}'.format(len(lanes['lane_xs']), len(golden_lanes['lane_xs']))
+    if not lanes['lane_xs']:
+        return None
+    if lanes['h_samples'] != golden_lanes['h_samples']:
+        return 'h samples differ from the golden ones'
+
+    lane_xs = np.array(lanes['lane_xs'], dtype=np.float64)
+    golden_lane_xs = np.array(golden_lanes['lane_xs'], dtype=np.float64)
+    valid = lane_xs != -2
+    golden_valid = golden_lane_xs != -2
+    if np.any(valid != golden_valid):
+        return '{:d} samples differ in presence from the golden ones'.format(int(np.sum(valid != golden_valid)))
+    max_diff = float(np.max(np.abs(lane_xs[valid] - golden_lane_xs[valid]), initial=0.0))
+    if max_diff > tolerance:
+        return 'max sampled x difference {:.3f} > tolerance {:.3f}'.format(max_diff, tolerance)
+
+    return None
+
+
+def benchmark_mode(postprocessor, binary_seg_image, instance_seg_image, data_source, iterations,
+                   warmup_iterations):
+    """
+
+    :param postprocessor:
+    :param binary_seg_image:
+    :param instance_seg_image:
+    :param data_source:
+    :param iterations:
+    :param warmup_iterations:
+    :return: the stage timing summary in milliseconds and the lanes of the last postprocess
+    """
+    collector = lanenet_postprocess.PostprocessTimingCollector()
+    totals = []
+    postprocess_ret = None
+    for iteration in range(warmup_iterations + iterations):
+        t_start = time.perf_counter()
+        postprocess_ret = postprocessor.postprocess(
+            binary_seg_result=binary_seg_image,
+            instance_seg_result=instance_seg_image,
+            data_source=data_source,
+            headless=True,
+            with_timings=True
+        )
+        t_cost = time.perf_counter() - t_start
+        if iteration >= warmup_iterations:
+            collector.add(postprocess_ret.get('timings'))
+            totals.append(t_cost)
+
+    stages = collections.OrderedDict()
+    for stage_name, stage_summary in collector.summary().items():
+        stages[stage_name] = collections.OrderedDict(
+            [(key if key == 'count' else '{:s}_ms'.format(key), value if key == 'count' else value * 1000.0)
+             for key, value in stage_summary.items()])
+    totals = np.array(totals, dtype=np.float64) * 1000.0
+    stages['total'] = collections.OrderedDict([('count', int(totals.size)), ('mean_ms', float(np.mean(totals)))])
+    for percentile in (50, 95, 99):
+        stages['total']['p{:d}_ms'.format(percentile)] = float(np.percentile(totals, percentile))
+
+    return stages, get_lanes(postprocess_ret)
+
+
+def benchmark_postprocess(seg_result_path, ipm_remap_file_path, cluster_methods, cluster_modes, fit_methods,
+                          data_source='tusimple', iterations=10, warmup_iterations=2, golden_lanes=None,
+                          tolerance=2.0):
+    """
+
+    :param seg_result_path:
+    :param ipm_remap_file_path:
+    :param cluster_methods:
+    :param cluster_modes:
+    :param fit_methods:
+    :param data_source:
+    :param iterations:
+    :param warmup_iterations:
+    :param golden_lanes: golden lanes of every mode, None to skip the check
+    :param tolerance:
+    :return: the results of every mode and the lanes of every mode
+    """
+    assert ops.exists(seg_result_path), '{:s} not exist'.format(seg_result_path)
+    seg_results = np.load(seg_result_path)
+    binary_seg_image = seg_results['binary_seg_image'][0]
+    instance_seg_image = seg_results['instance_seg_image'][0]
+
+    results = collections.OrderedDict()
+    lanes = collections.OrderedDict()
+    for cluster_method, cluster_mode, fit_method in itertools.product(cluster_methods, cluster_modes, fit_methods):
+        mode_key = _get_mode_key(cluster_method, cluster_mode, fit_method)
+        postprocessor = lanenet_postprocess.LaneNetPostProcessor(
+            ipm_remap_file_path=ipm_remap_file_path,
+            cluster_method=cluster_method,
+            cluster_mode=cluster_mode,
+            fit_method=fit_method
+        )
+        stages, lanes[mode_key] = benchmark_mode(
+            postprocessor, binary_seg_image, instance_seg_image, data_source, iterations, warmup_iterations)
+        postprocessor.close()
+
+        mode_ret = collections.OrderedDict([('lane_nums', len(lanes[mode_key]['lane_xs'])), ('stages', stages)])
+        if golden_lanes is not None:
+            if mode_key not in golden_lanes:
+                mode_ret['golden'] = 'missing'
+                log.warning('{:s}: no golden lanes'.format(mode_key))
+            else:
+                mismatch = compare_lanes(lanes[mode_key], golden_lanes[mode_key], tolerance)
+                mode_ret['golden'] = 'match' if mismatch is None else 'mismatch: {:s}'.format(mismatch)
+        results[mode_key] = mode_ret
+        log.info('{:s}: {:d} lanes, total p50 {:.3f}ms{:s}'.format(
+            mode_key, mode_ret['lane_nums'], stages['total']['p50_ms'],
+            ', golden {:s}'.format(mode_ret['golden']) if 'golden' in mode_ret else ''))
+
+    return results, lanes
+
+
+if __name__ == '__main__':
+    """
+    benchmark and check the postprocess
+    """
+    args = init_args()
+
+    if args.save_golden and args.golden_path is None:
+        raise ValueError('Wrong golden settings, --save_golden needs --golden_path')
+    golden = None
+    if args.golden_path is not None and not args.save_golden:
+        with open(args.golden_path, 'r') as file:
+            golden = json.load(file)
+
+    benchmark_results, benchmark_lanes = benchmark_postprocess(
+        seg_result_path=args.seg_result_path,
+        ipm_remap_file_path=args.ipm_remap_file_path,
+        cluster_methods=args.cluster_methods,
+        cluster_modes=args.cluster_modes,
+        fit_methods=args.fit_methods,
+        data_source=args.data_source,
+        iterations=args.iterations,
+        warmup_iterations=args.warmup_iterations,
+        golden_lanes=golden,
+        tolerance=args.tolerance
+    )
+
+    if args.save_golden:
+        with open(args.golden_path, 'w') as file:
+            json.dump(benchmark_lanes, file, indent=4)
+        log.info('Golden lanes of {:d} modes saved to {:s}'.format(len(benchmark_lanes), args.golden_path))
+    if args.output_path is not None:
+        with open(args.output_path, 'w') as file:
+            json.dump(benchmark_results, file, indent=4)
+        log.info('Benchmark results saved to {:s}'.format(args.output_path))
+    else:
+        print(json.dumps(benchmark_results, indent=4))
+
+    mismatch_modes = [mode_key for mode_key, mode_ret in benchmark_results.items()
+                      if mode_ret.get('golden', '').startswith('mismatch')]
+    if mismatch_modes:
+        log.error('Postprocess lanes of {:s} do not match the golden lanes'.format(', '.join(mismatch_modes)))
+        sys.exit(1)
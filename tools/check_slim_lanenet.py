@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : check_slim_lanenet.py
+# @IDE: PyCharm
+"""
+Check the slim lanenet inference graph against the standard inference graph restored from the same weights
+"""
+import argparse
+import os.path as ops
+import shutil
+import sys
+import tempfile
+sys.path.append('./')
+
+import cv2
+import glog as log
+import numpy as np
+import tensorflow as tf
+
+from config import global_config
+from lanenet_model import lanenet
+
+CFG = global_config.cfg
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights_path', type=str, default=None,
+                        help='The model weights path, default check a randomly initialized model with random '
+                             'batch norm statistics')
+    parser.add_argument('--net_flag', type=str, default='mobilenet_v2', help='Backbone Network Tag')
+    parser.add_argument('--image_path', type=str, default='./data/tusimple_test_image/0.jpg',
+                        help='The test image path')
+    parser.add_argument('--mask_tolerance', type=float, default=1e-4,
+                        help='The max ratio of the binary mask pixels allowed to differ')
+    parser.add_argument('--embedding_tolerance', type=float, default=1e-3,
+                        help='The max embedding feats difference allowed relative to the max embedding feats')
+
+    return parser.parse_args()
+
+
+def _load_image(image_path):
+    """
+    load a uint8 BGR image batch, the lanenet normalizes it in graph
+    :param image_path:
+    :return:
+    """
+    if ops.exists(image_path):
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    else:
+        log.warning('{:s} not exist, use a random image instead'.format(image_path))
+        image = np.random.RandomState(0).randint(0, 256, size=[720, 1280, 3]).astype(np.uint8)
+    image = cv2.resize(image, (CFG.TRAIN.IMG_WIDTH, CFG.TRAIN.IMG_HEIGHT), interpolation=cv2.INTER_LINEAR)
+
+    return np.array([image], dtype=np.uint8)
+
+
+def _run_lanenet(image, weights_path, net_flag, slim, save_path=None):
+    """
+    build the lanenet inference graph, restore the weights and run it on the image. If weights_path is None
+    the weights are randomly initialized, the batch norm statistics randomized and saved to save_path
+    :param image:
+    :param weights_path:
+    :param net_flag:
+    :param slim:
+    :param save_path:
+    :return:
+    """
+    with tf.Graph().as_default():
+        input_tensor = tf.placeholder(dtype=tf.uint8, shape=[1, 256, 512, 3], name='input_tensor')
+        net = lanenet.LaneNet(phase='test', net_flag=net_flag, slim=slim)
+        binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
+        saver = tf.train.Saver()
+
+        with tf.Session() as sess:
+            if weights_path is not None:
+                saver.restore(sess=sess, save_path=weights_path)
+            else:
+                sess.run(tf.global_variables_initializer())
+                random_state = np.random.RandomState(1234)
+                for var in tf.global_variables():
+                    var_name = var.op.name.split('/')[-1]
+                    var_shape = var.get_shape().as_list()
+                    if var_name in ('gamma', 'moving_variance'):
+                        var.load(random_state.uniform(0.5, 1.5, size=var_shape), session=sess)
+                    elif var_name in ('beta', 'moving_mean'):
+                        var.load(random_state.uniform(-0.5, 0.5, size=var_shape), session=sess)
+                saver.save(sess=sess, save_path=save_path)
+
+            binary_seg_image, instance_seg_image = sess.run(
+                [binary_seg_ret, instance_seg_ret], feed_dict={input_tensor: image})
+
+    return binary_seg_image, instance_seg_image
+
+
+def check_slim_lanenet(weights_path, net_flag, image_path, mask_tolerance, embedding_tolerance):
+    """
+
+    :param weights_path:
+    :param net_flag:
+    :param image_path:
+    :param mask_tolerance:
+    :param embedding_tolerance:
+    :return: True if the slim graph matches the standard graph
+    """
+    image = _load_image(image_path)
+
+    tmp_dir = tempfile.mkdtemp(prefix='check_slim_lanenet_')
+    try:
+        save_path = None
+        if weights_path is None:
+            save_path = ops.join(tmp_dir, 'random_lanenet.ckpt')
+        binary_seg_image, instance_seg_image = _run_lanenet(
+            image, weights_path, net_flag, slim=False, save_path=save_path)
+        slim_binary_seg_image, slim_instance_seg_image = _run_lanenet(
+            image, weights_path if weights_path is not None else save_path, net_flag, slim=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    mask_diff_ratio = np.mean(binary_seg_image != slim_binary_seg_image)
+    embedding_diff = np.max(np.abs(instance_seg_image - slim_instance_seg_image)) / \
+        max(np.max(np.abs(instance_seg_image)), 1e-12)
+    log.info('Slim binary mask dtype: {}, differing pixel ratio: {:.6f}'.format(
+        slim_binary_seg_image.dtype, mask_diff_ratio))
+    log.info('Slim max embedding feats difference relative to the max embedding feats: {:.6f}'.format(
+        embedding_diff))
+
+    return mask_diff_ratio <= mask_tolerance and embedding_diff <= embedding_tolerance
+
+
+if __name__ == '__main__':
+    """
+    check the slim lanenet
+    """
+    args = init_args()
+
+    if not check_slim_lanenet(args.weights_path, args.net_flag, args.image_path,
+                              args.mask_tolerance, args.embedding_tolerance):
+        log.error('Slim lanenet does not match the standard lanenet')
+        sys.exit(1)
+    log.info('Slim lanenet matches the standard lanenet')
@@ -17,14 +17,13 @@ import math
 import sys
 sys.path.append('./')
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-import tensorflow as tf
 import glog as log
-import numpy as np
 import cv2
 
-from lanenet_model import lanenet
+from lanenet_model import lanenet_predictor
 from data_provider import lanenet_data_processor
 from config import global_config
+from tools import evaluate_model_utils
 
 CFG = global_config.cfg
 
@@ -47,11 +46,13 @@ def init_args():
     parser.add_argument('--use_gpu', type=int, help='If use gpu set 1 or 0 instead', default=0)
     parser.add_argument('--net_flag', type=str, default='mobilenet_v2', # vgg mobilenet_v2
                         help='Backbone Network Tag')
+    parser.add_argument('--save_dir', type=str, default=None,
+                        help='The binary segmentation image save dir, the images are not saved if not given')
 
     return parser.parse_args()
 
 
-def test_lanenet_batch(image_list, weights_path, batch_size, use_gpu, net_flag='vgg'):
+def test_lanenet_batch(image_list, weights_path, batch_size, use_gpu, net_flag='vgg', save_dir=None):
     """
 
     :param image_list:
@@ -59,6 +60,7 @@ def test_lanenet_batch(image_list, weights_path, batch_size, use_gpu, net_flag='
     :param batch_size:
     :param use_gpu:
     :param net_flag:
+    :param save_dir: save the binary segmentation images under their label path in save_dir if given
     :return:
     """
     assert ops.exists(image_list), '{:s} not exist'.format(image_list)
@@ -74,72 +76,44 @@ def test_lanenet_batch(image_list, weights_path, batch_size, use_gpu, net_flag='
             gt_label_binary_list.append(info_tmp[1])
     # ==============================
 
-    input_tensor = tf.placeholder(dtype=tf.float32, shape=[None, 256, 512, 3], name='input_tensor')
-    binary_label_tensor = tf.placeholder(dtype=tf.int64,
-                                         shape=[None, 256, 512, 1], name='binary_input_label')
-    phase_tensor = tf.constant('test', tf.string)
-    net = lanenet.LaneNet(phase=phase_tensor, net_flag=net_flag)
-    binary_seg_ret, instance_seg_ret, recall_ret, false_positive, false_negative, precision_ret, accuracy_ret = \
-        net.compute_acc(input_tensor=input_tensor, binary_label_tensor=binary_label_tensor, name='lanenet_model')
-
-    saver = tf.train.Saver()
-    # ==============================
-    # Set sess configuration
-    if use_gpu:
-        sess_config = tf.ConfigProto(device_count={'GPU': 1})
-    else:
-        sess_config = tf.ConfigProto(device_count={'GPU': 0})
-    sess_config.gpu_options.per_process_gpu_memory_fraction = CFG.TEST.GPU_MEMORY_FRACTION
-    sess_config.gpu_options.allow_growth = CFG.TRAIN.TF_ALLOW_GROWTH
-    sess_config.gpu_options.allocator_type = 'BFC'
-    # ==============================
-    sess = tf.Session(config=sess_config)
-
-    with sess.as_default():
-        saver.restore(sess=sess, save_path=weights_path)
-        epoch_nums = int(math.ceil(test_dataset._dataset_size / batch_size))
-        mean_accuracy = 0.0
-        mean_recall = 0.0
-        mean_precision = 0.0
-        mean_fp = 0.0
-        mean_fn = 0.0
-        total_num = 0
-        t_start = time.time()
-        for epoch in range(epoch_nums):
-            gt_imgs, binary_gt_labels, instance_gt_labels = test_dataset.next_batch(batch_size)
-            if net_flag == 'vgg':
-                image_list_epoch = [tmp / 127.5 - 1.0 for tmp in gt_imgs]
-            elif net_flag == 'mobilenet_v2':
-                image_list_epoch = [tmp - [103.939, 116.779, 123.68] for tmp in gt_imgs]
-
-            binary_seg_images, instance_seg_images, recall, fp, fn, precision, accuracy = sess.run(
-                [binary_seg_ret, instance_seg_ret, recall_ret, false_positive, false_negative, precision_ret, accuracy_ret],
-                feed_dict={input_tensor: image_list_epoch, binary_label_tensor: binary_gt_labels})
-            # ==============================
-            out_dir = 'H:/Other_DataSets/TuSimple/out/'
-            dst_binary_image_path = ops.join(out_dir,gt_label_binary_list[epoch])
-            root_dir = ops.dirname(ops.abspath(dst_binary_image_path))
-            if not os.path.exists(root_dir):
-                os.makedirs(root_dir)
-            cv2.imwrite(dst_binary_image_path, binary_seg_images[0] * 255)
-            # ==============================
-            print(recall, fp, fn)
-            mean_accuracy += accuracy
-            mean_precision += precision
-            mean_recall += recall
-            mean_fp += fp
-            mean_fn += fn
-            total_num += len(gt_imgs)
-        t_cost = time.time() - t_start
-        mean_accuracy = mean_accuracy / epoch_nums
-        mean_precision = mean_precision / epoch_nums
-        mean_recall = mean_recall / epoch_nums
-        mean_fp = mean_fp / epoch_nums
-        mean_fn = mean_fn / epoch_nums
-        print('测试 {} 张图片，耗时{}，{}_recall = {}, precision = {}, accuracy = {}, fp = {}, fn = {}, '.format(
-            total_num, t_cost, net_flag, mean_recall, mean_precision, mean_accuracy, mean_fp, mean_fn))
-
-    sess.close()
+    predictor = lanenet_predictor.load_predictor(
+        weights_path=weights_path, net_flag=net_flag, use_gpu=bool(use_gpu))
+
+    epoch_nums = int(math.ceil(test_dataset._dataset_size / batch_size))
+    mean_accuracy = 0.0
+    mean_recall = 0.0
+    mean_precision = 0.0
+    mean_fp = 0.0
+    mean_fn = 0.0
+    total_num = 0
+    t_start = time.time()
+    for epoch in range(epoch_nums):
+        gt_imgs, binary_gt_labels, instance_gt_labels = test_dataset.next_batch(batch_size)
+        binary_seg_images, instance_seg_images = predictor.inference(gt_imgs)
+        recall, fp, fn, precision, accuracy = evaluate_model_utils.calculate_binary_seg_metrics(
+            binary_seg_images, binary_gt_labels)
+        if save_dir is not None:
+            for index, binary_seg_image in enumerate(binary_seg_images):
+                dst_binary_image_path = ops.join(save_dir, gt_label_binary_list[epoch * batch_size + index])
+                os.makedirs(ops.dirname(ops.abspath(dst_binary_image_path)), exist_ok=True)
+                cv2.imwrite(dst_binary_image_path, binary_seg_image * 255)
+        log.info('[Epoch:{:d}] recall: {:.5f} fp: {:.5f} fn: {:.5f}'.format(epoch, recall, fp, fn))
+        mean_accuracy += accuracy
+        mean_precision += precision
+        mean_recall += recall
+        mean_fp += fp
+        mean_fn += fn
+        total_num += len(gt_imgs)
+    t_cost = time.time() - t_start
+    mean_accuracy = mean_accuracy / epoch_nums
+    mean_precision = mean_precision / epoch_nums
+    mean_recall = mean_recall / epoch_nums
+    mean_fp = mean_fp / epoch_nums
+    mean_fn = mean_fn / epoch_nums
+    log.info('测试 {} 张图片，耗时{}，{}_recall = {}, precision = {}, accuracy = {}, fp = {}, fn = {}, '.format(
+        total_num, t_cost, net_flag, mean_recall, mean_precision, mean_accuracy, mean_fp, mean_fn))
+
+    predictor.close()
 
 """
 测试 2782 张图片，耗时529.4126558303833，mobilenet_v2_recall = 0.9335565098483821, precision = 0.9500883211213997, 
@@ -152,7 +126,8 @@ if __name__ == '__main__':
     args = init_args()
 
     test_lanenet_batch(image_list=args.image_list, weights_path=args.weights_path,
-                       use_gpu=args.use_gpu, batch_size=args.batch_size, net_flag=args.net_flag)
+                       use_gpu=args.use_gpu, batch_size=args.batch_size, net_flag=args.net_flag,
+                       save_dir=args.save_dir)
 
 
 
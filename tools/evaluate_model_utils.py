@@ -8,6 +8,7 @@
 """
 Calculate model's fp fn and precision
 """
+import numpy as np
 import tensorflow as tf
 
 
@@ -69,6 +70,32 @@ def calculate_model_fn(input_tensor, label_tensor):
     return tf.divide(mis_pred, tf.cast(tf.shape(label_cls_ret)[0], tf.int64))
 
 
+def calculate_binary_seg_metrics(binary_seg_images, binary_gt_labels):
+    """
+    calculate the binary segmentation metrics of a batch of predictions like LaneNet.compute_acc
+    :param binary_seg_images: [batch, height, width] binary segmentation results
+    :param binary_gt_labels: [batch, height, width, 1] 0/1 binary labels
+    :return: recall, fp, fn, precision, accuracy
+    """
+    pred = np.asarray(binary_seg_images) == 1
+    label = np.reshape(np.asarray(binary_gt_labels), pred.shape) == 1
+
+    # 车道线正检数
+    true_pred = np.count_nonzero(pred & label)
+    pred_nums = np.count_nonzero(pred)
+    label_nums = np.count_nonzero(label)
+    background_nums = label.size - label_nums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = np.float64(true_pred) / label_nums
+        fp = np.float64(pred_nums - true_pred) / pred_nums
+        fn = np.float64(label_nums - true_pred) / label_nums
+        # 背景正检数
+        precision = np.float64(background_nums - np.count_nonzero(pred & ~label)) / background_nums
+        accuracy = 2.0 / (1.0 / recall + 1.0 / precision)
+
+    return recall, fp, fn, precision, accuracy
+
+
 def get_image_summary(img):
     """
     Make an image summary for 4d tensor image with index idx
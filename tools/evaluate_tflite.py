@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : evaluate_tflite.py
+# @IDE: PyCharm
+"""
+Compare the accuracy and the cpu latency of tflite lanenet models with the reference model they were exported
+from on the images of a dataset list
+"""
+import argparse
+import collections
+import json
+import os.path as ops
+import sys
+import time
+sys.path.append('./')
+
+import glog as log
+import numpy as np
+
+from data_provider import lanenet_data_processor
+from lanenet_model import lanenet_predictor
+from tools import evaluate_model_utils
+
+METRIC_NAMES = ('recall', 'fp', 'fn', 'precision', 'accuracy')
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image_list', type=str, default='./data/training_data_example/val.txt',
+                        help='The image list path, the train.txt / val.txt format')
+    parser.add_argument('--weights_path', type=str, required=True,
+                        help='The reference model weights path, a checkpoint or a frozen .pb or SavedModel dir')
+    parser.add_argument('--tflite_model_paths', type=str, nargs='+', required=True,
+                        help='The tflite model paths exported by convert_tflite.py')
+    parser.add_argument('--net_flag', type=str, default='mobilenet_v2', help='Backbone Network Tag')
+    parser.add_argument('--image_nums', type=int, default=200, help='The max evaluated image nums')
+    parser.add_argument('--use_gpu', type=int, default=0, help='If the reference model use gpu set 1 or 0 instead')
+    parser.add_argument('--num_threads', type=int, default=None, help='The tflite interpreter thread nums')
+    parser.add_argument('--report_path', type=str, default=None, help='The json report output path')
+
+    return parser.parse_args()
+
+
+def _load_images(image_list, image_nums):
+    """
+
+    :param image_list:
+    :param image_nums:
+    :return: the images and their binary labels
+    """
+    assert ops.exists(image_list), '{:s} not exist'.format(image_list)
+    dataset = lanenet_data_processor.DataSet(image_list, traing=False)
+    image_nums = min(image_nums, dataset._dataset_size)
+
+    images = []
+    binary_labels = []
+    for _ in range(image_nums):
+        gt_imgs, binary_gt_labels, _ = dataset.next_batch(1)
+        images.append(gt_imgs[0])
+        binary_labels.append(binary_gt_labels[0])
+
+    return images, binary_labels
+
+
+def _evaluate_predictor(predictor, images, binary_labels, reference_binary_seg_images=None):
+    """
+    run the images one by one and average the compute_acc metrics and the latency
+    :param predictor:
+    :param images:
+    :param binary_labels:
+    :param reference_binary_seg_images: the binary masks of the reference model to compute the agreement with
+    :return: the evaluation result and the binary masks
+    """
+    metrics = collections.OrderedDict([(name, []) for name in METRIC_NAMES])
+    latencies = []
+    binary_seg_images = []
+    for image, binary_label in zip(images, binary_labels):
+        image = predictor.preprocess(image)
+        t_start = time.perf_counter()
+        binary_seg_image, _ = predictor.inference([image], preprocessed=True)
+        latencies.append(time.perf_counter() - t_start)
+        binary_seg_images.append(binary_seg_image[0])
+        for name, value in zip(METRIC_NAMES, evaluate_model_utils.calculate_binary_seg_metrics(
+                binary_seg_image, [binary_label])):
+            metrics[name].append(value)
+
+    ret = collections.OrderedDict()
+    for name, values in metrics.items():
+        ret[name] = float(np.nanmean(values))
+    latencies = np.array(latencies, dtype=np.float64) * 1000.0
+    ret['mean_latency_ms'] = float(np.mean(latencies))
+    ret['p50_latency_ms'] = float(np.percentile(latencies, 50))
+    if reference_binary_seg_images is not None:
+        ret['mask_agreement'] = float(np.mean(
+            [np.mean((mask == 1) == (reference_mask == 1))
+             for mask, reference_mask in zip(binary_seg_images, reference_binary_seg_images)]))
+
+    return ret, binary_seg_images
+
+
+def evaluate_tflite(image_list, weights_path, tflite_model_paths, net_flag='mobilenet_v2', image_nums=200,
+                    use_gpu=False, num_threads=None):
+    """
+
+    :param image_list:
+    :param weights_path:
+    :param tflite_model_paths:
+    :param net_flag:
+    :param image_nums:
+    :param use_gpu:
+    :param num_threads:
+    :return: the evaluation result of every model, the reference model first
+    """
+    images, binary_labels = _load_images(image_list, image_nums)
+    log.info('Evaluate on {:d} images of {:s}'.format(len(images), image_list))
+
+    report = collections.OrderedDict()
+    predictor = lanenet_predictor.load_predictor(weights_path=weights_path, net_flag=net_flag, use_gpu=use_gpu)
+    try:
+        report[weights_path], reference_binary_seg_images = _evaluate_predictor(predictor, images, binary_labels)
+    finally:
+        predictor.close()
+
+    for tflite_model_path in tflite_model_paths:
+        predictor = lanenet_predictor.LaneNetTFLitePredictor(
+            tflite_model_path=tflite_model_path, net_flag=net_flag, num_threads=num_threads)
+        try:
+            report[tflite_model_path], _ = _evaluate_predictor(
+                predictor, images, binary_labels, reference_binary_seg_images)
+        finally:
+            predictor.close()
+        report[tflite_model_path]['speedup'] = \
+            report[weights_path]['mean_latency_ms'] / report[tflite_model_path]['mean_latency_ms']
+
+    return report
+
+
+def log_report(report):
+    """
+
+    :param report:
+    :return:
+    """
+    for model_path, model_ret in report.items():
+        log.info('{:s}: {:s}'.format(model_path, ', '.join(
+            '{:s} = {:.5f}'.format(name, value) for name, value in model_ret.items())))
+
+
+if __name__ == '__main__':
+    """
+    compare the tflite models with the reference model
+    """
+    args = init_args()
+
+    evaluate_report = evaluate_tflite(
+        image_list=args.image_list,
+        weights_path=args.weights_path,
+        tflite_model_paths=args.tflite_model_paths,
+        net_flag=args.net_flag,
+        image_nums=args.image_nums,
+        use_gpu=bool(args.use_gpu),
+        num_threads=args.num_threads
+    )
+    log_report(evaluate_report)
+    if args.report_path is not None:
+        with open(args.report_path, 'w') as file:
+            json.dump(evaluate_report, file, indent=4)
+        log.info('Report saved to {:s}'.format(args.report_path))
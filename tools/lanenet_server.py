@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Site    : https://github.com/MaybeShewill-CV/lanenet-lane-detection
+# @File    : lanenet_server.py
+# @IDE: PyCharm
+"""
+Serve lanenet over http with a warm session and dynamic batching
+
+POST /predict with an encoded image as the request body returns the headless lane results as json. The optional
+X-Deadline-Ms header overrides the default request deadline. GET /health and GET /stats report the server state
+"""
+import argparse
+import http.server
+import json
+import socketserver
+import sys
+import time
+sys.path.append('./')
+
+import cv2
+import glog as log
+import numpy as np
+
+from lanenet_model import lanenet_batcher
+from lanenet_model import lanenet_postprocess
+from lanenet_model import lanenet_predictor
+
+
+def init_args():
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights_path', type=str,
+                        help='The model weights path, a checkpoint, a frozen .pb or SavedModel dir exported by '
+                             'convert_pb.py or a .tflite model exported by convert_tflite.py')
+    parser.add_argument('--net_flag', type=str, default='vgg', help='Backbone Network Tag')
+    parser.add_argument('--slim', action='store_true', help='Build the slim inference graph of the checkpoint')
+    parser.add_argument('--use_gpu', type=int, default=1, help='If use gpu set 1 or 0 instead')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='The server host')
+    parser.add_argument('--port', type=int, default=8080, help='The server port')
+    parser.add_argument('--data_source', type=str, default='tusimple', help='The camera profile of the images')
+    parser.add_argument('--max_batch_size', type=int, default=8, help='The max request nums of a batch')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0,
+                        help='The max time to wait for more requests after the first request of a batch')
+    parser.add_argument('--max_queue_size', type=int, default=64,
+                        help='The max pending request nums, more requests are rejected with 503')
+    parser.add_argument('--deadline_ms', type=float, default=1000.0,
+                        help='The default request deadline, requests not answered in time get 504')
+    parser.add_argument('--postprocess_workers', type=int, default=None,
+                        help='The postprocess worker process nums of a batch, default postprocess in the '
+                             'batching thread')
+
+    return parser.parse_args()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Handle every connection in its own thread so the requests reach the batcher concurrently
+    """
+    daemon_threads = True
+
+
+class LaneNetRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Decode and preprocess the posted image in the connection thread, submit it to the batcher and wait for
+    its lanes until the request deadline
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, body, headers=None):
+        """
+
+        :param status:
+        :param body:
+        :param headers:
+        :return:
+        """
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """
+
+        :return:
+        """
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.batcher.get_stats())
+        else:
+            self._send_json(404, {'error': 'Not found: {:s}'.format(self.path)})
+
+    def do_POST(self):
+        """
+
+        :return:
+        """
+        t_start = time.perf_counter()
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Not found: {:s}'.format(self.path)})
+            return
+
+        try:
+            deadline = float(self.headers.get('X-Deadline-Ms', self.server.deadline_ms)) / 1000.0
+        except ValueError:
+            self._send_json(400, {'error': 'Wrong X-Deadline-Ms header, it must be a number'})
+            return
+        image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR) if body else None
+        if image is None:
+            self._send_json(400, {'error': 'Wrong request body, it must be an encoded image'})
+            return
+        image = self.server.predictor.preprocess(image)
+
+        try:
+            request = self.server.batcher.submit(image, timeout=deadline - (time.perf_counter() - t_start))
+            ret = request.result()
+        except lanenet_batcher.BatcherFullError as err:
+            self._send_json(503, {'error': str(err)}, headers={'Retry-After': '1'})
+            return
+        except lanenet_batcher.BatcherStoppedError as err:
+            self._send_json(503, {'error': str(err)})
+            return
+        except lanenet_batcher.DeadlineExceededError as err:
+            self._send_json(504, {'error': str(err)})
+            return
+        except Exception as err:
+            self._send_json(500, {'error': str(err)})
+            return
+
+        ret = lanenet_postprocess.to_json_result(ret)
+        ret['latency_ms'] = 1000.0 * (time.perf_counter() - t_start)
+        self._send_json(200, ret)
+
+    def log_message(self, format, *args):
+        """
+        route the access log to glog debug instead of stderr
+        :param format:
+        :param args:
+        :return:
+        """
+        log.debug('{:s} {:s}'.format(self.address_string(), format % args))
+
+
+def serve_lanenet(weights_path, net_flag='vgg', slim=False, use_gpu=True, host='127.0.0.1', port=8080,
+                  data_source='tusimple', max_batch_size=8, max_wait_ms=5.0, max_queue_size=64,
+                  deadline_ms=1000.0, postprocess_workers=None):
+    """
+    load the model once and serve it until interrupted
+    :param weights_path:
+    :param net_flag:
+    :param slim:
+    :param use_gpu:
+    :param host:
+    :param port:
+    :param data_source:
+    :param max_batch_size:
+    :param max_wait_ms:
+    :param max_queue_size:
+    :param deadline_ms:
+    :param postprocess_workers: postprocess worker process nums of a batch, None to postprocess in the batching
+    thread
+    :return:
+    """
+    predictor = lanenet_predictor.load_predictor(
+        weights_path=weights_path,
+        net_flag=net_flag,
+        slim=slim,
+        use_gpu=use_gpu,
+        postprocessor=lanenet_postprocess.LaneNetPostProcessor(),
+        warmup_batch_size=max_batch_size
+    )
+
+    def _process_batch(images):
+        return predictor.predict_batch(
+            images, headless=True, data_source=data_source, preprocessed=True,
+            workers=0 if postprocess_workers is None else postprocess_workers)
+
+    batcher = lanenet_batcher.DynamicBatcher(
+        process_fn=_process_batch,
+        max_batch_size=max_batch_size,
+        max_wait_time=max_wait_ms / 1000.0,
+        max_queue_size=max_queue_size
+    )
+    batcher.start()
+
+    server = _ThreadingHTTPServer((host, port), LaneNetRequestHandler)
+    server.predictor = predictor
+    server.batcher = batcher
+    server.deadline_ms = deadline_ms
+    log.info('LaneNet server listening on http://{:s}:{:d}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        predictor.close()
+        log.info('LaneNet server stopped, stats: {}'.format(json.dumps(batcher.get_stats())))
+
+
+if __name__ == '__main__':
+    """
+    serve lanenet
+    """
+    args = init_args()
+
+    serve_lanenet(
+        weights_path=args.weights_path,
+        net_flag=args.net_flag,
+        slim=args.slim,
+        use_gpu=bool(args.use_gpu),
+        host=args.host,
+        port=args.port,
+        data_source=args.data_source,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue_size=args.max_queue_size,
+        deadline_ms=args.deadline_ms,
+        postprocess_workers=args.postprocess_workers
+    )
@@ -12,17 +12,13 @@ import argparse
 import glob
 import os
 import os.path as ops
-import time
 
 import cv2
-import glog as log
-import numpy as np
-import tensorflow as tf
 import tqdm
 
 from config import global_config
-from lanenet_model import lanenet
-from lanenet_model import lanenet_postprocess
+from lanenet_model import lanenet_pipeline
+from lanenet_model import lanenet_predictor
 
 CFG = global_config.cfg
 
@@ -38,84 +34,86 @@ def init_args():
                         help='The source tusimple lane test data dir')
     parser.add_argument('--weights_path', type=str,
                         default='./model/tusimple_lanenet_mobilenet_v2_1005/tusimple_lanenet_3600_0.929177263960692.ckpt-3601',
-                        help='The model weights path')
+                        help='The model weights path, a checkpoint or a frozen .pb or SavedModel dir '
+                             'exported by convert_pb.py')
     parser.add_argument('--save_dir', type=str,
                         default='H:/Other_DataSets/TuSimple/out/',
                         help='The test output save root dir')
     parser.add_argument('--net_flag', type=str, default='mobilenet_v2', # vgg mobilenet_v2
                         help='Backbone Network Tag')
+    parser.add_argument('--batch_size', type=int, default=8, help='The inference batch size')
+    parser.add_argument('--decode_workers', type=int, default=4, help='The image read thread nums')
+    parser.add_argument('--postprocess_workers', type=int, default=2,
+                        help='The postprocess and image write thread nums')
 
     return parser.parse_args()
 
 
-def test_lanenet_batch(src_dir, weights_path, save_dir, net_flag):
+def test_lanenet_batch(src_dir, weights_path, save_dir, net_flag, batch_size=8, decode_workers=4,
+                       postprocess_workers=2):
     """
-
+    run the images of a dir through a pipeline which reads, runs and postprocesses different batches at the
+    same time, the images whose result is already saved are skipped
     :param src_dir:
     :param weights_path:
     :param save_dir:
+    :param net_flag:
+    :param batch_size:
+    :param decode_workers:
+    :param postprocess_workers:
     :return:
     """
     assert ops.exists(src_dir), '{:s} not exist'.format(src_dir)
 
     os.makedirs(save_dir, exist_ok=True)
 
-    input_tensor = tf.placeholder(dtype=tf.float32, shape=[1, 256, 512, 3], name='input_tensor')
-
-    net = lanenet.LaneNet(phase='test', net_flag=net_flag)
-    binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
-
-    postprocessor = lanenet_postprocess.LaneNetPostProcessor()
-
-    saver = tf.train.Saver()
-
-    # Set sess configuration
-    sess_config = tf.ConfigProto()
-    sess_config.gpu_options.per_process_gpu_memory_fraction = CFG.TEST.GPU_MEMORY_FRACTION
-    sess_config.gpu_options.allow_growth = CFG.TRAIN.TF_ALLOW_GROWTH
-    sess_config.gpu_options.allocator_type = 'BFC'
+    predictor = lanenet_predictor.LaneNetPredictor(weights_path=weights_path, net_flag=net_flag)
 
-    sess = tf.Session(config=sess_config)
+    image_list = glob.glob('{:s}/**/*.jpg'.format(src_dir), recursive=True)
+    progress_bar = tqdm.tqdm(total=len(image_list))
 
-    with sess.as_default():
-
-        saver.restore(sess=sess, save_path=weights_path)
-
-        image_list = glob.glob('{:s}/**/*.jpg'.format(src_dir), recursive=True)
-        avg_time_cost = []
-        for index, image_path in tqdm.tqdm(enumerate(image_list), total=len(image_list)):
+    def _get_output_image_path(image_path):
+        input_image_dir = ops.split(image_path.split('clips')[1])[0][1:]
+        input_image_name = ops.split(image_path)[1]
+        return ops.join(save_dir, input_image_dir, input_image_name)
 
+    def _decode_image(image_path):
+        image = None
+        if not ops.exists(_get_output_image_path(image_path)):
             image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-            image_vis = image
-            image = cv2.resize(image, (512, 256), interpolation=cv2.INTER_LINEAR)
-            image = image / 127.5 - 1.0
-
-            t_start = time.time()
-            binary_seg_image, instance_seg_image = sess.run(
-                [binary_seg_ret, instance_seg_ret],
-                feed_dict={input_tensor: [image]}
-            )
-            avg_time_cost.append(time.time() - t_start)
-
-            postprocess_result = postprocessor.postprocess(
-                binary_seg_result=binary_seg_image[0],
-                instance_seg_result=instance_seg_image[0],
-                source_image=image_vis
-            )
-
-            if index % 100 == 0:
-                log.info('Mean inference time every single image: {:.5f}s'.format(np.mean(avg_time_cost)))
-                avg_time_cost.clear()
-
-            input_image_dir = ops.split(image_path.split('clips')[1])[0][1:]
-            input_image_name = ops.split(image_path)[1]
-            output_image_dir = ops.join(save_dir, input_image_dir)
-            os.makedirs(output_image_dir, exist_ok=True)
-            output_image_path = ops.join(output_image_dir, input_image_name)
-            if ops.exists(output_image_path):
-                continue
-
-            cv2.imwrite(output_image_path, postprocess_result['source_image'])
+        if image is None:
+            progress_bar.update(1)
+            return None
+        return image, predictor.preprocess(image)
+
+    def _inference_batch(decoded_images):
+        return predictor.inference([tmp[1] for tmp in decoded_images], sparse=True, preprocessed=True)
+
+    def _postprocess_batch(image_paths, decoded_images, sparse_seg_images):
+        postprocess_results = predictor.postprocessor.postprocess_batch(
+            binary_seg_results=sparse_seg_images,
+            source_images=[tmp[0] for tmp in decoded_images]
+        )
+        for image_path, postprocess_result in zip(image_paths, postprocess_results):
+            output_image_path = _get_output_image_path(image_path)
+            os.makedirs(ops.split(output_image_path)[0], exist_ok=True)
+            if postprocess_result['source_image'] is not None:
+                cv2.imwrite(output_image_path, postprocess_result['source_image'])
+        progress_bar.update(len(image_paths))
+
+    pipeline = lanenet_pipeline.LaneNetPipeline(
+        decode_fn=_decode_image,
+        inference_fn=_inference_batch,
+        postprocess_fn=_postprocess_batch,
+        batch_size=batch_size,
+        decode_workers=decode_workers,
+        postprocess_workers=postprocess_workers
+    )
+    pipeline_stats = pipeline.run(image_list)
+    progress_bar.close()
+    lanenet_pipeline.log_pipeline_stats(pipeline_stats)
+
+    predictor.close()
 
     return
 
@@ -131,5 +129,8 @@ if __name__ == '__main__':
         src_dir=args.image_dir,
         weights_path=args.weights_path,
         save_dir=args.save_dir,
-        net_flag = args.net_flag
+        net_flag = args.net_flag,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+        postprocess_workers=args.postprocess_workers
     )
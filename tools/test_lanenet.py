@@ -10,6 +10,8 @@ test LaneNet model on single image
 """
 import argparse
 import os.path as ops
+import queue
+import threading
 import time
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
@@ -18,16 +20,15 @@ sys.path.append('./')
 
 import cv2
 import glob
-import math
 import glog as log
 import matplotlib.pyplot as plt
 # plt.switch_backend('agg')
 import numpy as np
-import tensorflow as tf
 
 from config import global_config
-from lanenet_model import lanenet
+from lanenet_model import lanenet_pipeline
 from lanenet_model import lanenet_postprocess
+from lanenet_model import lanenet_predictor
 
 CFG = global_config.cfg
 
@@ -42,11 +43,13 @@ def init_args():
     parser.add_argument('--weights_path', type=str,
                         default='./model/tusimple_lanenet_mobilenet_v2_1005/tusimple_lanenet_3600_0.929177263960692.ckpt-3601',
                         # default='./model/tusimple_lanenet_vgg/tusimple_lanenet_vgg_changename.ckpt',
-                        help='The model weights path')
+                        help='The model weights path, a checkpoint or a frozen .pb or SavedModel dir '
+                             'exported by convert_pb.py')
     parser.add_argument('--net_flag', type=str, default='mobilenet_v2', # vgg mobilenet_v2
                         help='Backbone Network Tag')
     parser.add_argument('--batch_size', type=int, help='The batch size of the test images', default=1)
-    parser.add_argument('--save_dir', type=str, help='Test result image save dir', default='out')
+    parser.add_argument('--save_dir', type=str, default='out',
+                        help='Test result image save dir, the results are shown one by one instead if empty')
     parser.add_argument('--use_gpu', type=bool, help='if use GPU', default=True)
 
     return parser.parse_args()
@@ -81,6 +84,35 @@ def minmax_scale(input_arr):
     return output_arr
 
 
+def show_result(source_image, mask_image, instance_seg_image, binary_seg_image, pause_time=3.0):
+    """
+    show the postprocess result of an image for pause_time seconds
+    :param source_image:
+    :param mask_image:
+    :param instance_seg_image:
+    :param binary_seg_image:
+    :param pause_time:
+    :return:
+    """
+    embedding_image = np.zeros(shape=instance_seg_image.shape, dtype=np.float32)
+    for i in range(CFG.TRAIN.EMBEDDING_FEATS_DIMS):
+        embedding_image[:, :, i] = minmax_scale(instance_seg_image[:, :, i])
+    embedding_image = np.array(embedding_image, np.uint8)
+
+    plt.ion()
+    plt.figure('mask_image')
+    plt.imshow(mask_image[:, :, (2, 1, 0)])
+    plt.figure('src_image')
+    plt.imshow(source_image[:, :, (2, 1, 0)])
+    plt.figure('instance_image')
+    plt.imshow(embedding_image[:, :, (2, 1, 0)])
+    plt.figure('binary_image')
+    plt.imshow(binary_seg_image * 255, cmap='gray')
+    plt.pause(pause_time)
+    plt.show()
+    plt.ioff()
+
+
 def test_lanenet(image_path, weights_path, net_flag):
     """
 
@@ -91,96 +123,56 @@ def test_lanenet(image_path, weights_path, net_flag):
     """
     assert ops.exists(image_path), '{:s} not exist'.format(image_path)
 
+    predictor = lanenet_predictor.LaneNetPredictor(weights_path=weights_path, net_flag=net_flag)
+
     log.info('Start reading image and preprocessing')
     t_start = time.time()
     image = cv2.imread(image_path, cv2.IMREAD_COLOR)
     image_vis = image
-    # ======================
-    image = cv2.resize(image, (CFG.TRAIN.IMG_WIDTH, CFG.TRAIN.IMG_HEIGHT), interpolation=cv2.INTER_LINEAR) # W521 x H256
-    if net_flag == 'vgg':
-        image = image / 127.5 - 1.0 # 归一化到 -1,1
-    elif net_flag == 'mobilenet_v2':
-        image = image - [103.939, 116.779, 123.68]
-    # ======================
-    # ======================
-    # import struct
-    # image = np.full(shape=[256, 512, 3], fill_value=0.0, dtype=np.float32)
-    # f = open('1.bin', "rb")
-    # for c in range(image.shape[2]):
-    #     for h in range(image.shape[0]):
-    #         for w in range(image.shape[1]):
-    #             data = f.read(1)
-    #             data_temp = struct.unpack("b", data)[0]
-    #             image[h][w][c] = float(data_temp)
-    # f.close()
-    # ======================
     log.info('Image load complete, cost time: {:.5f}s'.format(time.time() - t_start))
 
-    input_tensor = tf.placeholder(dtype=tf.float32, shape=[1, 256, 512, 3], name='input_tensor')
-
-    net = lanenet.LaneNet(net_flag=net_flag, phase='test')
-    binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
-
-    postprocessor = lanenet_postprocess.LaneNetPostProcessor()
-
-    saver = tf.train.Saver()
-
-    # Set sess configuration
-    # ============================== config GPU
-    sess_config = tf.ConfigProto()
-    sess_config.gpu_options.per_process_gpu_memory_fraction = CFG.TEST.GPU_MEMORY_FRACTION
-    sess_config.gpu_options.allow_growth = CFG.TRAIN.TF_ALLOW_GROWTH
-    sess_config.gpu_options.allocator_type = 'BFC' # TensorFlow内存管理bfc算法
-    # ==============================
-    sess = tf.Session(config=sess_config)
-
-    with sess.as_default():
-
-        saver.restore(sess=sess, save_path=weights_path)
-
-        t_start = time.time()
-        binary_seg_image, instance_seg_image = sess.run(
-            [binary_seg_ret, instance_seg_ret],
-            feed_dict={input_tensor: [image]}
-        )
-        # np.savez('PC_seg_iamge',binary_seg_image=binary_seg_image[0],instance_seg_image =instance_seg_image[0])
-        t_cost = time.time() - t_start
-        log.info('Single imgae inference cost time: {:.5f}s'.format(t_cost))
-
-        postprocess_result = postprocessor.postprocess(
-            binary_seg_result=binary_seg_image[0],
-            instance_seg_result=instance_seg_image[0],
-            source_image=image_vis
-        )
-        mask_image = postprocess_result['mask_image']
-
-        for i in range(CFG.TRAIN.EMBEDDING_FEATS_DIMS):
-            instance_seg_image[0][:, :, i] = minmax_scale(instance_seg_image[0][:, :, i])
-        embedding_image = np.array(instance_seg_image[0], np.uint8)
-        print('============================================')
-        plt.figure('mask_image')
-        plt.imshow(mask_image[:, :, (2, 1, 0)])
-        plt.figure('src_image')
-        plt.imshow(image_vis[:, :, (2, 1, 0)])
-        plt.figure('instance_image')
-        plt.imshow(embedding_image[:, :, (2, 1, 0)])
-        plt.figure('binary_image')
-        plt.imshow(binary_seg_image[0] * 255, cmap='gray')
-        plt.show()
-
-        cv2.imwrite('instance_mask_image.png', mask_image)
-        cv2.imwrite('instance_image.png', embedding_image)
-        cv2.imwrite('source_image.png', postprocess_result['source_image'])
-        cv2.imwrite('binary_mask_image.png', binary_seg_image[0] * 255)
-
-    sess.close()
+    t_start = time.time()
+    binary_seg_image, instance_seg_image = predictor.inference([image])
+    # np.savez('PC_seg_iamge',binary_seg_image=binary_seg_image[0],instance_seg_image =instance_seg_image[0])
+    t_cost = time.time() - t_start
+    log.info('Single imgae inference cost time: {:.5f}s'.format(t_cost))
+
+    postprocess_result = predictor.postprocessor.postprocess(
+        binary_seg_result=binary_seg_image[0],
+        instance_seg_result=instance_seg_image[0],
+        source_image=image_vis
+    )
+    mask_image = postprocess_result['mask_image']
+
+    for i in range(CFG.TRAIN.EMBEDDING_FEATS_DIMS):
+        instance_seg_image[0][:, :, i] = minmax_scale(instance_seg_image[0][:, :, i])
+    embedding_image = np.array(instance_seg_image[0], np.uint8)
+    print('============================================')
+    plt.figure('mask_image')
+    plt.imshow(mask_image[:, :, (2, 1, 0)])
+    plt.figure('src_image')
+    plt.imshow(image_vis[:, :, (2, 1, 0)])
+    plt.figure('instance_image')
+    plt.imshow(embedding_image[:, :, (2, 1, 0)])
+    plt.figure('binary_image')
+    plt.imshow(binary_seg_image[0] * 255, cmap='gray')
+    plt.show()
+
+    cv2.imwrite('instance_mask_image.png', mask_image)
+    cv2.imwrite('instance_image.png', embedding_image)
+    cv2.imwrite('source_image.png', postprocess_result['source_image'])
+    cv2.imwrite('binary_mask_image.png', binary_seg_image[0] * 255)
+
+    predictor.close()
 
     return
 
 
 def test_lanenet_batch(image_dir, weights_path, batch_size, use_gpu, save_dir=None, net_flag='vgg'):
     """
-
+    test the images of a dir in a pipeline which reads, runs and postprocesses different batches at the same
+    time, the mask images are saved if save_dir is given, otherwise the results are shown one by one in the
+    main thread while the pipeline runs in the background
     :param image_dir:
     :param weights_path:
     :param batch_size:
@@ -195,97 +187,88 @@ def test_lanenet_batch(image_dir, weights_path, batch_size, use_gpu, save_dir=No
                       glob.glob('{:s}/**/*.png'.format(image_dir), recursive=True) + \
                       glob.glob('{:s}/**/*.jpeg'.format(image_dir), recursive=True)
 
-    input_tensor = tf.placeholder(dtype=tf.float32, shape=[None, 256, 512, 3], name='input_tensor')
-    phase_tensor = tf.constant('test', tf.string)
-
-    net = lanenet.LaneNet(phase=phase_tensor, net_flag=net_flag)
-    binary_seg_ret, instance_seg_ret = net.inference(input_tensor=input_tensor, name='lanenet_model')
-
-    postprocessor = lanenet_postprocess.LaneNetPostProcessor()
-
-    saver = tf.train.Saver()
-
-    # Set sess configuration
-    if use_gpu:
-        sess_config = tf.ConfigProto(device_count={'GPU': 0})
+    predictor = lanenet_predictor.LaneNetPredictor(weights_path=weights_path, net_flag=net_flag, use_gpu=use_gpu)
+    timing_collector = lanenet_postprocess.PostprocessTimingCollector()
+    # matplotlib must run in the main thread, the postprocess threads hand the results to show over
+    show_queue = queue.Queue(maxsize=batch_size) if save_dir is None else None
+
+    def _decode_image(image_path):
+        image_vis = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image_vis is None:
+            log.warning('Failed to read image {:s}, skip it'.format(image_path))
+            return None
+        return image_vis, predictor.preprocess(image_vis)
+
+    def _inference_batch(decoded_images):
+        # the shown instance images need the dense results
+        return predictor.inference([tmp[1] for tmp in decoded_images], sparse=show_queue is None,
+                                   preprocessed=True)
+
+    def _postprocess_batch(image_paths, decoded_images, seg_images):
+        image_vis_list = [tmp[0] for tmp in decoded_images]
+        if isinstance(seg_images, dict):
+            binary_seg_images, instance_seg_images = seg_images, None
+        else:
+            binary_seg_images, instance_seg_images = seg_images
+        postprocess_results = predictor.postprocessor.postprocess_batch(
+            binary_seg_results=binary_seg_images,
+            instance_seg_results=instance_seg_images,
+            source_images=image_vis_list,
+            with_timings=True
+        )
+        for index, postprocess_result in enumerate(postprocess_results):
+            timing_collector.add(postprocess_result['timings'])
+            mask_image = postprocess_result['mask_image']
+            if mask_image is None:
+                continue
+            if show_queue is not None:
+                show_queue.put((image_vis_list[index], mask_image, instance_seg_images[index],
+                                binary_seg_images[index]))
+                continue
+            mask_image = cv2.resize(mask_image, (image_vis_list[index].shape[1],
+                                                 image_vis_list[index].shape[0]),
+                                    interpolation=cv2.INTER_LINEAR)
+            mask_image = cv2.addWeighted(image_vis_list[index], 1.0, mask_image, 1.0, 0)
+            image_name = ops.split(image_paths[index])[1]
+            image_save_path = ops.join(save_dir, image_name)
+            cv2.imwrite(image_save_path, mask_image)
+
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+
+    pipeline = lanenet_pipeline.LaneNetPipeline(
+        decode_fn=_decode_image,
+        inference_fn=_inference_batch,
+        postprocess_fn=_postprocess_batch,
+        batch_size=batch_size
+    )
+    if show_queue is None:
+        pipeline_stats = pipeline.run(image_path_list)
     else:
-        sess_config = tf.ConfigProto(device_count={'CPU': 0})
-    sess_config.gpu_options.per_process_gpu_memory_fraction = CFG.TEST.GPU_MEMORY_FRACTION
-    sess_config.gpu_options.allow_growth = CFG.TRAIN.TF_ALLOW_GROWTH
-    sess_config.gpu_options.allocator_type = 'BFC'
-
-    sess = tf.Session(config=sess_config)
-
-    with sess.as_default():
-
-        saver.restore(sess=sess, save_path=weights_path)
-
-        epoch_nums = int(math.ceil(len(image_path_list) / batch_size))
-
-        for epoch in range(epoch_nums):
-            log.info('[Epoch:{:d}] 开始图像读取和预处理...'.format(epoch))
-            t_start = time.time()
-            image_path_epoch = image_path_list[epoch * batch_size:(epoch + 1) * batch_size]
-            image_list_epoch = [cv2.imread(tmp, cv2.IMREAD_COLOR) for tmp in image_path_epoch]
-            image_vis_list = image_list_epoch
-            image_list_epoch = [cv2.resize(tmp, (512, 256), interpolation=cv2.INTER_LINEAR)
-                                for tmp in image_list_epoch]
-            if net_flag == 'vgg':
-                image_list_epoch = [tmp / 127.5 - 1.0 for tmp in image_list_epoch]
-            elif net_flag == 'mobilenet_v2':
-                image_list_epoch = [tmp - [103.939, 116.779, 123.68] for tmp in image_list_epoch]
-            t_cost = time.time() - t_start
-            log.info('[Epoch:{:d}] 预处理{:d}张图像, 共耗时: {:.5f}s, 平均每张耗时: {:.5f}'.format(
-                epoch, len(image_path_epoch), t_cost, t_cost / len(image_path_epoch)))
-
-            t_start = time.time()
-            binary_seg_images, instance_seg_images = sess.run(
-                [binary_seg_ret, instance_seg_ret], feed_dict={input_tensor: image_list_epoch})
-            t_cost = time.time() - t_start
-            log.info('[Epoch:{:d}] 预测{:d}张图像车道线, 共耗时: {:.5f}s, 平均每张耗时: {:.5f}s'.format(
-                epoch, len(image_path_epoch), t_cost, t_cost / len(image_path_epoch)))
-
-            cluster_time = []
-            for index, binary_seg_image in enumerate(binary_seg_images):
-                t_start = time.time()
-                postprocess_result = postprocessor.postprocess(
-                    binary_seg_result=binary_seg_image,
-                    instance_seg_result=instance_seg_images[index],
-                    source_image=image_vis_list[index]
-                )
-                mask_image = postprocess_result['mask_image']
-                cluster_time.append(time.time() - t_start)
-
-                if save_dir is None:
-                    plt.ion()
-                    plt.figure('mask_image')
-                    plt.imshow(mask_image[:, :, (2, 1, 0)])
-                    plt.figure('src_image')
-                    plt.imshow(image_vis_list[index][:, :, (2, 1, 0)])
-                    plt.figure('instance_image')
-                    for i in range(CFG.TRAIN.EMBEDDING_FEATS_DIMS):
-                        instance_seg_images[index][:, :, i] = minmax_scale(instance_seg_images[index][:, :, i])
-                    embedding_image = np.array(instance_seg_images[index], np.uint8)
-                    plt.imshow(embedding_image[:, :, (2, 1, 0)])
-                    plt.figure('binary_image')
-                    plt.imshow(binary_seg_image * 255, cmap='gray')
-                    plt.pause(3.0)
-                    plt.show()
-                    plt.ioff()
-
-                if save_dir is not None:
-                    mask_image = cv2.resize(mask_image, (image_vis_list[index].shape[1],
-                                                         image_vis_list[index].shape[0]),
-                                            interpolation=cv2.INTER_LINEAR)
-                    mask_image = cv2.addWeighted(image_vis_list[index], 1.0, mask_image, 1.0, 0)
-                    image_name = ops.split(image_path_epoch[index])[1]
-                    image_save_path = ops.join(save_dir, image_name)
-                    cv2.imwrite(image_save_path, mask_image)
-
-            log.info('[Epoch:{:d}] 进行{:d}张图像车道线聚类, 共耗时: {:.5f}s, 平均每张耗时: {:.5f}'.format(
-                epoch, len(image_path_epoch), np.sum(cluster_time), np.mean(cluster_time)))
-
-    sess.close()
+        pipeline_ret = dict()
+
+        def _run_pipeline():
+            try:
+                pipeline_ret['stats'] = pipeline.run(image_path_list)
+            except Exception as err:
+                pipeline_ret['error'] = err
+            finally:
+                show_queue.put(None)
+
+        pipeline_thread = threading.Thread(target=_run_pipeline, daemon=True)
+        pipeline_thread.start()
+        show_item = show_queue.get()
+        while show_item is not None:
+            show_result(*show_item)
+            show_item = show_queue.get()
+        pipeline_thread.join()
+        if 'error' in pipeline_ret:
+            raise pipeline_ret['error']
+        pipeline_stats = pipeline_ret['stats']
+    lanenet_pipeline.log_pipeline_stats(pipeline_stats)
+
+    timing_collector.log_summary()
+    predictor.close()
 
     return
 
@@ -300,4 +283,4 @@ if __name__ == '__main__':
         test_lanenet(args.image_path, args.weights_path, args.net_flag)
     else:
         test_lanenet_batch(args.image_path, args.weights_path,args.batch_size,
-                           args.use_gpu, args.save_dir, args.net_flag)
+                           args.use_gpu, args.save_dir or None, args.net_flag)